@@ -2,12 +2,13 @@
 from __future__ import print_function
 import argparse
 import os
-from cic_dis import cic_overlap
+import cic_agg_overlap
+import cic_grid_tensor
+import cic_progress
 import cPickle as pickle
-import csv
+import numpy as np
+from array import array
 from cic_dis import cic_utils
-import sys
-from collections import defaultdict
 
 
 def main():
@@ -18,7 +19,9 @@ def main():
                         help='Input aggregated overlap csv',
                         required=True)
     parser.add_argument('-o', '--output_ctx_mat_csv',
-                        help='Output path for connectivity matrix csv',
+                        help='Output path for connectivity matrix csv, '
+                        'sparse matrix if it ends with .npz, or memory '
+                        'mapped matrix if .npy',
                         required=True)
     parser.add_argument('-hemi', '--hemisphere_of_interest',
                         help='exclusively include listed hemisphere in output')
@@ -26,6 +29,10 @@ def main():
                         help='List of case:section tuples to exclude from '
                         'ctx mat e.g. -es SW130212-02A:1_09 SW160212-02A:1_10',
                         nargs='+')
+    parser.add_argument('-ot', '--output_grid_tensor',
+                        help='Output path for .npz of inj site x ARA Level x '
+                        'hemisphere x col x row GRID ONLY and OVERLAP '
+                        'tensor, to slice without re-reading aggregate')
     parser.add_argument('-v', '--verbose',
                         help='Print extra information about conversion',
                         action='store_true')
@@ -39,20 +46,39 @@ def main():
     hemisphere_of_interest = args['hemisphere_of_interest']
     check_hemi = hemisphere_of_interest is not None
     exclude_sections = args['exclude_sections']
+    output_grid_tensor = args['output_grid_tensor']
 
-    assert os.path.isfile(input_agg_overlap_csv), "{} not found".\
+    assert os.path.exists(input_agg_overlap_csv), "{} not found".\
         format(input_agg_overlap_csv)
 
     (agg_overlap_csv_header, agg_overlap_rows) = \
-        cic_overlap.read_agg_overlap_csv(input_csv_path=input_agg_overlap_csv)
-
-    cell_lbl_set = frozenset()
-    inj_site_lbl_set = frozenset()
-
-    # for managing extents
-    curr_ara_level = -1
-    # keep track of overlap for each injection site
-    inj_site_overlap_dcts = defaultdict(lambda: defaultdict())
+        cic_agg_overlap.read_agg_overlap_csv(
+            input_csv_path=input_agg_overlap_csv)
+    agg_overlap_records = cic_agg_overlap.agg_overlap_records(
+        header=agg_overlap_csv_header,
+        rows=agg_overlap_rows,
+        col_names=['Atlas Name', 'Atlas Version', 'Grid Size',
+                   'Overlap Format', 'Tracer', 'Slide Number', 'Case Name',
+                   'ARA Level', '(HEMISPHERE:COLUMN:ROW)', 'Injection Site',
+                   'GRID ONLY', 'OVERLAP'],
+        int_col_names=cic_agg_overlap.INT_COL_NAMES + ['Grid Size'])
+
+    # injection sites factorized to codes in order first seen
+    #  { inj_site : code }
+    inj_site_code_dct = {}
+    # per row inj site codes, grid cells, tracer modes and vals of all rows,
+    #  checked and summed into grid tensor once all rows are read, keeps are
+    #  rows in hemi of interest and not in excluded sections
+    inj_site_codes = array('l')
+    retros = array('b')
+    ara_levels = array('l')
+    hemi_bits = array('l')
+    col_nums = array('l')
+    row_nums = array('l')
+    grid_onlys = array('l')
+    overlaps = array('l')
+    keeps = array('b')
+    GRID_SIZE = None
 
     if verbose:
         print("Calculating connectivity matrix from {} agg overlap rows".
@@ -61,28 +87,27 @@ def main():
             print("Excluding {} sections: {}".format(len(exclude_sections),
                                                      exclude_sections))
 
-    for row_idx, row in enumerate(agg_overlap_rows):
+    progress = cic_progress.ProgressReporter(total=len(agg_overlap_rows))
+    for row_idx, row in enumerate(agg_overlap_records):
         # get constant vals, assume
         # Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap Format
         #   Tracer are the same for all rows
         if row_idx == 0:
-            ATLAS_NAME = row[agg_overlap_csv_header.index('Atlas Name')]
-            ATLAS_VERSION = row[agg_overlap_csv_header.index('Atlas Version')]
-            GRID_SIZE = int(row[agg_overlap_csv_header.index('Grid Size')])
-            OVERLAP_FORMAT = row[agg_overlap_csv_header.index(
-                'Overlap Format')]
+            ATLAS_NAME = row.atlas_name
+            ATLAS_VERSION = row.atlas_version
+            GRID_SIZE = row.grid_size
+            OVERLAP_FORMAT = row.overlap_format
 
         # march through rows
         # for assertion
-        atlas_name = row[agg_overlap_csv_header.index('Atlas Name')]
-        atlas_version = row[agg_overlap_csv_header.index('Atlas Version')]
-        grid_size = int(row[agg_overlap_csv_header.index('Grid Size')])
-        overlap_format = row[agg_overlap_csv_header.index(
-            'Overlap Format')]
-        tracer = row[agg_overlap_csv_header.index('Tracer')]
+        atlas_name = row.atlas_name
+        atlas_version = row.atlas_version
+        grid_size = row.grid_size
+        overlap_format = row.overlap_format
+        tracer = row.tracer
         # get section and case in event exclude_sections list provided
-        section = row[agg_overlap_csv_header.index('Slide Number')]
-        case = row[agg_overlap_csv_header.index('Case Name')]
+        section = row.slide_number
+        case = row.case_name
 
         # assert these are always the same
         #   Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap
@@ -99,139 +124,139 @@ def main():
             tracer_type = 'retro'
 
         # moving values
-        ara_level = int(row[agg_overlap_csv_header.index('ARA Level')])
-        hemi_col_row = row[agg_overlap_csv_header.
-                           index('(HEMISPHERE:COLUMN:ROW)')]
+        ara_level = row.ara_level
+        hemi_col_row = row.hemisphere_column_row
         assert len(hemi_col_row.split(':')) == 3, \
             "ERROR: {}, row {}, {} wrong format" \
             .format(input_agg_overlap_csv, row_idx + 1, hemi_col_row)
-        hemi = hemi_col_row.split(':')[0].replace('(', '')
-        col_num = int(hemi_col_row.split(':')[1])
-        row_num = int(hemi_col_row.split(':')[2].replace(')', ''))
-
-        if ara_level != curr_ara_level:
-            curr_ara_level = ara_level
-            # keep record of extents for sanity check
-            max_ext = {'l': {'row': 0, 'col': 0}, 'r': {'row': 0, 'col': 0}}
-            min_ext = {'l': {'row': sys.maxint, 'col': sys.maxint},
-                       'r': {'row': sys.maxint, 'col': sys.maxint}}
-
-        # update extents for sanity check
-        if col_num > max_ext[hemi]['col']:
-            max_ext[hemi]['col'] = col_num
-        if row_num > max_ext[hemi]['row']:
-            max_ext[hemi]['row'] = row_num
-        if col_num < min_ext[hemi]['col']:
-            min_ext[hemi]['col'] = col_num
-        if row_num < min_ext[hemi]['row']:
-            min_ext[hemi]['row'] = row_num
-
-        inj_site = row[agg_overlap_csv_header.index('Injection Site')]
-        grid_only = int(row[agg_overlap_csv_header.index('GRID ONLY')])
-        overlap = int(row[agg_overlap_csv_header.index('OVERLAP')])
-
-        # assert GRID ONLY + OVERLAP == Grid Size**2
-        assert grid_only + overlap == grid_size ** 2 \
-            or col_num == max_ext[hemi]['col'] \
-            or row_num == max_ext[hemi]['row'] \
-            or col_num == min_ext[hemi]['col'] \
-            or row_num == min_ext[hemi]['row'],\
-            'line {}\ncol/min_col/max_col {}/{}/{}\n'\
-            'row/min_row/max_row {}/{}/{}\n'\
-            'grid only {}, overlap {}, grid_size {}'.\
-            format(row_idx + 2,
-                   col_num, min_ext[hemi]['col'], max_ext[hemi]['col'],
-                   row_num, min_ext[hemi]['row'], max_ext[hemi]['row'],
-                   grid_only, overlap, grid_size)
-
-        # only make and add lbl to dct if hemi of interest or not checking hemi
-        if (not check_hemi or hemi == hemisphere_of_interest) and \
-           (not exclude_sections or
-                "{}:{}".format(case, section) not in exclude_sections):
-            # first make (ara_level:hemi:col:row) cell label
-            cell_lbl = "({}:{})".format(ara_level, hemi_col_row.
-                                        replace('(', '').replace(')', ''))
-
-            # TODO change inj_site and other terminology to src vs. dest
-            # build labels and dct lst
-            # if antero
-            if tracer_type == 'antero':
-                # cell labels from all (HEMISPHERE:COLUMN:ROWS) values
-                cell_lbl_set = cell_lbl_set.union(frozenset({cell_lbl}))
-                #   injection site labels from all Injection Site values
-                inj_site_lbl_set = inj_site_lbl_set.union(
-                    frozenset({inj_site}))
-            elif tracer_type == 'retro':
-                # cell labels from all inj_site values
-                cell_lbl_set = cell_lbl_set.union(frozenset({inj_site}))
-                #   injection site labels from all Injection Site values
-                inj_site_lbl_set = inj_site_lbl_set.union(
-                    frozenset({cell_lbl}))
-            else:
-                assert 0, 'Tracer type should either be antro or retro'
-
-            #   populate dcts
-            #     { 'Injection Site' : '...' {cell_lbl1 : (grid_only,overlap),
-            #                                 cell_lbl2 : ...} }
-            if tracer_type == 'antero':
-                inj_site_overlap_dct = \
-                                       inj_site_overlap_dcts[inj_site]
-                overlap_tup = inj_site_overlap_dct.get(cell_lbl, (0, 0))
-                overlap_tup = tuple(
-                    map(lambda x, y: x + y, overlap_tup, (grid_only, overlap)))
-
-                inj_site_overlap_dct[cell_lbl] = overlap_tup
-
-            else:
-                inj_site_overlap_dct = \
-                                       inj_site_overlap_dcts[cell_lbl]
-                overlap_tup = inj_site_overlap_dct.get(inj_site, (0, 0))
-                overlap_tup = tuple(
-                    map(lambda x, y: x + y, overlap_tup, (grid_only, overlap)))
-
-                inj_site_overlap_dct[inj_site] = overlap_tup
-
-        pct_str = "\r{0:0.2f}% complete... ".\
-                  format((float(row_idx)/float(len(agg_overlap_rows)))*100.0)
-        print(pct_str, end='')
-
-    # fill all rows with dct lst, need initial blank for header
-    cell_lbls = [''] + sorted(cell_lbl_set, key=cell_lbl_to_tup)
-    inj_site_lbls = sorted(inj_site_lbl_set)
-    with open(output_ctx_mat_csv, 'wb') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        csvwriter.writerow(cell_lbls)
-        for inj_site_lbl in inj_site_lbls:
-            cols = [inj_site_lbl]
-            for cell_lbl in cell_lbls[1:len(cell_lbls)]:
-                # do get to make sure cell_lbl exists for given injection site
-                overlap_tup = inj_site_overlap_dcts[inj_site_lbl].get(cell_lbl)
-                if overlap_tup is not None and len(overlap_tup) > 0:
-                    assert len(overlap_tup) == 2, \
-                        "overlap tup: {}".format(overlap_tup)
-                    grid_only = overlap_tup[0]
-                    overlap = overlap_tup[1]
-                    cols.append(float(overlap)/float(grid_only + overlap))
-                else:
-                    cols.append('')
-            csvwriter.writerow(cols)  # string technically a sequence
-
-    pct_str = "\r{0:0.2f}% complete... ".format(100)
-    print(pct_str)
+        (hemi, col_num, row_num) = \
+            cic_agg_overlap.parse_hemi_col_row(hemi_col_row)
+
+        # TODO change inj_site and other terminology to src vs. dest
+        # antero rows are inj site x (ara_level:hemi:col:row) cell,
+        #  retro rows are cell x inj site
+        inj_site_codes.append(inj_site_code_dct.setdefault(
+            row.injection_site, len(inj_site_code_dct)))
+        retros.append(tracer_type == 'retro')
+        ara_levels.append(ara_level)
+        hemi_bits.append(cic_agg_overlap.CELL_HEMI_BIT_DCT[hemi])
+        col_nums.append(col_num)
+        row_nums.append(row_num)
+        grid_onlys.append(row.grid_only)
+        overlaps.append(row.overlap)
+        # only keep row if hemi of interest or not checking hemi
+        keeps.append(
+            (not check_hemi or hemi == hemisphere_of_interest) and
+            (not exclude_sections or
+             "{}:{}".format(case, section) not in exclude_sections))
+
+        progress.update(row_idx + 1)
+
+    (ara_level_npa, hemi_bit_npa, col_npa, row_npa, grid_only_npa,
+     overlap_npa) = [np.frombuffer(arr, dtype=np.int_) for arr in (
+         ara_levels, hemi_bits, col_nums, row_nums, grid_onlys, overlaps)]
+    assert_grid_cells_full(ara_level_npa=ara_level_npa,
+                           hemi_bit_npa=hemi_bit_npa,
+                           col_npa=col_npa,
+                           row_npa=row_npa,
+                           grid_only_npa=grid_only_npa,
+                           overlap_npa=overlap_npa,
+                           grid_size=GRID_SIZE)
+
+    inj_site_lbls = [None] * len(inj_site_code_dct)
+    for (inj_site, code) in inj_site_code_dct.iteritems():
+        inj_site_lbls[code] = inj_site
+    keep_npa = np.frombuffer(keeps, dtype=np.int8).astype(bool)
+    inj_site_code_npa = np.frombuffer(inj_site_codes, dtype=np.int_)[keep_npa]
+    retro_npa = np.frombuffer(retros, dtype=np.int8)[keep_npa]
+    (ara_level_npa, hemi_bit_npa, col_npa, row_npa, grid_only_npa,
+     overlap_npa) = [npa[keep_npa] for npa in (
+         ara_level_npa, hemi_bit_npa, col_npa, row_npa, grid_only_npa,
+         overlap_npa)]
+
+    # dense tensor only built when asked for, ctx mat summed over packed cell
+    #  keys of present cells so it isn't bounded by dense memory
+    if output_grid_tensor is not None:
+        grid_tensor = cic_grid_tensor.accumulate_grid_tensor(
+            inj_site_lbls=inj_site_lbls,
+            inj_site_codes=inj_site_code_npa,
+            retros=retro_npa,
+            ara_levels=ara_level_npa,
+            hemi_bits=hemi_bit_npa,
+            col_nums=col_npa,
+            row_nums=row_npa,
+            grid_onlys=grid_only_npa,
+            overlaps=overlap_npa,
+            grid_size=GRID_SIZE)
+        grid_tensor.save(output_grid_tensor)
+
+    cell_keys = cic_agg_overlap.pack_cell_keys(level_npa=ara_level_npa,
+                                               hemi_bit_npa=hemi_bit_npa,
+                                               col_npa=col_npa,
+                                               row_npa=row_npa)
+    grid_ctx_mat = cic_grid_tensor.accumulate_grid_ctx_mat(
+        inj_site_lbls=inj_site_lbls,
+        inj_site_codes=inj_site_code_npa,
+        cell_keys=cell_keys,
+        retros=retro_npa.astype(bool),
+        grid_onlys=grid_only_npa,
+        overlaps=overlap_npa)
+    cic_grid_tensor.write_grid_ctx_mat(ctx_mat_path=output_ctx_mat_csv,
+                                       grid_ctx_mat=grid_ctx_mat)
+
+    progress.done()
 
     output_pickle_path = cic_utils.pickle_path(output_ctx_mat_csv)
     pickle_dct = cic_utils.pickle_dct(args)
     pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
 
 
-def cell_lbl_to_tup(lbl):
-    lst = lbl.replace('(', '').replace(')', '').split(':')
-    # if grid label
-    if len(lst) > 1:
-        return tuple([(x == 'r' or x == 'l') and x or int(x) for x in lst])
-    # else inj site label
-    else:
-        return tuple(lbl)
+# asserts GRID ONLY + OVERLAP == Grid Size**2 of all rows except edge cells,
+#  rows whose col or row is the min or max so far of rows of its hemisphere
+#  since ARA Level last changed, as rows come in order of the aggregate
+def assert_grid_cells_full(ara_level_npa, hemi_bit_npa, col_npa, row_npa,
+                           grid_only_npa, overlap_npa, grid_size):
+    if len(ara_level_npa) == 0:
+        return
+    assert np.all(col_npa >= 0) and np.all(row_npa >= 0), \
+        "grid cols and rows must be >= 0"
+    # extents group of each row, new group each time ARA Level changes
+    level_run_npa = np.concatenate((
+        [0], np.cumsum(ara_level_npa[1:] != ara_level_npa[0:-1])))
+    group_npa = level_run_npa * 2 + hemi_bit_npa
+    (min_col_npa, max_col_npa) = running_extents(col_npa, group_npa)
+    (min_row_npa, max_row_npa) = running_extents(row_npa, group_npa)
+    ok_npa = (grid_only_npa + overlap_npa == grid_size ** 2) | \
+        (col_npa == max_col_npa) | (row_npa == max_row_npa) | \
+        (col_npa == min_col_npa) | (row_npa == min_row_npa)
+    if np.all(ok_npa):
+        return
+    row_idx = np.flatnonzero(~ok_npa)[0]
+    assert 0, 'line {}\ncol/min_col/max_col {}/{}/{}\n'\
+        'row/min_row/max_row {}/{}/{}\n'\
+        'grid only {}, overlap {}, grid_size {}'.\
+        format(row_idx + 2,
+               col_npa[row_idx], min_col_npa[row_idx], max_col_npa[row_idx],
+               row_npa[row_idx], min_row_npa[row_idx], max_row_npa[row_idx],
+               grid_only_npa[row_idx], overlap_npa[row_idx], grid_size)
+
+
+# running min and max of non negative vals within each group, up to and
+#  including each val, in order of vals
+#  returns (min_npa, max_npa)
+def running_extents(val_npa, group_npa):
+    order = np.argsort(group_npa, kind='mergesort')
+    # offset sorted groups past each other so one accumulate runs them all
+    offset = np.int64(val_npa.max()) + 1
+    group_offset_npa = group_npa[order].astype(np.int64) * offset
+    sorted_val_npa = val_npa[order].astype(np.int64)
+    max_npa = np.empty(len(val_npa), dtype=np.int64)
+    max_npa[order] = np.maximum.accumulate(
+        sorted_val_npa + group_offset_npa) - group_offset_npa
+    min_npa = np.empty(len(val_npa), dtype=np.int64)
+    min_npa[order] = offset - 1 - (np.maximum.accumulate(
+        offset - 1 - sorted_val_npa + group_offset_npa) - group_offset_npa)
+    return (min_npa, max_npa)
 
 
 if __name__ == '__main__':
@@ -6,7 +6,14 @@ import glob
 import csv
 import os
 from cic_dis import cic_utils
+import cic_agg_overlap
+import cic_io
+import cic_progress
 import cPickle as pickle
+from multiprocessing import Pool
+from collections import deque
+import hashlib
+import shutil
 
 
 def main():
@@ -28,6 +35,46 @@ def main():
     parser.add_argument('-div', '--only_division_regions',
                         help='Only copies SC division region rows',
                         action='store_true')
+    parser.add_argument('-hemi', '--hemisphere_of_interest',
+                        help='exclusively include listed hemisphere rows')
+    parser.add_argument('-es', '--exclude_sections',
+                        help='List of case:section tuples to exclude from '
+                        'output e.g. -es SW130212-02A:1_09 SW160212-02A:1_10',
+                        nargs='+')
+    parser.add_argument('-lvlr', '--level_range',
+                        help='Only include rows with ARA Level in inclusive '
+                        'range e.g. -lvlr 19 32',
+                        type=int,
+                        nargs=2)
+    parser.add_argument('-eir', '--exclusively_include_rois',
+                        help='A list of ROIS to include... exclusively, '
+                        'matched as by the converters, grid rows kept if any '
+                        'of their REGION(S) is',
+                        nargs='+')
+    parser.add_argument('-ns', '--num_slots',
+                        help='Number of slots to use for parsing overlap csvs',
+                        type=int, default=1)
+    parser.add_argument('-inc', '--incremental',
+                        help='Only parse overlap csvs new or changed since '
+                        'last incremental run, reuse rest of output',
+                        action='store_true')
+    parser.add_argument('-col', '--columnar',
+                        help='Also write memory mappable columnar companion '
+                        'of output, used when reading it if up to date',
+                        action='store_true')
+    parser.add_argument('-cmp', '--compact',
+                        help='Write each overlap csv meta vals once to a '
+                        'files csv next to output, rows only get file id',
+                        action='store_true')
+    parser.add_argument('-part', '--partitioned',
+                        help='Write output as directory of csvs, one per case '
+                        'and ARA Level, plus index.csv',
+                        action='store_true')
+    parser.add_argument('-mop', '--max_open_partitions',
+                        help='Most partition csvs open at once while writing '
+                        'partitioned output, others reopened to append',
+                        type=int,
+                        default=cic_agg_overlap.MAX_OPEN_PARTS)
     parser.add_argument('-v', '--verbose',
                         help='Print extra information about aggregation',
                         action='store_true')
@@ -39,78 +86,493 @@ def main():
     # sort glob for consistency of test results
     overlap_csv_path_lst = sorted(glob.glob(input_overlap_csv_wildcard))
     output_agg_overlap_csv = args['output_agg_overlap_csv']
-    division_regions = args['only_division_regions']
+    # filters applied to each overlap csv row as it's read
+    row_filter_dct = {
+        'division_regions': args['only_division_regions'],
+        'hemisphere_of_interest': args['hemisphere_of_interest'],
+        'exclude_sections': args['exclude_sections'],
+        'level_range': args['level_range'],
+        'exclusively_include_rois': args['exclusively_include_rois']}
+    num_slots = args['num_slots']
+    incremental = args['incremental']
+    columnar = args['columnar']
+    compact = args['compact']
+    partitioned = args['partitioned']
+    verbose = args['verbose']
     # get replacement injection site if it's there
     ris = args['replacement_injection_site']
-    replace_inj_site = ris is not None
 
     replace_csv = args['replace_csv']
+    rep_dict = None
     if replace_csv:
         rep_dict = replacement_csv_to_dict(replace_csv)
     assert len(overlap_csv_path_lst) > 0,\
         "no input csv files matching {}".format(input_overlap_csv_wildcard)
+    # file ids are positions in sorted glob, change when csvs added/removed
+    assert not (compact and incremental), \
+        "compact output can't be built incrementally"
+    assert not (partitioned and (compact or incremental)), \
+        "partitioned output can't be compact or built incrementally"
+    # previous output byte ranges are copied as is, not through compression
+    assert not incremental or \
+        not cic_io.is_compressed(output_agg_overlap_csv), \
+        "compressed output can't be built incrementally"
 
-    # OPEN, READ INPUT CSV
-    all_rows = []
-    for overlap_csv_path in overlap_csv_path_lst:
-        (overlap_csv_meta_dct, overlap_header_lst, overlap_csv_dct_rows) = \
-            cic_overlap.read_overlap_csv_dct_rows(overlap_csv_path)
-
-        #  first check for meta keys that could be missing
-        if 'Connection Lens Version' not in overlap_csv_meta_dct.keys() + \
-           overlap_header_lst:
-            overlap_csv_meta_dct['Connection Lens Version'] = 'None'
-        if 'Seconday Injection Site' not in overlap_csv_meta_dct.keys() + \
-           overlap_header_lst:
-            overlap_csv_meta_dct['Seconday Injection Site'] = 'None'
-        # replace injection site with replacement value specified on cl
-        if replace_inj_site:
-            # overlap_csv_meta_dct['Injection Site'] = ris
-            print("WARNING: not replacing {}".format(ris))
-
-        # if replacement csv provided, use rep_dict to update inj site names
-        if replace_csv:
-
-            cis = overlap_csv_meta_dct['Injection Site'].replace('_5', '').replace('_6a', '')
-            overlap_csv_meta_dct['Injection Site'] = cis
-            case_id = overlap_csv_meta_dct['Case Name']
-            print("WARNING: Replacing {}, with {}".format(ris, overlap_csv_meta_dct['Injection Site']))
-
-            channel = overlap_csv_meta_dct['Channel Number']
-            key = "{}_{}".format(channel, case_id)
-            if key in rep_dict:
-                overlap_csv_meta_dct['Injection Site'] = "{}".format(
-                    rep_dict[key].replace(' ', '_'))
-
-        # if writing first row, then write header
-        if len(all_rows) == 0:
-            meta_dct_keys = sorted(overlap_csv_meta_dct.keys())
-            overlap_dct_keys = sorted(overlap_header_lst)
-            new_header = meta_dct_keys + overlap_dct_keys
-            all_rows.append(new_header)
-        front_cols = []
-        for key in meta_dct_keys:
-            front_cols.append(overlap_csv_meta_dct[key])
-        # for each overlap_csv_dct row
-        #  place vals in same order on each row w/ blank if no value
-        for row in overlap_csv_dct_rows:
-            # Only interested in SC*_div{1,2,3,4} sections
-            if division_regions and "_div" not in row['REGION']:
-                continue
-            overlap_val_row = []
-            for key in overlap_dct_keys:
-                overlap_val_row.append(row.get(key, ''))
-            all_rows.append(front_cols + overlap_val_row)
-
-    with open(output_agg_overlap_csv, 'wb') as csvfile:
+    # if incremental, get previous manifest for reusing output rows
+    #  manifest is only valid if rows were built with the same options
+    manifest_opts_dct = {'row_filter_dct': row_filter_dct,
+                         'rep_dict': rep_dict}
+    prev_manifest_dct = None
+    if incremental:
+        prev_manifest_dct = read_manifest(
+            output_agg_overlap_csv=output_agg_overlap_csv,
+            manifest_opts_dct=manifest_opts_dct)
+    prev_file_dcts = {}
+    if prev_manifest_dct is not None:
+        prev_file_dcts = dict([(file_dct['path'], file_dct) for file_dct in
+                               prev_manifest_dct['files']])
+
+    # check each input csv against previous manifest, reuse if unchanged
+    if incremental:
+        file_dct_lst = [overlap_csv_file_dct(
+            overlap_csv_path=overlap_csv_path,
+            prev_file_dct=prev_file_dcts.get(overlap_csv_path))
+            for overlap_csv_path in overlap_csv_path_lst]
+    else:
+        file_dct_lst = [{'path': overlap_csv_path, 'reuse': False}
+                        for overlap_csv_path in overlap_csv_path_lst]
+
+    # parse csvs that aren't reused, first one included, in parallel if more
+    #  than 1 slot, each csv parsed with its own keys
+    parse_idxs = [file_idx for file_idx, file_dct in enumerate(file_dct_lst)
+                  if not file_dct['reuse']]
+    map_arg_lst = [(file_dct_lst[file_idx]['path'], ris, rep_dict,
+                    row_filter_dct, file_idx if compact else None)
+                   for file_idx in parse_idxs]
+    if num_slots > 1:
+        pool = Pool(num_slots)
+        # results in sorted glob order for consistent output, at most
+        #  num_slots csvs parsed ahead of the one being written
+        map_results = bounded_imap(pool=pool,
+                                   fn=agg_overlap_rows_wrapper,
+                                   arg_lst=map_arg_lst,
+                                   window=num_slots)
+    else:
+        pool = None
+        map_results = (agg_overlap_rows_wrapper(map_arg)
+                       for map_arg in map_arg_lst)
+
+    # first csv keys define header for all rows, taken from its result
+    #  unless reusing previous header, its rows written with the others
+    first_result = None
+    if file_dct_lst[0]['reuse']:
+        header = prev_manifest_dct['header']
+        num_meta_keys = prev_manifest_dct['num_meta_keys']
+    else:
+        first_result = next(map_results)
+        header = first_result[0] + first_result[1]
+        num_meta_keys = len(first_result[0])
+        # if header changed then previous rows can't be reused
+        if prev_manifest_dct is not None and \
+           (header != prev_manifest_dct['header'] or
+                num_meta_keys != prev_manifest_dct['num_meta_keys']):
+            if verbose:
+                print("Header changed, parsing all overlap csvs")
+            for file_dct in file_dct_lst:
+                file_dct['reuse'] = False
+    meta_dct_keys = header[0:num_meta_keys]
+    overlap_dct_keys = header[num_meta_keys:len(header)]
+
+    if verbose:
+        num_reuse = len([x for x in file_dct_lst if x['reuse']])
+        print("Aggregating {} overlap csvs using {} slots".format(
+            len(overlap_csv_path_lst) - num_reuse, num_slots))
+        if incremental:
+            print("Reusing rows of {} unchanged overlap csvs, dropping {} "
+                  "missing".format(num_reuse, len(
+                      frozenset(prev_file_dcts.keys()).difference(
+                          overlap_csv_path_lst))))
+
+    # when incremental write to tmp file, previous output read for reuse
+    if incremental:
+        write_agg_overlap_csv = output_agg_overlap_csv + '.tmp'
+    else:
+        write_agg_overlap_csv = output_agg_overlap_csv
+
+    # OPEN OUTPUT CSV, then WRITE each parsed input csv's rows before taking
+    #  the next, so only a window of input csvs is held in memory
+    # if compact, [file id] + meta vals for each overlap csv
+    file_meta_rows = []
+    if partitioned:
+        # output path is partition directory, rows written to csv of their
+        #  case and level
+        csvfile = None
+        csvwriter = cic_agg_overlap.AggOverlapPartitionWriter(
+            part_dir_path=output_agg_overlap_csv,
+            header=header,
+            max_open_parts=args['max_open_partitions'])
+    else:
+        csvfile = cic_io.open_file(write_agg_overlap_csv, 'wb')
         csvwriter = csv.writer(csvfile)
-        csvwriter.writerows(all_rows)
+        if compact:
+            csvwriter.writerow([cic_agg_overlap.FILE_ID_COL] +
+                               overlap_dct_keys)
+        else:
+            csvwriter.writerow(header)
+
+    prev_csvfile = None
+    if len([x for x in file_dct_lst if x['reuse']]) > 0:
+        prev_csvfile = open(output_agg_overlap_csv, 'rb')
+
+    parse_idx_set = frozenset(parse_idxs)
+    progress = cic_progress.ProgressReporter(total=len(file_dct_lst),
+                                             unit='files')
+    for file_idx, file_dct in enumerate(file_dct_lst):
+        if csvfile is not None:
+            start = csvfile.tell()
+        if file_dct['reuse']:
+            # copy byte range of unchanged csv rows from previous output
+            prev_csvfile.seek(file_dct['start'])
+            copy_bytes(src_file=prev_csvfile,
+                       dst_file=csvfile,
+                       num_bytes=file_dct['end'] - file_dct['start'])
+        else:
+            if file_idx == 0:
+                # not held after it's written
+                (agg_result, first_result) = (first_result, None)
+            elif file_idx in parse_idx_set:
+                agg_result = next(map_results)
+            else:
+                # unchanged but header changed, so parsed again here
+                agg_result = agg_overlap_rows_wrapper(
+                    (file_dct['path'], ris, rep_dict, row_filter_dct,
+                     file_idx if compact else None))
+            (meta_vals, agg_rows) = header_ordered_rows(
+                agg_result=agg_result,
+                meta_dct_keys=meta_dct_keys,
+                overlap_dct_keys=overlap_dct_keys,
+                compact=compact)
+            csvwriter.writerows(agg_rows)
+        if compact:
+            file_meta_rows.append([file_idx] + meta_vals)
+        if csvfile is not None:
+            file_dct['start'] = start
+            file_dct['end'] = csvfile.tell()
+        progress.update(file_idx + 1)
+    progress.done()
+
+    if prev_csvfile is not None:
+        prev_csvfile.close()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if partitioned:
+        part_dct_lst = csvwriter.close()
+        if verbose:
+            print("Wrote {} partitions to {}".format(
+                len(part_dct_lst), output_agg_overlap_csv))
+    else:
+        csvfile.close()
+
+    if incremental:
+        shutil.move(write_agg_overlap_csv, output_agg_overlap_csv)
+        write_manifest(output_agg_overlap_csv=output_agg_overlap_csv,
+                       manifest_opts_dct=manifest_opts_dct,
+                       header=header,
+                       num_meta_keys=num_meta_keys,
+                       file_dct_lst=file_dct_lst)
+
+    if compact:
+        files_csv_path = cic_agg_overlap.compact_files_csv_path(
+            output_agg_overlap_csv)
+        with cic_io.open_file(files_csv_path, 'wb') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow([cic_agg_overlap.FILE_ID_COL] + meta_dct_keys)
+            csvwriter.writerows(file_meta_rows)
+        if verbose:
+            print("Wrote {} overlap csv meta rows to {}".format(
+                len(file_meta_rows), files_csv_path))
+
+    if columnar:
+        if partitioned:
+            agg_overlap_csv_lst = [part_dct['path'] for part_dct in
+                                   part_dct_lst]
+        else:
+            agg_overlap_csv_lst = [output_agg_overlap_csv]
+        for agg_overlap_csv in agg_overlap_csv_lst:
+            col_dir_path = cic_agg_overlap.write_columnar(agg_overlap_csv)
+            if verbose:
+                print("Wrote columnar companion to {}".format(col_dir_path))
 
     output_pickle_path = cic_utils.pickle_path(output_agg_overlap_csv)
     pickle_dct = cic_utils.pickle_dct(args)
     pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
 
 
+# results of fn over arg_lst in order as pool.imap, but at most window tasks
+#  submitted and not yet taken, so parsed rows waiting to be written stay
+#  bounded when writing falls behind the workers
+def bounded_imap(pool, fn, arg_lst, window):
+    pending = deque()
+    for arg in arg_lst:
+        if len(pending) == window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(fn, (arg,)))
+    while len(pending) > 0:
+        yield pending.popleft().get()
+
+
+# reads overlap csv, filling in missing meta keys and replacing injection site
+#  names from rep_dict if provided
+def read_overlap_csv(overlap_csv_path, ris, rep_dict):
+    with cic_io.decompressed_path(overlap_csv_path) as csv_path:
+        (overlap_csv_meta_dct, overlap_header_lst, overlap_csv_dct_rows) = \
+            cic_overlap.read_overlap_csv_dct_rows(csv_path)
+
+    #  first check for meta keys that could be missing
+    if 'Connection Lens Version' not in overlap_csv_meta_dct.keys() + \
+       overlap_header_lst:
+        overlap_csv_meta_dct['Connection Lens Version'] = 'None'
+    if 'Seconday Injection Site' not in overlap_csv_meta_dct.keys() + \
+       overlap_header_lst:
+        overlap_csv_meta_dct['Seconday Injection Site'] = 'None'
+    # replace injection site with replacement value specified on cl
+    if ris is not None:
+        # overlap_csv_meta_dct['Injection Site'] = ris
+        print("WARNING: not replacing {}".format(ris))
+
+    # if replacement csv provided, use rep_dict to update inj site names
+    if rep_dict is not None:
+
+        cis = overlap_csv_meta_dct['Injection Site'].replace('_5', '').\
+            replace('_6a', '')
+        overlap_csv_meta_dct['Injection Site'] = cis
+        case_id = overlap_csv_meta_dct['Case Name']
+        print("WARNING: Replacing {}, with {}".format(
+            ris, overlap_csv_meta_dct['Injection Site']))
+
+        channel = overlap_csv_meta_dct['Channel Number']
+        key = "{}_{}".format(channel, case_id)
+        if key in rep_dict:
+            overlap_csv_meta_dct['Injection Site'] = "{}".format(
+                rep_dict[key].replace(' ', '_'))
+
+    return (overlap_csv_meta_dct, overlap_header_lst, overlap_csv_dct_rows)
+
+
+# yields aggregated rows for one overlap csv, meta vals in front of overlap
+#  vals, each in the same key order as the header w/ blank if no value
+#  if file_id given then it replaces meta vals for compact output
+def agg_overlap_rows(overlap_csv_meta_dct, overlap_csv_dct_rows,
+                     meta_dct_keys, overlap_dct_keys, row_filter_dct,
+                     file_id=None):
+    # -eir decisions cached per ROI for the whole csv
+    eir = row_filter_dct['exclusively_include_rois']
+    eir_matcher = None if not eir else \
+        cic_agg_overlap.RoiIncludeMatcher(include_rois=eir)
+    front_cols = []
+    if file_id is not None:
+        front_cols.append(file_id)
+    else:
+        for key in meta_dct_keys:
+            front_cols.append(overlap_csv_meta_dct[key])
+    # for each overlap_csv_dct row
+    #  place vals in same order on each row w/ blank if no value
+    for row in overlap_csv_dct_rows:
+        if not keep_overlap_row(row=row,
+                                overlap_csv_meta_dct=overlap_csv_meta_dct,
+                                row_filter_dct=row_filter_dct,
+                                eir_matcher=eir_matcher):
+            continue
+        overlap_val_row = []
+        for key in overlap_dct_keys:
+            overlap_val_row.append(row.get(key, ''))
+        yield front_cols + overlap_val_row
+
+
+# reads overlap csv and returns its (meta keys, overlap keys, meta vals,
+#  aggregated rows), keys sorted as header of its own, args as tuple for map
+def agg_overlap_rows_wrapper(args):
+    (overlap_csv_path, ris, rep_dict, row_filter_dct, file_id) = args
+    (overlap_csv_meta_dct, overlap_header_lst, overlap_csv_dct_rows) = \
+        read_overlap_csv(overlap_csv_path=overlap_csv_path,
+                         ris=ris,
+                         rep_dict=rep_dict)
+    meta_dct_keys = sorted(overlap_csv_meta_dct.keys())
+    overlap_dct_keys = sorted(overlap_header_lst)
+    meta_vals = [overlap_csv_meta_dct[key] for key in meta_dct_keys]
+    return (meta_dct_keys, overlap_dct_keys, meta_vals, list(agg_overlap_rows(
+        overlap_csv_meta_dct=overlap_csv_meta_dct,
+        overlap_csv_dct_rows=overlap_csv_dct_rows,
+        meta_dct_keys=meta_dct_keys,
+        overlap_dct_keys=overlap_dct_keys,
+        row_filter_dct=row_filter_dct,
+        file_id=file_id)))
+
+
+# (meta vals, aggregated rows) of agg_overlap_rows_wrapper result in header
+#  order, as is if its keys are the header's, otherwise vals moved to header
+#  cols, blank if csv has no such overlap col
+def header_ordered_rows(agg_result, meta_dct_keys, overlap_dct_keys,
+                        compact):
+    (csv_meta_keys, csv_overlap_keys, csv_meta_vals, agg_rows) = agg_result
+    if csv_meta_keys == meta_dct_keys and \
+       csv_overlap_keys == overlap_dct_keys:
+        return (csv_meta_vals, agg_rows)
+    meta_val_dct = dict(zip(csv_meta_keys, csv_meta_vals))
+    meta_vals = [meta_val_dct[key] for key in meta_dct_keys]
+    # compact rows start with file id, others with meta vals
+    num_front_cols = 1 if compact else len(csv_meta_keys)
+    col_idx_dct = dict([(key, num_front_cols + idx) for (idx, key) in
+                        enumerate(csv_overlap_keys)])
+    col_idxs = [col_idx_dct.get(key) for key in overlap_dct_keys]
+    return (meta_vals,
+            [(row[0:1] if compact else meta_vals) +
+             ['' if col_idx is None else row[col_idx] for col_idx in col_idxs]
+             for row in agg_rows])
+
+
+# returns val of first of keys in overlap csv row, or its meta dct if not a
+#  col, None if neither has any of keys
+def overlap_row_val(row, overlap_csv_meta_dct, keys):
+    for key in keys:
+        if key in row:
+            return row[key]
+        if key in overlap_csv_meta_dct:
+            return overlap_csv_meta_dct[key]
+    return None
+
+
+# True if overlap csv row passes all filters in row_filter_dct, eir_matcher
+#  RoiIncludeMatcher of its exclusively_include_rois, None if not filtering
+def keep_overlap_row(row, overlap_csv_meta_dct, row_filter_dct,
+                     eir_matcher=None):
+    # Only interested in SC*_div{1,2,3,4} sections
+    if row_filter_dct['division_regions'] and \
+            not cic_agg_overlap.is_sc_division_region(row['REGION']):
+        return False
+
+    hemisphere_of_interest = row_filter_dct['hemisphere_of_interest']
+    if hemisphere_of_interest is not None:
+        # hemi is first val of e.g. (l:0:3) or (l:8:128:136), None if overlap
+        #  data doesn't include hemisphere
+        hemi_etc = overlap_row_val(
+            row, overlap_csv_meta_dct,
+            ['(HEMISPHERE:COLUMN:ROW)', '(HEMISPHERE:R:G:B)'])
+        hemi = hemi_etc.split(':')[0].replace('(', '') \
+            if hemi_etc is not None else None
+        if hemi != hemisphere_of_interest:
+            return False
+
+    exclude_sections = row_filter_dct['exclude_sections']
+    if exclude_sections:
+        case = overlap_row_val(row, overlap_csv_meta_dct, ['Case Name'])
+        section = overlap_row_val(row, overlap_csv_meta_dct, ['Slide Number'])
+        if "{}:{}".format(case, section) in exclude_sections:
+            return False
+
+    level_range = row_filter_dct['level_range']
+    if level_range is not None:
+        level = overlap_row_val(row, overlap_csv_meta_dct, ['ARA Level'])
+        assert level is not None, \
+            "level range {} given but no ARA Level in overlap csv".format(
+                level_range)
+        if int(level) < level_range[0] or int(level) > level_range[1]:
+            return False
+
+    if eir_matcher is not None:
+        # REGION, or '|' separated REGION(S) of grid rows
+        region = overlap_row_val(row, overlap_csv_meta_dct,
+                                 ['REGION', 'REGION(S)'])
+        if region is None or not any([eir_matcher.includes(roi)
+                                      for roi in region.split('|')]):
+            return False
+
+    return True
+
+
+# path of manifest for output agg overlap csv, hidden next to output like
+#  pickle path
+def manifest_path(output_agg_overlap_csv):
+    (output_dir, output_name) = os.path.split(output_agg_overlap_csv)
+    return os.path.join(output_dir, ".{}_manifest.p".format(
+        os.path.splitext(output_name)[0]))
+
+
+# returns previous manifest dct, or None if missing or invalid for output
+def read_manifest(output_agg_overlap_csv, manifest_opts_dct):
+    path = manifest_path(output_agg_overlap_csv)
+    if not os.path.isfile(path) or not os.path.isfile(output_agg_overlap_csv):
+        return None
+    manifest_dct = pickle.load(open(path, 'rb'))
+    # only valid if same options and output unchanged since written
+    if manifest_dct['opts'] != manifest_opts_dct or \
+       manifest_dct['size'] != os.path.getsize(output_agg_overlap_csv):
+        return None
+    return manifest_dct
+
+
+# manifest format
+# { 'opts' : { 'row_filter_dct' : ..., 'rep_dict' : ... },
+#   'header' : [...],
+#   'num_meta_keys' : ...,
+#   'size' : output size in bytes,
+#   'files' : [ { 'path' : ..., 'size' : ..., 'mtime' : ..., 'sha1' : ...,
+#                 'start' : ..., 'end' : ... }, ... ] }
+#  start and end are byte range of overlap csv rows in output
+def write_manifest(output_agg_overlap_csv, manifest_opts_dct, header,
+                   num_meta_keys, file_dct_lst):
+    manifest_dct = {
+        'opts': manifest_opts_dct,
+        'header': header,
+        'num_meta_keys': num_meta_keys,
+        'size': os.path.getsize(output_agg_overlap_csv),
+        'files': [dict([(key, file_dct[key]) for key in
+                        ['path', 'size', 'mtime', 'sha1', 'start', 'end']])
+                  for file_dct in file_dct_lst]}
+    pickle.dump(manifest_dct,
+                open(manifest_path(output_agg_overlap_csv), 'wb'))
+
+
+# returns file dct for overlap csv, 'reuse' True if unchanged from
+#  prev_file_dct, only hashes contents if size or mtime changed
+def overlap_csv_file_dct(overlap_csv_path, prev_file_dct):
+    file_dct = {'path': overlap_csv_path,
+                'size': os.path.getsize(overlap_csv_path),
+                'mtime': os.path.getmtime(overlap_csv_path),
+                'reuse': False}
+    if prev_file_dct is not None and \
+       prev_file_dct['size'] == file_dct['size'] and \
+       prev_file_dct['mtime'] == file_dct['mtime']:
+        file_dct['sha1'] = prev_file_dct['sha1']
+    else:
+        file_dct['sha1'] = file_sha1(overlap_csv_path)
+    if prev_file_dct is not None and \
+       prev_file_dct['sha1'] == file_dct['sha1']:
+        file_dct['reuse'] = True
+        file_dct['start'] = prev_file_dct['start']
+        file_dct['end'] = prev_file_dct['end']
+    return file_dct
+
+
+def file_sha1(path, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def copy_bytes(src_file, dst_file, num_bytes, block_size=1 << 20):
+    while num_bytes > 0:
+        block = src_file.read(min(block_size, num_bytes))
+        assert len(block) > 0, "unexpected end of previous output"
+        dst_file.write(block)
+        num_bytes -= len(block)
+
+
 # returns dict with inj_name_chan_case_id: new_name items from csv
 def replacement_csv_to_dict(csv_path):
     assert os.path.isfile(csv_path)
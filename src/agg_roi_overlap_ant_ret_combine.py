@@ -4,6 +4,7 @@ import argparse
 import os
 import cPickle as pickle
 from cic_dis import cic_utils
+import cic_ctx_mat
 import csv
 import numpy as np
 
@@ -23,7 +24,9 @@ def main():
                         help='Retrograde connectivity matrix csv',
                         required=True)
     parser.add_argument('-o', '--output_cmb_ctx_mat_csv',
-                        help='Output combined connectivity matrix csv',
+                        help='Output combined connectivity matrix csv, or '
+                        'block matrix of ant and ret blocks if it ends with '
+                        '.npz',
                         required=True)
     parser.add_argument('-n', '--normalize_values',
                         help='Normalize retrograde and anterograde values',
@@ -81,28 +84,40 @@ def main():
             a_col = map(lambda x: x, ret_ctx_mat_npa[:, idx])
         ret_ctx_mat_npa[:, idx] = a_col
 
+    # Write ant and ret blocks only, no '' cells between them
+    if cic_ctx_mat.is_sparse_ctx_mat(output_ctx_mat_csv):
+        write_block_ctx_mat(
+            ctx_mat_path=output_ctx_mat_csv,
+            ant_row_roi_name_npa=ant_row_roi_name_npa,
+            ant_col_roi_name_npa=ant_col_roi_name_npa,
+            ant_ctx_mat_npa=np.array(ant_norm_ctx_mat, dtype=np.float64),
+            ret_row_roi_name_npa=ret_row_roi_name_npa,
+            ret_col_roi_name_npa=ret_col_roi_name_npa,
+            ret_ctx_mat_npa=ret_ctx_mat_npa)
+
     # Write rows to CSV output file
-    with open(output_ctx_mat_csv, 'wb') as csvfile:
-        csvwriter = csv.writer(csvfile)
+    else:
+        with open(output_ctx_mat_csv, 'wb') as csvfile:
+            csvwriter = csv.writer(csvfile)
 
-        header_row = [''] + \
-            ant_col_roi_name_npa.tolist() + \
-            ret_col_roi_name_npa.tolist()
-        csvwriter.writerow(header_row)
+            header_row = [''] + \
+                ant_col_roi_name_npa.tolist() + \
+                ret_col_roi_name_npa.tolist()
+            csvwriter.writerow(header_row)
 
-        for idx in xrange(ant_row_roi_name_npa.size):
-            ant_row = [ant_row_roi_name_npa[idx]] + \
-                      ant_norm_ctx_mat[idx] + \
-                      ([''] * ret_col_roi_name_npa.size)
+            for idx in xrange(ant_row_roi_name_npa.size):
+                ant_row = [ant_row_roi_name_npa[idx]] + \
+                          ant_norm_ctx_mat[idx] + \
+                          ([''] * ret_col_roi_name_npa.size)
 
-            csvwriter.writerow(ant_row)
+                csvwriter.writerow(ant_row)
 
-        for idx in xrange(ret_row_roi_name_npa.size):
-            ret_row = [ret_row_roi_name_npa[idx]] + \
-                      ([''] * ant_col_roi_name_npa.size) + \
-                      list(ret_ctx_mat_npa[idx])
+            for idx in xrange(ret_row_roi_name_npa.size):
+                ret_row = [ret_row_roi_name_npa[idx]] + \
+                          ([''] * ant_col_roi_name_npa.size) + \
+                          list(ret_ctx_mat_npa[idx])
 
-            csvwriter.writerow(ret_row)
+                csvwriter.writerow(ret_row)
 
     print("Wrote combined connection matrix csv to {}".format(
         output_ctx_mat_csv))
@@ -112,6 +127,28 @@ def main():
     pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
 
 
+# ant inj site x roi block, then ret roi x inj site block below and right of
+#  it, as the csv without '' cells of neither
+def write_block_ctx_mat(ctx_mat_path, ant_row_roi_name_npa,
+                        ant_col_roi_name_npa, ant_ctx_mat_npa,
+                        ret_row_roi_name_npa, ret_col_roi_name_npa,
+                        ret_ctx_mat_npa):
+    (num_ant_rows, num_ant_cols) = (ant_row_roi_name_npa.size,
+                                    ant_col_roi_name_npa.size)
+    row_lbls = ant_row_roi_name_npa.tolist() + ret_row_roi_name_npa.tolist()
+    col_lbls = ant_col_roi_name_npa.tolist() + ret_col_roi_name_npa.tolist()
+    block_ctx_mat = cic_ctx_mat.BlockCtxMat(
+        shape=(len(row_lbls), len(col_lbls)),
+        blocks=[('ant', np.arange(num_ant_rows), np.arange(num_ant_cols),
+                 ant_ctx_mat_npa),
+                ('ret', np.arange(num_ant_rows, len(row_lbls)),
+                 np.arange(num_ant_cols, len(col_lbls)), ret_ctx_mat_npa)])
+    cic_ctx_mat.write_block_ctx_mat(ctx_mat_path=ctx_mat_path,
+                                    row_lbls=row_lbls,
+                                    col_lbls=col_lbls,
+                                    block_ctx_mat=block_ctx_mat)
+
+
 def normalize_calc(maximum, minimum, value):
     if maximum - minimum == 0:
         return minimum
@@ -2,12 +2,13 @@
 from __future__ import print_function
 import argparse
 import os
-from cic_dis import cic_overlap
+import cic_io
+import cic_roi_ctx_mat
 import cPickle as pickle
 import csv
 from cic_dis import cic_utils
-from collections import defaultdict
-import re
+import numpy as np
+import shlex
 
 
 def main():
@@ -46,6 +47,11 @@ def main():
     parser.add_argument('-ma', '--multiple_atlases',
                         help='Use overlap files from multiple atlases',
                         action='store_true')
+    parser.add_argument('-vf', '--variants_file',
+                        help='File of extra outputs from the same pass over '
+                        'input, one per line as options above e.g. '
+                        '-hemi l -mtv 0.004 -o l.csv, -v and -ma apply to '
+                        'all')
     parser.add_argument('-v', '--verbose',
                         help='Print extra information about conversion',
                         action='store_true')
@@ -54,274 +60,118 @@ def main():
     args = vars(parser.parse_args())
 
     input_agg_overlap_csv = args['input_agg_overlap_csv']
-    output_ctx_mat_csv = args['output_ctx_mat_csv']
     verbose = args['verbose']
-    hemisphere_of_interest = args['hemisphere_of_interest']
-    check_hemi = hemisphere_of_interest is not None
-    exclude_sections = args['exclude_sections']
-    eir = args['exclusively_include_rois']
-    mtv = args['minimum_threshold_value']
-    by_division = args['by_sc_division']
-    raw_pixel = args['raw_pixel']
-    add_level = args['add_level']
     multi_atlas = args['multiple_atlases']
-    tracer_mode = \
-        "retrograde" if 'ret' in input_agg_overlap_csv else "anterograde"
-
-    if verbose:
-        print("Using tracer mode {}".format(tracer_mode))
-
-    assert os.path.isfile(input_agg_overlap_csv), "{} not found".\
-        format(input_agg_overlap_csv)
-
-    (agg_overlap_csv_header, agg_overlap_rows) = \
-        cic_overlap.read_agg_overlap_csv(input_csv_path=input_agg_overlap_csv)
-
-    dst_lbl_set = frozenset()
-    src_lbl_set = frozenset()
-
-    # for managing extents
-    # keep track of overlap for each injection site
-    inj_site_overlap_dcts = defaultdict(lambda: defaultdict())
-
-    if verbose:
-        print("Calculating connectivity matrix from {} agg overlap rows".
-              format(len(agg_overlap_rows)))
-        if exclude_sections is not None:
-            print("Excluding {} sections: {}".format(len(exclude_sections),
-                                                     exclude_sections))
-        if eir is not None:
-            print("Including only {} sections: {}".format(len(eir), eir))
-
-    for row_idx, row in enumerate(agg_overlap_rows):
-        # get constant vals, assume
-        # Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap Format
-        #   Tracer are the same for all rows
-        if row_idx == 0:
-            ATLAS_NAME = row[agg_overlap_csv_header.index('Atlas Name')]
-            ATLAS_VERSION = row[agg_overlap_csv_header.index('Atlas Version')]
-            OVERLAP_FORMAT = row[agg_overlap_csv_header.index(
-                'Overlap Format')]
-            assert OVERLAP_FORMAT == 'Region'
-
-        # march through rows
-        # for assertion
-        atlas_name = row[agg_overlap_csv_header.index('Atlas Name')]
-        atlas_version = row[agg_overlap_csv_header.index('Atlas Version')]
-        assert 'Grid Size' not in agg_overlap_csv_header
-        overlap_format = row[agg_overlap_csv_header.index(
-            'Overlap Format')]
-        # get section and case in event exclude_sections list provided
-        section = row[agg_overlap_csv_header.index('Slide Number')]
-        case = row[agg_overlap_csv_header.index('Case Name')]
-
-        # assert these are always the same
-        #   Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap
-        # Format
-        if multi_atlas:
-            if atlas_name != ATLAS_NAME:
-                print("WARNING: Multiple atlases detected: {}, {}".format(
-                    atlas_name, ATLAS_NAME))
-        else:
-            assert atlas_name == ATLAS_NAME
-        assert atlas_version == ATLAS_VERSION, "{} does not equal {}".format(
-            atlas_version, ATLAS_VERSION)
-        assert overlap_format == OVERLAP_FORMAT
-
-        inj_site = row[agg_overlap_csv_header.index('Injection Site')]
-        overlap = int(row[agg_overlap_csv_header.index('OVERLAP')])
-        level = int(row[agg_overlap_csv_header.index('ARA Level')])
-
-        # Need to support overlap data without hemisphere included
-        #  if is included then set hemi normally
-        if '(HEMISPHERE:R:G:B)' in agg_overlap_csv_header:
-            hemi_etc = row[agg_overlap_csv_header.index('(HEMISPHERE:R:G:B)')]
-            hemi = hemi_etc.split(':')[0].replace('(', '')
-        #  else if no hemi included then set hemi to None
-        elif 'REGION RGB' in agg_overlap_csv_header:
-            hemi = None
-        else:
-            assert None, "invalid overlap format"
-
-        roi = row[agg_overlap_csv_header.index('REGION')]
-        source_only = int(row[agg_overlap_csv_header.index('ATLAS ONLY')])
-
-        # only make and add lbl to dct if mtv overlap present and
-        #  hemi of interest or not checking hemi and
-        #  not excluding sections or section not excluded
-        #  not roi exclusive or roi included
-        if ((not check_hemi or hemi == hemisphere_of_interest) and
-            (not exclude_sections or
-             "{}:{}".format(case, section) not in exclude_sections) and
-            (not eir or
-             len([r for r in eir if
-                  r == roi or
-                  re.search('^' + r + '[a-z0-9_]', roi) is not None]) > 0)):
-            # ^^^ check for exact match e.g. VISal_2/3 or == VISal_2/3
-            # or that e.g. MO matches MOp but not MOB ^^^
-            # first make 'roi' cell label
-            if by_division:
-                sep_roi = roi.split('_')  # ex. SCzo_div1, ['SCzo', 'div1']
-                div_lbl = sep_roi[len(sep_roi) - 1].upper()
-                if div_lbl == 'DIV1':
-                    div_lbl = 'SC.m'
-                elif div_lbl == 'DIV2':
-                    div_lbl = 'SC.cm'
-                elif div_lbl == 'DIV3':
-                    div_lbl = 'SC.cl'
-                else:
-                    assert div_lbl == 'DIV4'
-                    div_lbl = 'SC.l'
-                roi_lbl = "{}".format(div_lbl)
-            else:
-                roi_lbl = "{}".format(roi)
-
-            # if True, append level to roi_lbl
-            if add_level:
-                roi_lbl = "{}_{}".format(roi_lbl, level)
-
-            # TODO change inj_site and other terminology to src vs. dest
-            # build labels and dct lst
-            # if anterograde
-            if tracer_mode == 'anterograde':
-                # cell labels from all (HEMISPHERE:COLUMN:ROWS) values
-                dst_lbl_set = dst_lbl_set.union(frozenset({roi_lbl}))
-                #   injection site labels from all Injection Site values
-                src_lbl_set = src_lbl_set.union(
-                    frozenset({inj_site}))
-            elif tracer_mode == 'retrograde':
-                # cell labels from all inj_site values
-                dst_lbl_set = dst_lbl_set.union(frozenset({inj_site}))
-                #   injection site labels from all Injection Site values
-                src_lbl_set = src_lbl_set.union(
-                    frozenset({roi_lbl}))
-            else:
-                assert 0, 'Tracer type should either be antro or retrograde'
-
-            # populate dcts
-            #  antero
-            #  { 'Injection Site' : '...' {roi_lbl1 : (source_only, overlap),
-            #                              roi_lbl2 : ...} }
-            if tracer_mode == 'anterograde':
-                inj_site_overlap_dct = \
-                                       inj_site_overlap_dcts[inj_site]
-                overlap_tup = inj_site_overlap_dct.get(roi_lbl, (0, 0))
-                overlap_tup = tuple(map(lambda x, y: x + y, overlap_tup,
-                                        (source_only, overlap)))
-
-                inj_site_overlap_dct[roi_lbl] = overlap_tup
-            #  retro
-            #  { 'Roi label' : '...' {inj_site1 : (source_only, overlap),
-            #                         inj_site2 : ...} }
-            else:
-                inj_site_overlap_dct = \
-                                       inj_site_overlap_dcts[roi_lbl]
-                overlap_tup = inj_site_overlap_dct.get(inj_site, (0, 0))
-                overlap_tup = tuple(
-                    map(lambda x, y: x + y, overlap_tup,
-                        (source_only, overlap)))
-
-                inj_site_overlap_dct[inj_site] = overlap_tup
-
-        pct_str = "\r{0:0.2f}% complete... ".\
-                  format((float(row_idx)/float(len(agg_overlap_rows)))*100.0)
-        print(pct_str, end='')
-
-    # define max overlap for each ROI
-    max_roi_olp_dct = defaultdict(float)
-
-    if tracer_mode == 'anterograde':
-
-        for inj_site in inj_site_overlap_dcts:
-            for roi in inj_site_overlap_dcts[inj_site]:
-                overlap_tup = inj_site_overlap_dcts[inj_site][roi]
-                source_only = overlap_tup[0]
-                overlap = overlap_tup[1]
-                max_roi_olp_dct[roi] = max(
-                    max_roi_olp_dct[roi],
-                    mat_olp_calc(source_only=source_only, overlap=overlap))
-
-    else:  # retrograde
-        for roi in inj_site_overlap_dcts:
-            for inj_site in inj_site_overlap_dcts[roi]:
-                overlap_tup = inj_site_overlap_dcts[roi][inj_site]
-                source_only = overlap_tup[0]
-                overlap = overlap_tup[1]
-                max_roi_olp_dct[roi] = max(
-                    max_roi_olp_dct[roi],
-                    overlap)
-
-    # only get labels with > max intensity, in ant case these are output rois
-
-    if tracer_mode == 'anterograde':
-        src_lbls = sorted(src_lbl_set)
-        dst_lbls = [''] + sorted([lbl for lbl in dst_lbl_set if
-                                  max_roi_olp_dct[lbl] > mtv])
-
-        if verbose:
-            print("Filtered\n{} with mtv {}...".format(
-                sorted(dst_lbl_set), mtv))
-            print("result\n{}".format(dst_lbls[1:len(dst_lbls)]))
-
-    else:  # retrograde
-        src_lbls = sorted([lbl for lbl in src_lbl_set if
-                           max_roi_olp_dct[lbl] > mtv])
-        dst_lbls = [''] + sorted(dst_lbl_set)
-
-        if verbose:
-            print("Filtered\n{} with mtv {}...".format(
-                sorted(src_lbl_set), mtv))
-            print("result\n{}".format(src_lbls[1:len(src_lbls)]))
+    tracer_mode = cic_roi_ctx_mat.tracer_mode_of(input_agg_overlap_csv)
+
+    # args of each output ctx mat, all from same input
+    variant_args_lst = [args]
+    if args['variants_file'] is not None:
+        for variant in read_variants_file(args['variants_file']):
+            variant_args = vars(parser.parse_args(
+                ['-i', input_agg_overlap_csv] + variant))
+            assert variant_args['variants_file'] is None, \
+                "variant {} can't have variants file".format(variant)
+            assert variant_args['input_agg_overlap_csv'] == \
+                input_agg_overlap_csv, \
+                "variant {} can't have its own input".format(variant)
+            variant_args['verbose'] = verbose
+            variant_args['multiple_atlases'] = multi_atlas
+            variant_args_lst.append(variant_args)
+
+    # variants with same row filters and labels share an accumulator
+    #  { accumulator key : CtxMatAccumulator }
+    accumulator_dct = {}
+    for variant_args in variant_args_lst:
+        key = cic_roi_ctx_mat.CtxMatAccumulator.key(variant_args)
+        if key not in accumulator_dct:
+            accumulator_dct[key] = cic_roi_ctx_mat.CtxMatAccumulator(
+                variant_args=variant_args, tracer_mode=tracer_mode)
+
+    cic_roi_ctx_mat.accumulate_agg_overlap_csv(
+        input_agg_overlap_csv=input_agg_overlap_csv,
+        tracer_mode=tracer_mode,
+        accumulators=accumulator_dct.values(),
+        variant_args_lst=variant_args_lst,
+        multi_atlas=multi_atlas,
+        verbose=verbose)
+
+    for variant_args in variant_args_lst:
+        write_ctx_mat(
+            variant_args=variant_args,
+            accumulator=accumulator_dct[
+                cic_roi_ctx_mat.CtxMatAccumulator.key(variant_args)],
+            tracer_mode=tracer_mode)
+
+
+# returns list of option lists, one per non blank line not starting with #
+def read_variants_file(variants_file_path):
+    assert os.path.isfile(variants_file_path), \
+        "{} not found".format(variants_file_path)
+    variants = []
+    with open(variants_file_path, 'rb') as variants_file:
+        for line in variants_file:
+            if len(line.strip()) > 0 and not line.strip().startswith('#'):
+                variants.append(shlex.split(line))
+    return variants
+
+
+# writes ctx mat csv of variant args from its accumulator
+def write_ctx_mat(variant_args, accumulator, tracer_mode):
+    output_ctx_mat_csv = variant_args['output_ctx_mat_csv']
+    verbose = variant_args['verbose']
+    mtv = variant_args['minimum_threshold_value']
+    raw_pixel = variant_args['raw_pixel']
+    src_code_dct = accumulator.src_code_dct
+    dst_code_dct = accumulator.dst_code_dct
+
+    # sum (source_only, overlap) of rows for each src, dst pair
+    (present_mat, source_only_mat, overlap_mat) = accumulator.ctx_mats()
+    (src_lbls, dst_lbls) = cic_roi_ctx_mat.mtv_lbls(accumulator=accumulator,
+                                                    tracer_mode=tracer_mode,
+                                                    mtv=mtv,
+                                                    verbose=verbose)
+    # need initial blank for header
+    dst_lbls = [''] + dst_lbls
+
+    # output matrix rows and cols of accumulated matrices
+    src_idxs = [src_code_dct[lbl] for lbl in src_lbls]
+    dst_idxs = [dst_code_dct[lbl] for lbl in dst_lbls[1:len(dst_lbls)]]
+    out_present_mat = present_mat[np.ix_(src_idxs, dst_idxs)]
+    out_source_only_mat = source_only_mat[np.ix_(src_idxs, dst_idxs)]
+    out_overlap_mat = overlap_mat[np.ix_(src_idxs, dst_idxs)]
+    assert np.all((out_source_only_mat + out_overlap_mat > 0)[
+        out_present_mat]), "WARNING: cell has no source or overlap"
+    if tracer_mode == 'anterograde' and not raw_pixel:
+        out_val_mat = cic_roi_ctx_mat.mat_olp_calc_npa(
+            source_only_npa=out_source_only_mat, overlap_npa=out_overlap_mat)
+    else:  # raw pixel or retrograde, only the overlap or cell count
+        out_val_mat = out_overlap_mat
 
     # fill all rows with dct lst, need initial blank for header
-    with open(output_ctx_mat_csv, 'wb') as csvfile:
+    with cic_io.open_file(output_ctx_mat_csv, 'wb') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(dst_lbls)
-        for src_lbl in src_lbls:
-            cols = [src_lbl]
-            inj_site_overlap_dct = inj_site_overlap_dcts[src_lbl]
+        for out_src_idx, src_lbl in enumerate(src_lbls):
+            present_lst = out_present_mat[out_src_idx].tolist()
             if verbose:
                 print("read inj site ovlp dct for {}, length {}".
-                      format(src_lbl, len(inj_site_overlap_dct)))
-            for dst_lbl in dst_lbls[1:len(dst_lbls)]:
-                overlap_tup = inj_site_overlap_dct.get(dst_lbl, None)
-                # do get to make sure dst_lbl exists for given injection site
-                if verbose:
-                    if overlap_tup is None:
+                      format(src_lbl, int(np.count_nonzero(
+                          present_mat[src_code_dct[src_lbl]]))))
+                for out_dst_idx, present in enumerate(present_lst):
+                    if not present:
                         print("no overlap tup for {}, {}".
-                              format(src_lbl, dst_lbl))
-
-                if overlap_tup is not None and len(overlap_tup) > 0:
-                    assert len(overlap_tup) == 2, \
-                        "overlap tup: {}".format(overlap_tup)
-                    source_only = overlap_tup[0]
-                    overlap = overlap_tup[1]
-                    assert source_only + overlap > 0, \
-                        "WARNING: cell {} has no source or overlap".format(
-                                dst_lbl)
-                    if tracer_mode == 'anterograde':
-                        if raw_pixel:
-                            cols.append(overlap)
-                        else:
-                            cols.append(mat_olp_calc(source_only=source_only,
-                                                     overlap=overlap))
-                    else:  # retrograde
-                        cols.append(overlap)  # append only the cell count
-                else:
-                    cols.append('')
+                              format(src_lbl, dst_lbls[out_dst_idx + 1]))
+            # python ints and floats so csv writes them as before
+            cols = [src_lbl] + [val if present else '' for val, present in
+                                zip(out_val_mat[out_src_idx].tolist(),
+                                    present_lst)]
             csvwriter.writerow(cols)  # string technically a sequence
 
-    pct_str = "\r{0:0.2f}% complete... ".format(100)
-    print(pct_str)
-
     output_pickle_path = cic_utils.pickle_path(output_ctx_mat_csv)
-    pickle_dct = cic_utils.pickle_dct(args)
+    pickle_dct = cic_utils.pickle_dct(variant_args)
     pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
 
 
-def mat_olp_calc(source_only, overlap):
-    return float(overlap)/float(source_only + overlap)
-
-
 if __name__ == '__main__':
     main()
@@ -2,12 +2,13 @@
 from __future__ import print_function
 import argparse
 import os
-from cic_dis import cic_overlap
+import cic_agg_overlap
+import cic_io
+import cic_progress
 import cPickle as pickle
 import csv
 from cic_dis import cic_utils
 from collections import defaultdict
-import re
 
 
 def main():
@@ -48,6 +49,8 @@ def main():
     check_hemi = hemisphere_of_interest is not None
     exclude_sections = args['exclude_sections']
     eir = args['exclusively_include_rois']
+    eir_matcher = None if not eir else \
+        cic_agg_overlap.RoiIncludeMatcher(include_rois=eir)
     mtv = args['minimum_threshold_value']
     tracer_mode = \
         "retrograde" if 'ret' in input_agg_overlap_csv else "anterograde"
@@ -55,11 +58,20 @@ def main():
     if verbose:
         print("Using tracer mode {}".format(tracer_mode))
 
-    assert os.path.isfile(input_agg_overlap_csv), "{} not found".\
+    assert os.path.exists(input_agg_overlap_csv), "{} not found".\
         format(input_agg_overlap_csv)
 
     (agg_overlap_csv_header, agg_overlap_rows) = \
-        cic_overlap.read_agg_overlap_csv(input_csv_path=input_agg_overlap_csv)
+        cic_agg_overlap.read_agg_overlap_csv(
+            input_csv_path=input_agg_overlap_csv)
+    assert 'Grid Size' not in agg_overlap_csv_header
+    agg_overlap_records = cic_agg_overlap.agg_overlap_records(
+        header=agg_overlap_csv_header,
+        rows=agg_overlap_rows,
+        col_names=['Atlas Name', 'Atlas Version', 'Overlap Format',
+                   'Slide Number', 'Case Name', 'Injection Site',
+                   'OVERLAP', 'REGION', 'ATLAS ONLY'],
+        optional_col_names=['(HEMISPHERE:R:G:B)'])
 
     dst_lbl_set = frozenset()
     src_lbl_set = frozenset()
@@ -77,27 +89,25 @@ def main():
         if eir is not None:
             print("Including only {} sections: {}".format(len(eir), eir))
 
-    for row_idx, row in enumerate(agg_overlap_rows):
+    progress = cic_progress.ProgressReporter(total=len(agg_overlap_rows))
+    for row_idx, row in enumerate(agg_overlap_records):
         # get constant vals, assume
         # Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap Format
         #   Tracer are the same for all rows
         if row_idx == 0:
-            ATLAS_NAME = row[agg_overlap_csv_header.index('Atlas Name')]
-            ATLAS_VERSION = row[agg_overlap_csv_header.index('Atlas Version')]
-            OVERLAP_FORMAT = row[agg_overlap_csv_header.index(
-                'Overlap Format')]
+            ATLAS_NAME = row.atlas_name
+            ATLAS_VERSION = row.atlas_version
+            OVERLAP_FORMAT = row.overlap_format
             assert OVERLAP_FORMAT == 'Region'
 
         # march through rows
         # for assertion
-        atlas_name = row[agg_overlap_csv_header.index('Atlas Name')]
-        atlas_version = row[agg_overlap_csv_header.index('Atlas Version')]
-        assert 'Grid Size' not in agg_overlap_csv_header
-        overlap_format = row[agg_overlap_csv_header.index(
-            'Overlap Format')]
+        atlas_name = row.atlas_name
+        atlas_version = row.atlas_version
+        overlap_format = row.overlap_format
         # get section and case in event exclude_sections list provided
-        section = row[agg_overlap_csv_header.index('Slide Number')]
-        case = row[agg_overlap_csv_header.index('Case Name')]
+        section = row.slide_number
+        case = row.case_name
 
         # assert these are always the same
         #   Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap
@@ -107,13 +117,13 @@ def main():
             atlas_version, ATLAS_VERSION)
         assert overlap_format == OVERLAP_FORMAT
 
-        inj_site = row[agg_overlap_csv_header.index('Injection Site')]
-        overlap = int(row[agg_overlap_csv_header.index('OVERLAP')])
+        inj_site = row.injection_site
+        overlap = row.overlap
 
         # Need to support overlap data without hemisphere included
         #  if is included then set hemi normally
         if '(HEMISPHERE:R:G:B)' in agg_overlap_csv_header:
-            hemi_etc = row[agg_overlap_csv_header.index('(HEMISPHERE:R:G:B)')]
+            hemi_etc = row.hemisphere_r_g_b
             hemi = hemi_etc.split(':')[0].replace('(', '')
         #  else if no hemi included then set hemi to None
         elif 'REGION RGB' in agg_overlap_csv_header:
@@ -121,8 +131,8 @@ def main():
         else:
             assert None, "invalid overlap format"
 
-        roi = row[agg_overlap_csv_header.index('REGION')]
-        source_only = int(row[agg_overlap_csv_header.index('ATLAS ONLY')])
+        roi = row.region
+        source_only = row.atlas_only
 
         # only make and add lbl to dct if mtv overlap present and
         #  hemi of interest or not checking hemi and
@@ -131,10 +141,8 @@ def main():
         if ((not check_hemi or hemi == hemisphere_of_interest) and
             (not exclude_sections or
              "{}:{}".format(case, section) not in exclude_sections) and
-            (not eir or
-             len([r for r in eir if
-                  r == roi or
-                  re.search('^' + r + '[a-z0-9_]', roi) is not None]) > 0)):
+            (eir_matcher is None or
+             eir_matcher.includes(roi))):
             # ^^^ check for exact match e.g. VISal_2/3 or == VISal_2/3
             # or that e.g. MO matches MOp but not MOB ^^^
             # first make 'roi' cell label
@@ -183,9 +191,7 @@ def main():
 
                 inj_site_overlap_dct[inj_site] = overlap_tup
 
-        pct_str = "\r{0:0.2f}% complete... ".\
-                  format((float(row_idx)/float(len(agg_overlap_rows)))*100.0)
-        print(pct_str, end='')
+        progress.update(row_idx + 1)
 
     # define max overlap for each ROI
     max_roi_olp_dct = defaultdict(float)
@@ -237,7 +243,7 @@ def main():
             print("result\n{}".format(src_lbls[1:len(src_lbls)]))
 
     # fill all rows with dct lst, need initial blank for header
-    with open(output_ctx_mat_csv, 'wb') as csvfile:
+    with cic_io.open_file(output_ctx_mat_csv, 'wb') as csvfile:
         csvwriter = csv.writer(csvfile)
         csvwriter.writerow(dst_lbls)
         for src_lbl in src_lbls:
@@ -270,8 +276,7 @@ def main():
                     cols.append('')
             csvwriter.writerow(cols)  # string technically a sequence
 
-    pct_str = "\r{0:0.2f}% complete... ".format(100)
-    print(pct_str)
+    progress.done()
 
     output_pickle_path = cic_utils.pickle_path(output_ctx_mat_csv)
     pickle_dct = cic_utils.pickle_dct(args)
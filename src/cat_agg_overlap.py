@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import csv
+import os
+import cic_agg_overlap
+import cic_io
+import cPickle as pickle
+from cic_dis import cic_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes aggregated overlap back out as plain aggregated "
+        "overlap csv, as the converters read it, whether compressed, compact, "
+        "with columnar companion or partitioned")
+    parser.add_argument('-i', '--input_agg_overlap_csv',
+                        help='Input aggregated overlap csv, or partitioned '
+                        'dir',
+                        required=True)
+    parser.add_argument('-o', '--output_agg_overlap_csv',
+                        help='Output aggregated overlap csv',
+                        required=True)
+    parser.add_argument('-cases', '--cases',
+                        help='Only read partitions of listed cases, '
+                        'partitioned dir only',
+                        nargs='+')
+    parser.add_argument('-lvls', '--levels',
+                        help='Only read partitions of listed levels, '
+                        'partitioned dir only',
+                        nargs='+')
+    parser.add_argument('-v', '--verbose',
+                        help='Print extra information about reading',
+                        action='store_true')
+
+    # READ ARGS
+    args = vars(parser.parse_args())
+
+    input_agg_overlap_csv = args['input_agg_overlap_csv']
+    output_agg_overlap_csv = args['output_agg_overlap_csv']
+    cases = args['cases']
+    levels = args['levels']
+    verbose = args['verbose']
+
+    assert os.path.exists(input_agg_overlap_csv), "{} not found".\
+        format(input_agg_overlap_csv)
+
+    (header, rows) = cic_agg_overlap.read_agg_overlap_csv(
+        input_csv_path=input_agg_overlap_csv,
+        cases=cases,
+        levels=levels)
+
+    with cic_io.open_file(output_agg_overlap_csv, 'wb') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(header)
+        csvwriter.writerows(rows)
+
+    if verbose:
+        print("Wrote {} rows of {} to {}".format(
+            len(rows), input_agg_overlap_csv, output_agg_overlap_csv))
+
+    output_pickle_path = cic_utils.pickle_path(output_agg_overlap_csv)
+    pickle_dct = cic_utils.pickle_dct(args)
+    pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,567 @@
+from __future__ import print_function
+import os
+import csv
+import bisect
+import re
+import cPickle as pickle
+import numpy as np
+from itertools import islice, izip
+from collections import namedtuple, OrderedDict
+from cic_dis import cic_overlap
+import cic_io
+
+# aggregated overlap columns stored as integers in columnar companion, any
+#  that don't round trip e.g. '019' ARA Level fall back to dictionary encoding
+INT_COL_NAMES = ['OVERLAP', 'GRID ONLY', 'ATLAS ONLY', 'ARA Level']
+INT_DTYPE = np.int64
+CODE_DTYPE = np.int32
+CHUNK_ROWS = 1 << 16
+# first col of compact aggregated overlap csv, meta vals kept in files csv
+FILE_ID_COL = 'FILE ID'
+
+
+# reads aggregated overlap csv, from columnar companion if present and fresh
+#  and expanding meta vals of compact output, header and rows are always as
+#  written by non compact agg_overlap.py
+#  input_csv_path can also be partitioned output dir, only partitions with
+#  case in cases and level in levels are read, None for all
+#  returns (header, rows), rows can be iterated, indexed and len()'d
+def read_agg_overlap_csv(input_csv_path, cases=None, levels=None):
+    if os.path.isdir(input_csv_path):
+        part_dct_lst = prune_part_index(read_part_index(input_csv_path),
+                                        cases=cases, levels=levels)
+        return (read_part_header(input_csv_path),
+                PartitionedAggOverlapRows(part_dct_lst=part_dct_lst))
+
+    agg_overlap_cols = read_columnar(input_csv_path)
+    if agg_overlap_cols is not None:
+        (header, rows) = (agg_overlap_cols.header, agg_overlap_cols)
+    else:
+        with cic_io.decompressed_path(input_csv_path) as csv_path:
+            (header, rows) = cic_overlap.read_agg_overlap_csv(
+                input_csv_path=csv_path)
+
+    if len(header) > 0 and header[0] == FILE_ID_COL:
+        (meta_keys, file_meta_dct) = read_compact_files_csv(
+            compact_files_csv_path(input_csv_path))
+        return (meta_keys + list(header[1:len(header)]),
+                CompactAggOverlapRows(file_meta_dct=file_meta_dct,
+                                      rows=rows))
+    return (header, rows)
+
+
+# typed records of aggregated overlap rows, col positions are resolved from
+#  header once and int_col_names converted to int a chunk at a time
+#  records are namedtuples with a field per col in col_names, named by
+#  record_field_name e.g. 'GRID ONLY' -> grid_only, optional_col_names
+#  missing from header are None
+def agg_overlap_records(header, rows, col_names, optional_col_names=(),
+                        int_col_names=INT_COL_NAMES):
+    all_col_names = list(col_names) + list(optional_col_names)
+    for name in col_names:
+        assert name in header, "{} not in header {}".format(name, header)
+    col_idxs = [header.index(name) if name in header else None
+                for name in all_col_names]
+    is_int_cols = [name in int_col_names for name in all_col_names]
+    record_type = namedtuple('AggOverlapRecord',
+                             [record_field_name(x) for x in all_col_names])
+
+    row_iter = iter(rows)
+    for start in xrange(0, len(rows), CHUNK_ROWS):
+        stop = min(start + CHUNK_ROWS, len(rows))
+        # columnar companion cols are sliced directly
+        chunk = None if isinstance(rows, AggOverlapCols) else \
+            list(islice(row_iter, stop - start))
+        cols = []
+        for col_idx, is_int in izip(col_idxs, is_int_cols):
+            if col_idx is None:
+                cols.append([None] * (stop - start))
+            elif chunk is None and is_int and \
+                    rows.col_types[col_idx] == 'int':
+                # already ints in columnar companion, no parsing
+                cols.append(rows.col_npas[col_idx][start:stop].tolist())
+            else:
+                if chunk is None:
+                    vals = rows.col_strs(col_idx, start, stop)
+                else:
+                    vals = [row[col_idx] for row in chunk]
+                cols.append(map(int, vals) if is_int else vals)
+        for vals in izip(*cols):
+            yield record_type._make(vals)
+
+
+def record_field_name(col_name):
+    return re.sub('[^0-9a-zA-Z]+', '_', col_name).strip('_').lower()
+
+
+# matches ROIs against include patterns e.g. -eir, ROI is included if equal
+#  to a pattern e.g. VISal_2/3 or a pattern matches its start followed by
+#  [a-z0-9_] e.g. MO matches MOp but not MOB, patterns are compiled into one
+#  alternation regex and decisions cached per ROI
+class RoiIncludeMatcher(object):
+    def __init__(self, include_rois):
+        self.include_roi_set = frozenset(include_rois)
+        # each pattern searched as '^' + r + '[a-z0-9_]' on its own
+        self.prefix_re = re.compile('|'.join(
+            ['(?:^{}[a-z0-9_])'.format(r) for r in include_rois]))
+        # { roi : True or False }
+        self.include_dct = {}
+
+    def includes(self, roi):
+        include = self.include_dct.get(roi)
+        if include is None:
+            include = roi in self.include_roi_set or \
+                self.prefix_re.search(roi) is not None
+            self.include_dct[roi] = include
+        return include
+
+
+# SC division labels of SC division region suffixes e.g. SCzo_div1 -> SC.m
+SC_DIVISION_LBL_DCT = {'DIV1': 'SC.m',
+                       'DIV2': 'SC.cm',
+                       'DIV3': 'SC.cl',
+                       'DIV4': 'SC.l'}
+
+
+def is_sc_division_region(roi):
+    return '_div' in roi
+
+
+def sc_division_lbl(roi):
+    sep_roi = roi.split('_')  # ex. SCzo_div1, ['SCzo', 'div1']
+    div = sep_roi[len(sep_roi) - 1].upper()
+    assert div in SC_DIVISION_LBL_DCT, \
+        "{} is not an SC division region".format(roi)
+    return SC_DIVISION_LBL_DCT[div]
+
+
+# files csv of compact aggregated overlap csv, next to it and compressed
+#  the same way
+def compact_files_csv_path(agg_overlap_csv_path):
+    return "{}_files{}".format(*cic_io.splitext(agg_overlap_csv_path))
+
+
+# returns (meta keys, { file id : tuple of meta vals })
+def read_compact_files_csv(files_csv_path):
+    assert os.path.isfile(files_csv_path), \
+        "compact files csv {} not found".format(files_csv_path)
+    with cic_io.open_file(files_csv_path, 'rb') as csvfile:
+        csvreader = csv.reader(csvfile)
+        header = next(csvreader)
+        assert header[0] == FILE_ID_COL
+        file_meta_dct = dict([(row[0], tuple(row[1:len(row)]))
+                              for row in csvreader])
+    return (header[1:len(header)], file_meta_dct)
+
+
+# compact aggregated overlap rows, each expanded to meta vals of its file id
+#  followed by its overlap vals when accessed
+class CompactAggOverlapRows(object):
+    def __init__(self, file_meta_dct, rows):
+        self.file_meta_dct = file_meta_dct
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        file_meta_dct = self.file_meta_dct
+        for row in self.rows:
+            yield file_meta_dct[row[0]] + tuple(row[1:len(row)])
+
+    def __getitem__(self, row_idx):
+        row = self.rows[row_idx]
+        return self.file_meta_dct[row[0]] + tuple(row[1:len(row)])
+
+
+# directory of columnar companion, next to aggregated overlap csv
+def columnar_dir_path(agg_overlap_csv_path):
+    return "{}_cols".format(cic_io.splitext(agg_overlap_csv_path)[0])
+
+
+def columnar_col_path(col_dir_path, col_idx):
+    return os.path.join(col_dir_path, "{:04d}.bin".format(col_idx))
+
+
+def columnar_meta_path(col_dir_path):
+    return os.path.join(col_dir_path, "meta.p")
+
+
+# writes columnar companion of aggregated overlap csv, one raw binary file per
+#  column that can be memory mapped, INT_COL_NAMES as INT_DTYPE and the rest
+#  as CODE_DTYPE codes into a per column dictionary kept in meta.p
+#  meta.p format
+#  { 'header' : [...],
+#    'num_rows' : ...,
+#    'col_types' : ['int' or 'str', ...],
+#    'col_dcts' : [None or [val for code 0, val for code 1, ...], ...],
+#    'csv_size' : ...,
+#    'csv_mtime' : ... }
+def write_columnar(agg_overlap_csv_path):
+    col_dir_path = columnar_dir_path(agg_overlap_csv_path)
+    if not os.path.isdir(col_dir_path):
+        os.makedirs(col_dir_path)
+
+    with cic_io.open_file(agg_overlap_csv_path, 'rb') as csvfile:
+        csvreader = csv.reader(csvfile)
+        header = next(csvreader)
+        col_types = ['int' if name in INT_COL_NAMES else 'str'
+                     for name in header]
+        # { val : code } while writing, turned into list for meta.p
+        col_code_dcts = [{} for name in header]
+        col_files = [open(columnar_col_path(col_dir_path, col_idx), 'wb')
+                     for col_idx in xrange(len(header))]
+        num_rows = 0
+        while True:
+            chunk = list(islice(csvreader, CHUNK_ROWS))
+            if len(chunk) == 0:
+                break
+            for row in chunk:
+                assert len(row) == len(header), \
+                    "row {} of {} has {} cols, header has {}".format(
+                        num_rows + 1, agg_overlap_csv_path, len(row),
+                        len(header))
+            for col_idx, vals in enumerate(izip(*chunk)):
+                if col_types[col_idx] == 'int':
+                    try:
+                        int_npa = np.array([int(x) for x in vals],
+                                           dtype=INT_DTYPE)
+                    except ValueError:
+                        int_npa = None
+                    if int_npa is not None and \
+                       [str(x) for x in int_npa.tolist()] == list(vals):
+                        int_npa.tofile(col_files[col_idx])
+                        continue
+                    # doesn't round trip, re-encode col as dictionary codes
+                    col_files[col_idx] = int_col_file_to_str(
+                        col_file=col_files[col_idx],
+                        col_code_dct=col_code_dcts[col_idx])
+                    col_types[col_idx] = 'str'
+                col_code_dct = col_code_dcts[col_idx]
+                code_npa = np.array(
+                    [col_code_dct.setdefault(x, len(col_code_dct))
+                     for x in vals], dtype=CODE_DTYPE)
+                code_npa.tofile(col_files[col_idx])
+            num_rows += len(chunk)
+
+        for col_file in col_files:
+            col_file.close()
+
+    col_dcts = []
+    for col_idx, col_code_dct in enumerate(col_code_dcts):
+        if col_types[col_idx] == 'int':
+            col_dcts.append(None)
+        else:
+            col_dct = [None] * len(col_code_dct)
+            for val, code in col_code_dct.iteritems():
+                col_dct[code] = val
+            col_dcts.append(col_dct)
+
+    meta_dct = {'header': header,
+                'num_rows': num_rows,
+                'col_types': col_types,
+                'col_dcts': col_dcts,
+                'csv_size': os.path.getsize(agg_overlap_csv_path),
+                'csv_mtime': os.path.getmtime(agg_overlap_csv_path)}
+    pickle.dump(meta_dct, open(columnar_meta_path(col_dir_path), 'wb'),
+                pickle.HIGHEST_PROTOCOL)
+
+    return col_dir_path
+
+
+# rewrites INT_DTYPE col file written so far as codes into col_code_dct,
+#  returns col file open for appending codes
+def int_col_file_to_str(col_file, col_code_dct):
+    col_path = col_file.name
+    col_file.close()
+    int_npa = np.fromfile(col_path, dtype=INT_DTYPE)
+    code_npa = np.array([col_code_dct.setdefault(str(x), len(col_code_dct))
+                         for x in int_npa.tolist()], dtype=CODE_DTYPE)
+    col_file = open(col_path, 'wb')
+    code_npa.tofile(col_file)
+    return col_file
+
+
+# returns AggOverlapCols for aggregated overlap csv, None if no columnar
+#  companion or it is older than the csv
+def read_columnar(agg_overlap_csv_path):
+    col_dir_path = columnar_dir_path(agg_overlap_csv_path)
+    meta_path = columnar_meta_path(col_dir_path)
+    if not os.path.isfile(meta_path):
+        return None
+    meta_dct = pickle.load(open(meta_path, 'rb'))
+    if meta_dct['csv_size'] != os.path.getsize(agg_overlap_csv_path) or \
+       meta_dct['csv_mtime'] != os.path.getmtime(agg_overlap_csv_path):
+        return None
+    return AggOverlapCols(col_dir_path=col_dir_path, meta_dct=meta_dct)
+
+
+# memory mapped aggregated overlap columns, behaves like the list of csv rows
+#  returned by cic_overlap.read_agg_overlap_csv, rows are tuples of str
+class AggOverlapCols(object):
+    def __init__(self, col_dir_path, meta_dct):
+        self.header = meta_dct['header']
+        self.num_rows = meta_dct['num_rows']
+        self.col_types = meta_dct['col_types']
+        self.col_dcts = meta_dct['col_dcts']
+        self.col_npas = []
+        for col_idx, col_type in enumerate(self.col_types):
+            dtype = INT_DTYPE if col_type == 'int' else CODE_DTYPE
+            if self.num_rows == 0:
+                self.col_npas.append(np.zeros(0, dtype=dtype))
+            else:
+                self.col_npas.append(np.memmap(
+                    columnar_col_path(col_dir_path, col_idx),
+                    dtype=dtype, mode='r', shape=(self.num_rows,)))
+        # object arrays of dictionaries for decoding codes in bulk
+        self.col_dct_npas = [None if col_dct is None else
+                             np.array(col_dct, dtype=object)
+                             for col_dct in self.col_dcts]
+
+    def __len__(self):
+        return self.num_rows
+
+    def __iter__(self):
+        for start in xrange(0, self.num_rows, CHUNK_ROWS):
+            stop = min(start + CHUNK_ROWS, self.num_rows)
+            for row in izip(*[self.col_strs(col_idx, start, stop)
+                              for col_idx in xrange(len(self.header))]):
+                yield row
+
+    def __getitem__(self, row_idx):
+        if row_idx < 0:
+            row_idx += self.num_rows
+        if row_idx < 0 or row_idx >= self.num_rows:
+            raise IndexError("row {} out of range".format(row_idx))
+        return tuple([self.col_strs(col_idx, row_idx, row_idx + 1)[0]
+                      for col_idx in xrange(len(self.header))])
+
+    # list of col vals as they appear in csv for rows start to stop
+    def col_strs(self, col_idx, start, stop):
+        if self.col_types[col_idx] == 'int':
+            return [str(x) for x in self.col_npas[col_idx][start:stop].
+                    tolist()]
+        return self.col_dct_npas[col_idx][
+            self.col_npas[col_idx][start:stop]].tolist()
+
+    # col as numpy array, INT_DTYPE for int cols or object array of str
+    def col_npa(self, col_idx):
+        if self.col_types[col_idx] == 'int':
+            return self.col_npas[col_idx]
+        return self.col_dct_npas[col_idx][self.col_npas[col_idx]]
+
+
+# index of partitioned aggregated overlap dir, one row per partition csv
+PART_INDEX_CSV = 'index.csv'
+PART_INDEX_HEADER = ['PARTITION', 'Case Name', 'ARA Level', 'ROWS']
+# aggregated overlap cols partitions are keyed by
+PART_KEY_COL_NAMES = ['Case Name', 'ARA Level']
+# partition csvs kept open at once while writing, least recently written
+#  closed first and reopened to append, far below the usual 1024 fd limit
+MAX_OPEN_PARTS = 64
+
+
+def part_index_path(part_dir_path):
+    return os.path.join(part_dir_path, PART_INDEX_CSV)
+
+
+# returns list of partition dcts in index order
+#  [ { 'path' : ..., 'case' : ..., 'level' : ..., 'num_rows' : ... }, ... ]
+def read_part_index(part_dir_path):
+    index_path = part_index_path(part_dir_path)
+    assert os.path.isfile(index_path), \
+        "partition index {} not found".format(index_path)
+    part_dct_lst = []
+    with open(index_path, 'rb') as csvfile:
+        csvreader = csv.reader(csvfile)
+        assert next(csvreader) == PART_INDEX_HEADER
+        for row in csvreader:
+            part_dct_lst.append({'path': os.path.join(part_dir_path, row[0]),
+                                 'case': row[1],
+                                 'level': row[2],
+                                 'num_rows': int(row[3])})
+    return part_dct_lst
+
+
+# header of partitions, from first line of first partition csv, all
+#  partitions share it
+def read_part_header(part_dir_path):
+    part_dct_lst = read_part_index(part_dir_path)
+    assert len(part_dct_lst) > 0, \
+        "no partitions in {}".format(part_dir_path)
+    with open(part_dct_lst[0]['path'], 'rb') as csvfile:
+        return next(csv.reader(csvfile))
+
+
+# partitions of dir with case in cases and level in levels, None for all,
+#  levels compared as ints so '19' matches '019'
+def prune_part_index(part_dct_lst, cases=None, levels=None):
+    if cases is not None:
+        cases = frozenset(cases)
+        part_dct_lst = [x for x in part_dct_lst if x['case'] in cases]
+    if levels is not None:
+        levels = frozenset([int(x) for x in levels])
+        part_dct_lst = [x for x in part_dct_lst if int(x['level']) in levels]
+    return part_dct_lst
+
+
+# writes aggregated overlap rows to a dir of csvs, one per case and ARA Level,
+#  each with full header, close() writes index.csv and returns partition dcts
+#  at most max_open_parts partition csvs open at once
+class AggOverlapPartitionWriter(object):
+    def __init__(self, part_dir_path, header, max_open_parts=MAX_OPEN_PARTS):
+        assert max_open_parts > 0, \
+            "max open partitions must be positive, got {}".format(
+                max_open_parts)
+        self.part_dir_path = part_dir_path
+        self.header = header
+        self.max_open_parts = max_open_parts
+        self.key_col_idxs = [header.index(name)
+                             for name in PART_KEY_COL_NAMES]
+        if not os.path.isdir(part_dir_path):
+            os.makedirs(part_dir_path)
+        elif os.path.isfile(part_index_path(part_dir_path)):
+            # remove previous partitions so none are left stale
+            for part_dct in read_part_index(part_dir_path):
+                if os.path.isfile(part_dct['path']):
+                    os.remove(part_dct['path'])
+            os.remove(part_index_path(part_dir_path))
+        # { (case, level) : num rows }
+        self.part_dct = {}
+        self.part_key_lst = []
+        # { (case, level) : (csvfile, csvwriter) } of open partitions, least
+        #  recently written first
+        self.open_part_dct = OrderedDict()
+
+    def writerows(self, rows):
+        for row in rows:
+            part_key = tuple([row[idx] for idx in self.key_col_idxs])
+            self.part_writer(part_key).writerow(row)
+            self.part_dct[part_key] += 1
+
+    # csv writer of partition, opened and header written if new, reopened to
+    #  append if closed, least recently written closed if too many open
+    def part_writer(self, part_key):
+        open_part = self.open_part_dct.pop(part_key, None)
+        if open_part is None:
+            if len(self.open_part_dct) >= self.max_open_parts:
+                self.open_part_dct.popitem(last=False)[1][0].close()
+            part_csv_path = os.path.join(self.part_dir_path,
+                                         part_csv_name(part_key))
+            is_new = part_key not in self.part_dct
+            csvfile = open(part_csv_path, 'wb' if is_new else 'ab')
+            open_part = (csvfile, csv.writer(csvfile))
+            if is_new:
+                open_part[1].writerow(self.header)
+                self.part_dct[part_key] = 0
+                self.part_key_lst.append(part_key)
+        # most recently written last
+        self.open_part_dct[part_key] = open_part
+        return open_part[1]
+
+    def close(self):
+        for (csvfile, _) in self.open_part_dct.values():
+            csvfile.close()
+        self.open_part_dct.clear()
+        part_dct_lst = []
+        with open(part_index_path(self.part_dir_path), 'wb') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(PART_INDEX_HEADER)
+            for part_key in sorted(self.part_key_lst):
+                csvwriter.writerow([part_csv_name(part_key)] +
+                                   list(part_key) + [self.part_dct[part_key]])
+                part_dct_lst.append({
+                    'path': os.path.join(self.part_dir_path,
+                                         part_csv_name(part_key)),
+                    'case': part_key[0],
+                    'level': part_key[1],
+                    'num_rows': self.part_dct[part_key]})
+        return part_dct_lst
+
+
+def part_csv_name(part_key):
+    return "{}_{}.csv".format(*part_key)
+
+
+# rows of partitioned aggregated overlap dir, partitions read one at a time
+#  as iterated, so only one is held in memory
+class PartitionedAggOverlapRows(object):
+    def __init__(self, part_dct_lst):
+        self.part_dct_lst = part_dct_lst
+        self.part_starts = []
+        num_rows = 0
+        for part_dct in part_dct_lst:
+            self.part_starts.append(num_rows)
+            num_rows += part_dct['num_rows']
+        self.num_rows = num_rows
+        # last partition read by __getitem__, (part idx, rows)
+        self.cached_part = (None, None)
+
+    def __len__(self):
+        return self.num_rows
+
+    def __iter__(self):
+        for part_dct in self.part_dct_lst:
+            for row in read_agg_overlap_csv(part_dct['path'])[1]:
+                yield row
+
+    def __getitem__(self, row_idx):
+        if row_idx < 0:
+            row_idx += self.num_rows
+        if row_idx < 0 or row_idx >= self.num_rows:
+            raise IndexError("row {} out of range".format(row_idx))
+        part_idx = bisect.bisect_right(self.part_starts, row_idx) - 1
+        if self.cached_part[0] != part_idx:
+            self.cached_part = (part_idx, read_agg_overlap_csv(
+                self.part_dct_lst[part_idx]['path'])[1])
+        return self.cached_part[1][row_idx - self.part_starts[part_idx]]
+
+
+# grid cells (ARA Level, hemisphere, col, row) packed high to low bits in int64
+#  keys, so keys sort as cell labels sort by level, 'l' before 'r', col, row
+CELL_HEMIS = ['l', 'r']
+CELL_HEMI_BIT_DCT = dict([(hemi, bit) for bit, hemi in enumerate(CELL_HEMIS)])
+CELL_COL_BITS = 20
+CELL_ROW_BITS = 20
+CELL_KEY_DTYPE = np.int64
+
+
+# (HEMISPHERE:COLUMN:ROW) val e.g. '(l:0:3)' -> ('l', 0, 3)
+def parse_hemi_col_row(hemi_col_row):
+    lst = hemi_col_row.replace('(', '').replace(')', '').split(':')
+    assert len(lst) == 3, "{} wrong format".format(hemi_col_row)
+    return (lst[0], int(lst[1]), int(lst[2]))
+
+
+# levels, hemi bits, cols and rows are equal length int arrays
+def pack_cell_keys(level_npa, hemi_bit_npa, col_npa, row_npa):
+    (level_npa, hemi_bit_npa, col_npa, row_npa) = \
+        [np.asarray(npa, dtype=CELL_KEY_DTYPE)
+         for npa in (level_npa, hemi_bit_npa, col_npa, row_npa)]
+    assert np.all((col_npa >= 0) & (col_npa < (1 << CELL_COL_BITS))), \
+        "grid cols must be in [0, {})".format(1 << CELL_COL_BITS)
+    assert np.all((row_npa >= 0) & (row_npa < (1 << CELL_ROW_BITS))), \
+        "grid rows must be in [0, {})".format(1 << CELL_ROW_BITS)
+    assert np.all(level_npa >= 0), "ARA Levels must be positive"
+    return (((level_npa << 1 | hemi_bit_npa) << CELL_COL_BITS | col_npa)
+            << CELL_ROW_BITS | row_npa)
+
+
+# returns (level_npa, hemi_bit_npa, col_npa, row_npa)
+def unpack_cell_keys(cell_key_npa):
+    cell_key_npa = np.asarray(cell_key_npa, dtype=CELL_KEY_DTYPE)
+    row_npa = cell_key_npa & ((1 << CELL_ROW_BITS) - 1)
+    col_npa = (cell_key_npa >> CELL_ROW_BITS) & ((1 << CELL_COL_BITS) - 1)
+    hemi_bit_npa = (cell_key_npa >> (CELL_ROW_BITS + CELL_COL_BITS)) & 1
+    level_npa = cell_key_npa >> (CELL_ROW_BITS + CELL_COL_BITS + 1)
+    return (level_npa, hemi_bit_npa, col_npa, row_npa)
+
+
+# (ARA Level:HEMISPHERE:COLUMN:ROW) labels of keys e.g. '(19:l:0:3)'
+def cell_key_lbls(cell_key_npa):
+    (level_npa, hemi_bit_npa, col_npa, row_npa) = \
+        unpack_cell_keys(cell_key_npa)
+    return ["({}:{}:{}:{})".format(level, CELL_HEMIS[hemi_bit], col, row)
+            for (level, hemi_bit, col, row) in izip(
+                level_npa.tolist(), hemi_bit_npa.tolist(), col_npa.tolist(),
+                row_npa.tolist())]
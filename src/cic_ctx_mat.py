@@ -0,0 +1,311 @@
+import os
+import numpy as np
+from cic_dis import cic_utils
+import cic_io
+
+# ctx mats with this extension are sparse, COO arrays and label tables saved
+#  with np.savez_compressed, or block, dense blocks placed in the whole matrix
+#  by row and col idxs e.g. ant and ret blocks of combined ctx mat
+SPARSE_CTX_MAT_EXT = '.npz'
+# block ctx mats have this array, sparse ones don't
+BLOCK_NAMES_KEY = 'block_names'
+# ctx mats with this extension are dense float64 .npy, memory mapped so they
+#  can be bigger than memory, row and col labels in MEMMAP_LBLS_SUFFIX .npz
+#  next to it
+MEMMAP_CTX_MAT_EXT = '.npy'
+MEMMAP_LBLS_SUFFIX = '_lbls.npz'
+
+
+def is_sparse_ctx_mat(ctx_mat_path):
+    return cic_io.splitext(ctx_mat_path)[1] == SPARSE_CTX_MAT_EXT
+
+
+def is_memmap_ctx_mat(ctx_mat_path):
+    return cic_io.splitext(ctx_mat_path)[1] == MEMMAP_CTX_MAT_EXT
+
+
+# reads ctx mat csv, compressed or not, or sparse or block ctx mat densified
+#  returns (row_roi_name_npa, col_roi_name_npa, ctx_mat_npa) as
+#  cic_utils.read_ctx_mat, BlockCtxMat instead of ctx_mat_npa for block ctx
+#  mat if not densify_blocks, memmap ctx mat read whole into memory
+def read_ctx_mat(ctx_mat_path, densify_blocks=True):
+    if is_memmap_ctx_mat(ctx_mat_path):
+        (row_roi_name_npa, col_roi_name_npa, ctx_mat_memmap) = \
+            open_memmap_ctx_mat(ctx_mat_path)
+        return (row_roi_name_npa, col_roi_name_npa, np.array(ctx_mat_memmap))
+    if is_sparse_ctx_mat(ctx_mat_path):
+        (row_roi_name_npa, col_roi_name_npa, sparse_ctx_mat) = \
+            read_sparse_ctx_mat(ctx_mat_path)
+        if isinstance(sparse_ctx_mat, BlockCtxMat) and not densify_blocks:
+            return (row_roi_name_npa, col_roi_name_npa, sparse_ctx_mat)
+        return (row_roi_name_npa, col_roi_name_npa, sparse_ctx_mat.toarray())
+    with cic_io.decompressed_path(ctx_mat_path) as csv_path:
+        return cic_utils.read_ctx_mat(csv_path)
+
+
+# writes sparse ctx mat, row_idxs, col_idxs and vals of present cells only
+#  npz format
+#  { 'row_lbls' : [...], 'col_lbls' : [...],
+#    'row_idxs' : [...], 'col_idxs' : [...], 'vals' : [...] }
+def write_sparse_ctx_mat(ctx_mat_path, row_lbls, col_lbls, row_idxs,
+                         col_idxs, vals):
+    assert is_sparse_ctx_mat(ctx_mat_path), \
+        "sparse ctx mat {} must end with {}".format(
+            ctx_mat_path, SPARSE_CTX_MAT_EXT)
+    assert len(row_idxs) == len(col_idxs) == len(vals)
+    # file object so savez doesn't add its own extension
+    with open(ctx_mat_path, 'wb') as npz_file:
+        np.savez_compressed(npz_file,
+                            row_lbls=np.array(row_lbls),
+                            col_lbls=np.array(col_lbls),
+                            row_idxs=np.array(row_idxs, dtype=np.int64),
+                            col_idxs=np.array(col_idxs, dtype=np.int64),
+                            vals=np.array(vals, dtype=np.float64))
+
+
+# writes block ctx mat, row and col idxs and dense vals of each block only,
+#  cells outside blocks are never written
+#  npz format
+#  { 'row_lbls' : [...], 'col_lbls' : [...], 'block_names' : [...],
+#    'block_0_row_idxs' : [...], 'block_0_col_idxs' : [...],
+#    'block_0_vals' : [[...], ...], ... }
+def write_block_ctx_mat(ctx_mat_path, row_lbls, col_lbls, block_ctx_mat):
+    assert is_sparse_ctx_mat(ctx_mat_path), \
+        "block ctx mat {} must end with {}".format(
+            ctx_mat_path, SPARSE_CTX_MAT_EXT)
+    assert block_ctx_mat.shape == (len(row_lbls), len(col_lbls))
+    block_npa_dct = {}
+    for (block_idx, (_, row_idxs, col_idxs, vals)) in \
+            enumerate(block_ctx_mat.blocks):
+        block_npa_dct['block_{}_row_idxs'.format(block_idx)] = row_idxs
+        block_npa_dct['block_{}_col_idxs'.format(block_idx)] = col_idxs
+        block_npa_dct['block_{}_vals'.format(block_idx)] = vals
+    block_npa_dct[BLOCK_NAMES_KEY] = np.array(block_ctx_mat.block_names)
+    # file object so savez doesn't add its own extension
+    with open(ctx_mat_path, 'wb') as npz_file:
+        np.savez_compressed(npz_file,
+                            row_lbls=np.array(row_lbls),
+                            col_lbls=np.array(col_lbls),
+                            **block_npa_dct)
+
+
+# returns (row_roi_name_npa, col_roi_name_npa, SparseCtxMat), or BlockCtxMat
+#  if written by write_block_ctx_mat
+def read_sparse_ctx_mat(ctx_mat_path):
+    assert os.path.isfile(ctx_mat_path), \
+        "can't find sparse ctx mat {}".format(ctx_mat_path)
+    with open(ctx_mat_path, 'rb') as npz_file:
+        npz = np.load(npz_file)
+        row_roi_name_npa = npz['row_lbls']
+        col_roi_name_npa = npz['col_lbls']
+        if BLOCK_NAMES_KEY in npz.files:
+            blocks = [(block_name,
+                       npz['block_{}_row_idxs'.format(block_idx)],
+                       npz['block_{}_col_idxs'.format(block_idx)],
+                       npz['block_{}_vals'.format(block_idx)])
+                      for (block_idx, block_name) in
+                      enumerate(npz[BLOCK_NAMES_KEY].tolist())]
+            block_ctx_mat = BlockCtxMat(
+                shape=(len(row_roi_name_npa), len(col_roi_name_npa)),
+                blocks=blocks)
+            return (row_roi_name_npa, col_roi_name_npa, block_ctx_mat)
+        sparse_ctx_mat = SparseCtxMat(
+            shape=(len(row_roi_name_npa), len(col_roi_name_npa)),
+            row_idxs=npz['row_idxs'],
+            col_idxs=npz['col_idxs'],
+            vals=npz['vals'])
+    return (row_roi_name_npa, col_roi_name_npa, sparse_ctx_mat)
+
+
+# e.g. 'out/ctx_mat.npy' -> 'out/ctx_mat_lbls.npz'
+def memmap_lbls_path(ctx_mat_path):
+    return cic_io.splitext(ctx_mat_path)[0] + MEMMAP_LBLS_SUFFIX
+
+
+# creates memmap ctx mat of row_lbls x col_lbls float64 zeros and its labels
+#  returns memmap open for writing, flush or del to finish writing
+def create_memmap_ctx_mat(ctx_mat_path, row_lbls, col_lbls):
+    assert is_memmap_ctx_mat(ctx_mat_path), \
+        "memmap ctx mat {} must end with {}".format(
+            ctx_mat_path, MEMMAP_CTX_MAT_EXT)
+    # file object so savez doesn't add its own extension
+    with open(memmap_lbls_path(ctx_mat_path), 'wb') as npz_file:
+        np.savez_compressed(npz_file,
+                            row_lbls=np.array(row_lbls),
+                            col_lbls=np.array(col_lbls))
+    return np.lib.format.open_memmap(ctx_mat_path, mode='w+',
+                                     dtype=np.float64,
+                                     shape=(len(row_lbls), len(col_lbls)))
+
+
+# writes whole ctx_mat_npa as memmap ctx mat
+def write_memmap_ctx_mat(ctx_mat_path, row_lbls, col_lbls, ctx_mat_npa):
+    ctx_mat_memmap = create_memmap_ctx_mat(ctx_mat_path=ctx_mat_path,
+                                           row_lbls=row_lbls,
+                                           col_lbls=col_lbls)
+    ctx_mat_memmap[...] = ctx_mat_npa
+    ctx_mat_memmap.flush()
+
+
+# returns (row_roi_name_npa, col_roi_name_npa, ctx_mat_memmap), memmap read
+#  from disk as it's indexed, mode as np.load mmap_mode
+def open_memmap_ctx_mat(ctx_mat_path, mode='r'):
+    assert os.path.isfile(ctx_mat_path), \
+        "can't find memmap ctx mat {}".format(ctx_mat_path)
+    lbls_path = memmap_lbls_path(ctx_mat_path)
+    assert os.path.isfile(lbls_path), \
+        "can't find labels {} of memmap ctx mat {}".format(lbls_path,
+                                                           ctx_mat_path)
+    with open(lbls_path, 'rb') as npz_file:
+        npz = np.load(npz_file)
+        row_roi_name_npa = npz['row_lbls']
+        col_roi_name_npa = npz['col_lbls']
+    ctx_mat_memmap = np.load(ctx_mat_path, mmap_mode=mode)
+    assert ctx_mat_memmap.shape == (len(row_roi_name_npa),
+                                    len(col_roi_name_npa)), \
+        "memmap ctx mat {} shape {} doesn't match labels {} x {}".format(
+            ctx_mat_path, ctx_mat_memmap.shape, len(row_roi_name_npa),
+            len(col_roi_name_npa))
+    return (row_roi_name_npa, col_roi_name_npa, ctx_mat_memmap)
+
+
+# ctx mat of present cells only, densified on demand whole or by row or col
+#  missing cells are fill_val, scipy.sparse matrices from tocoo/tocsr
+class SparseCtxMat(object):
+    def __init__(self, shape, row_idxs, col_idxs, vals):
+        self.shape = shape
+        self.row_idxs = row_idxs
+        self.col_idxs = col_idxs
+        self.vals = vals
+        # cells sorted by row and row starts, built on first row access
+        self.row_order = None
+        self.row_starts = None
+
+    @property
+    def nnz(self):
+        return len(self.vals)
+
+    def toarray(self, fill_val=0.0):
+        ctx_mat_npa = np.full(self.shape, fill_val, dtype=np.float64)
+        ctx_mat_npa[self.row_idxs, self.col_idxs] = self.vals
+        return ctx_mat_npa
+
+    def row_npa(self, row_idx, fill_val=0.0):
+        if self.row_order is None:
+            self.row_order = np.argsort(self.row_idxs, kind='mergesort')
+            self.row_starts = np.searchsorted(
+                self.row_idxs[self.row_order], np.arange(self.shape[0] + 1))
+        cell_idxs = self.row_order[
+            self.row_starts[row_idx]:self.row_starts[row_idx + 1]]
+        row_npa = np.full(self.shape[1], fill_val, dtype=np.float64)
+        row_npa[self.col_idxs[cell_idxs]] = self.vals[cell_idxs]
+        return row_npa
+
+    def col_npa(self, col_idx, fill_val=0.0):
+        cell_idxs = np.flatnonzero(self.col_idxs == col_idx)
+        col_npa = np.full(self.shape[0], fill_val, dtype=np.float64)
+        col_npa[self.row_idxs[cell_idxs]] = self.vals[cell_idxs]
+        return col_npa
+
+    def tocoo(self):
+        # scipy only needed for scipy matrices
+        from scipy import sparse
+        return sparse.coo_matrix((self.vals, (self.row_idxs, self.col_idxs)),
+                                 shape=self.shape)
+
+    def tocsr(self):
+        return self.tocoo().tocsr()
+
+
+# ctx mat of dense blocks e.g. ant inj site x roi and ret roi x inj site of
+#  combined ctx mat, blocks is [(name, row_idxs, col_idxs, vals), ...] with
+#  vals len(row_idxs) x len(col_idxs) placed at those rows and cols, cells
+#  outside blocks are fill_val, no two blocks share a cell
+class BlockCtxMat(object):
+    def __init__(self, shape, blocks):
+        self.shape = shape
+        self.blocks = [(name,
+                        np.asarray(row_idxs, dtype=np.int64),
+                        np.asarray(col_idxs, dtype=np.int64),
+                        np.asarray(vals, dtype=np.float64).reshape(
+                            len(row_idxs), len(col_idxs)))
+                       for (name, row_idxs, col_idxs, vals) in blocks]
+
+    @property
+    def block_names(self):
+        return [name for (name, _, _, _) in self.blocks]
+
+    @property
+    def nnz(self):
+        return sum([vals.size for (_, _, _, vals) in self.blocks])
+
+    def block(self, name):
+        for block in self.blocks:
+            if block[0] == name:
+                return block
+        assert 0, "no block {} in {}".format(name, self.block_names)
+
+    def toarray(self, fill_val=0.0):
+        ctx_mat_npa = np.full(self.shape, fill_val, dtype=np.float64)
+        for (_, row_idxs, col_idxs, vals) in self.blocks:
+            ctx_mat_npa[np.ix_(row_idxs, col_idxs)] = vals
+        return ctx_mat_npa
+
+    def row_npa(self, row_idx, fill_val=0.0):
+        row_npa = np.full(self.shape[1], fill_val, dtype=np.float64)
+        for (_, row_idxs, col_idxs, vals) in self.blocks:
+            for block_row_idx in np.flatnonzero(row_idxs == row_idx):
+                row_npa[col_idxs] = vals[block_row_idx]
+        return row_npa
+
+    def col_npa(self, col_idx, fill_val=0.0):
+        col_npa = np.full(self.shape[0], fill_val, dtype=np.float64)
+        for (_, row_idxs, col_idxs, vals) in self.blocks:
+            for block_col_idx in np.flatnonzero(col_idxs == col_idx):
+                col_npa[row_idxs] = vals[:, block_col_idx]
+        return col_npa
+
+    def tocoo(self):
+        # scipy only needed for scipy matrices
+        from scipy import sparse
+        # empty arrays so a ctx mat of no blocks concatenates
+        (row_idxs, col_idxs, vals) = ([np.zeros(0, dtype=np.int64)],
+                                      [np.zeros(0, dtype=np.int64)],
+                                      [np.zeros(0, dtype=np.float64)])
+        for (_, block_row_idxs, block_col_idxs, block_vals) in self.blocks:
+            (block_row_grid, block_col_grid) = np.meshgrid(
+                block_row_idxs, block_col_idxs, indexing='ij')
+            row_idxs.append(block_row_grid.ravel())
+            col_idxs.append(block_col_grid.ravel())
+            vals.append(block_vals.ravel())
+        return sparse.coo_matrix(
+            (np.concatenate(vals),
+             (np.concatenate(row_idxs), np.concatenate(col_idxs))),
+            shape=self.shape)
+
+    def tocsr(self):
+        return self.tocoo().tocsr()
+
+
+# square ctx mat of block ctx mat for Louvain, blocks placed straight into it
+#  without densifying the rectangular ctx mat first, rois are row rois if the
+#  same as col rois, otherwise row and col rois sorted, cells outside blocks 0
+#  returns (sq_roi_name_npa, sq_ctx_mat_npa)
+def block_ctx_mat_to_sq(row_roi_name_npa, col_roi_name_npa, block_ctx_mat):
+    if np.array_equal(row_roi_name_npa, col_roi_name_npa):
+        sq_roi_name_npa = np.asarray(row_roi_name_npa)
+    else:
+        sq_roi_name_npa = np.array(sorted(
+            set(row_roi_name_npa.tolist()) | set(col_roi_name_npa.tolist())))
+    sq_idx_dct = dict([(roi, idx) for (idx, roi) in
+                       enumerate(sq_roi_name_npa.tolist())])
+    row_sq_idx_npa = np.array([sq_idx_dct[roi] for roi in
+                               row_roi_name_npa.tolist()], dtype=np.int64)
+    col_sq_idx_npa = np.array([sq_idx_dct[roi] for roi in
+                               col_roi_name_npa.tolist()], dtype=np.int64)
+    sq_ctx_mat_npa = np.zeros((len(sq_roi_name_npa), len(sq_roi_name_npa)),
+                              dtype=np.float64)
+    for (_, row_idxs, col_idxs, vals) in block_ctx_mat.blocks:
+        sq_ctx_mat_npa[np.ix_(row_sq_idx_npa[row_idxs],
+                              col_sq_idx_npa[col_idxs])] = vals
+    return (sq_roi_name_npa, sq_ctx_mat_npa)
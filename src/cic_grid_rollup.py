@@ -0,0 +1,157 @@
+import re
+import numpy as np
+import cic_agg_overlap
+
+# atlas border labels in REGION(S) e.g. BORDER6, border9, not rois
+BORDER_REGION_RE = re.compile('^border[0-9]*$', re.IGNORECASE)
+REGION_SEP = '|'
+
+
+# regions of each grid cell of grid aggregated overlap, rois of all rows of a
+#  cell unioned, border labels dropped, cells repeat across cases and sections
+#  so each distinct (ARA Level, (HEMISPHERE:COLUMN:ROW), REGION(S)) is parsed
+#  once
+#  returns { cell key : frozenset([roi, ...]) }
+def read_cell_regions(agg_overlap_csv_path):
+    (header, rows) = cic_agg_overlap.read_agg_overlap_csv(
+        input_csv_path=agg_overlap_csv_path)
+    records = cic_agg_overlap.agg_overlap_records(
+        header=header,
+        rows=rows,
+        col_names=['ARA Level', '(HEMISPHERE:COLUMN:ROW)', 'REGION(S)'])
+    cell_region_strs = frozenset(
+        [(row.ara_level, row.hemisphere_column_row, row.region_s)
+         for row in records])
+
+    (levels, hemi_bits, col_nums, row_nums, region_strs) = \
+        ([], [], [], [], [])
+    for (ara_level, hemi_col_row, region_str) in cell_region_strs:
+        (hemi, col_num, row_num) = \
+            cic_agg_overlap.parse_hemi_col_row(hemi_col_row)
+        levels.append(ara_level)
+        hemi_bits.append(cic_agg_overlap.CELL_HEMI_BIT_DCT[hemi])
+        col_nums.append(col_num)
+        row_nums.append(row_num)
+        region_strs.append(region_str)
+    cell_keys = cic_agg_overlap.pack_cell_keys(
+        level_npa=levels, hemi_bit_npa=hemi_bits, col_npa=col_nums,
+        row_npa=row_nums)
+
+    cell_region_dct = {}
+    for (cell_key, region_str) in zip(cell_keys.tolist(), region_strs):
+        rois = frozenset([roi for roi in region_str.split(REGION_SEP)
+                          if roi != '' and
+                          BORDER_REGION_RE.match(roi) is None])
+        cell_region_dct[cell_key] = cell_region_dct.get(
+            cell_key, frozenset()) | rois
+    return cell_region_dct
+
+
+# sparse 0/1 assignment matrix of grid_tensor cells, flattened in tensor order
+#  ARA Level x hemisphere x col x row, to the rois in their REGION(S), or to
+#  SC divisions of their SC division regions if by_sc_division, labels
+#  suffixed with _<ARA Level> if add_level, only cells of
+#  hemisphere_of_interest if not None, cells not in grid_tensor are skipped
+#  returns (roi_lbls, scipy.sparse cells x rois csr matrix)
+def roi_assignment(grid_tensor, cell_region_dct, by_sc_division=False,
+                   add_level=False, hemisphere_of_interest=None):
+    # scipy only needed for rollups
+    from scipy import sparse
+    cell_shape = grid_tensor.shape[1:len(grid_tensor.shape)]
+    cell_key_npa = np.array(sorted(cell_region_dct.keys()),
+                            dtype=cic_agg_overlap.CELL_KEY_DTYPE)
+    (level_npa, hemi_bit_npa, col_npa, row_npa) = \
+        cic_agg_overlap.unpack_cell_keys(cell_key_npa)
+    level_idx_npa = np.searchsorted(grid_tensor.ara_levels, level_npa)
+    in_tensor_npa = (level_idx_npa < len(grid_tensor.ara_levels)) & \
+        (col_npa < cell_shape[2]) & (row_npa < cell_shape[3])
+    in_tensor_npa[in_tensor_npa] &= grid_tensor.ara_levels[
+        level_idx_npa[in_tensor_npa]] == level_npa[in_tensor_npa]
+    if hemisphere_of_interest is not None:
+        in_tensor_npa &= hemi_bit_npa == cic_agg_overlap.CELL_HEMI_BIT_DCT[
+            hemisphere_of_interest]
+    cell_idx_npa = np.ravel_multi_index(
+        (level_idx_npa[in_tensor_npa], hemi_bit_npa[in_tensor_npa],
+         col_npa[in_tensor_npa], row_npa[in_tensor_npa]), cell_shape)
+
+    # a cell is assigned to each roi once e.g. SCzo_div1 and SCsg_div1 cell
+    #  to SC.m
+    cell_roi_set = set()
+    for (cell_idx, cell_key, ara_level) in zip(
+            cell_idx_npa.tolist(), cell_key_npa[in_tensor_npa].tolist(),
+            level_npa[in_tensor_npa].tolist()):
+        for roi in cell_region_dct[cell_key]:
+            if by_sc_division:
+                if not cic_agg_overlap.is_sc_division_region(roi):
+                    continue
+                roi_lbl = cic_agg_overlap.sc_division_lbl(roi)
+            else:
+                roi_lbl = roi
+            if add_level:
+                roi_lbl = "{}_{}".format(roi_lbl, ara_level)
+            cell_roi_set.add((cell_idx, roi_lbl))
+
+    roi_lbls = sorted(frozenset([roi_lbl for (_, roi_lbl) in cell_roi_set]))
+    roi_idx_dct = dict([(lbl, idx) for idx, lbl in enumerate(roi_lbls)])
+    cell_idxs = [cell_idx for (cell_idx, _) in cell_roi_set]
+    roi_idxs = [roi_idx_dct[roi_lbl] for (_, roi_lbl) in cell_roi_set]
+    assignment = sparse.csr_matrix(
+        (np.ones(len(cell_idxs), dtype=np.int64), (cell_idxs, roi_idxs)),
+        shape=(int(np.prod(cell_shape)), len(roi_lbls)))
+    return (roi_lbls, assignment)
+
+
+# sums GRID ONLY, OVERLAP and present cells of every inj site of grid_tensor
+#  into rois of assignment with one sparse matmul
+#  returns (grid_only_npa, overlap_npa, present_npa), inj site x roi
+def rollup_grid_tensor(grid_tensor, assignment):
+    num_inj_sites = grid_tensor.shape[0]
+    inj_site_cell_npa = np.vstack((
+        grid_tensor.grid_onlys.reshape(num_inj_sites, -1),
+        grid_tensor.overlaps.reshape(num_inj_sites, -1),
+        grid_tensor.presents.reshape(num_inj_sites, -1).astype(np.int64)))
+    # (rois x cells) . (cells x 3 inj sites), then back to 3 inj sites x rois
+    roi_npa = np.asarray(assignment.T.dot(inj_site_cell_npa.T)).T
+    return (roi_npa[0:num_inj_sites],
+            roi_npa[num_inj_sites:2 * num_inj_sites],
+            roi_npa[2 * num_inj_sites:3 * num_inj_sites] > 0)
+
+
+# ctx mat of rolled up grid_tensor as cic_grid_tensor.accumulate_grid_ctx_mat,
+#  antero inj sites x rois, retro rois x inj sites, row and col labels sorted
+#  as strings
+def roi_ctx_mat(grid_tensor, roi_lbls, grid_only_npa, overlap_npa,
+                present_npa):
+    (inj_site_idxs, roi_idxs) = np.nonzero(present_npa)
+    (row_lbls, col_lbls) = ([], [])
+    for (inj_site_idx, roi_idx) in zip(inj_site_idxs.tolist(),
+                                       roi_idxs.tolist()):
+        inj_site_lbl = grid_tensor.inj_site_lbls[inj_site_idx]
+        if grid_tensor.inj_site_retros[inj_site_idx]:
+            row_lbls.append(roi_lbls[roi_idx])
+            col_lbls.append(inj_site_lbl)
+        else:
+            row_lbls.append(inj_site_lbl)
+            col_lbls.append(roi_lbls[roi_idx])
+    sorted_row_lbls = sorted(frozenset(row_lbls))
+    sorted_col_lbls = sorted(frozenset(col_lbls))
+    row_idx_dct = dict([(lbl, idx) for idx, lbl in enumerate(sorted_row_lbls)])
+    col_idx_dct = dict([(lbl, idx) for idx, lbl in enumerate(sorted_col_lbls)])
+    row_idx_npa = np.array([row_idx_dct[lbl] for lbl in row_lbls],
+                           dtype=np.int64)
+    col_idx_npa = np.array([col_idx_dct[lbl] for lbl in col_lbls],
+                           dtype=np.int64)
+    (mat_idxs, mat_codes) = np.unique(
+        row_idx_npa * len(sorted_col_lbls) + col_idx_npa, return_inverse=True)
+    mat_grid_only_npa = np.zeros(len(mat_idxs), dtype=np.int64)
+    np.add.at(mat_grid_only_npa, mat_codes,
+              grid_only_npa[inj_site_idxs, roi_idxs])
+    mat_overlap_npa = np.zeros(len(mat_idxs), dtype=np.int64)
+    np.add.at(mat_overlap_npa, mat_codes,
+              overlap_npa[inj_site_idxs, roi_idxs])
+    return {'row_lbls': sorted_row_lbls,
+            'col_lbls': sorted_col_lbls,
+            'row_idxs': mat_idxs // len(sorted_col_lbls),
+            'col_idxs': mat_idxs % len(sorted_col_lbls),
+            'grid_onlys': mat_grid_only_npa,
+            'overlaps': mat_overlap_npa}
@@ -0,0 +1,295 @@
+import os
+import csv
+import numpy as np
+import cic_agg_overlap
+import cic_ctx_mat
+import cic_io
+
+GRID_TENSOR_EXT = '.npz'
+# hemisphere axis in cic_agg_overlap.CELL_HEMIS order
+NUM_HEMIS = len(cic_agg_overlap.CELL_HEMIS)
+
+
+# GRID ONLY and OVERLAP of grid aggregated overlap summed in dense tensors of
+#  shape inj site x ARA Level x hemisphere x col x row, present is True where
+#  any row was added, inj sites of antero and retro rows are separate entries
+#  of the inj site axis, told apart by inj_site_retros
+class GridOverlapTensor(object):
+    def __init__(self, inj_site_lbls, inj_site_retros, ara_levels, grid_size,
+                 grid_onlys, overlaps, presents):
+        assert grid_onlys.shape == overlaps.shape == presents.shape
+        assert grid_onlys.shape[0:3] == \
+            (len(inj_site_lbls), len(ara_levels), NUM_HEMIS)
+        self.inj_site_lbls = list(inj_site_lbls)
+        self.inj_site_retros = np.asarray(inj_site_retros, dtype=bool)
+        self.ara_levels = np.asarray(ara_levels, dtype=np.int64)
+        self.grid_size = grid_size
+        self.grid_onlys = grid_onlys
+        self.overlaps = overlaps
+        self.presents = presents
+
+    @property
+    def shape(self):
+        return self.grid_onlys.shape
+
+    # (grid_onlys, overlaps, presents) of ARA Level, inj site x hemisphere x
+    #  col x row
+    def level_slice(self, ara_level):
+        level_idxs = np.flatnonzero(self.ara_levels == ara_level)
+        assert len(level_idxs) == 1, \
+            "ARA Level {} not in grid tensor".format(ara_level)
+        level_idx = level_idxs[0]
+        return (self.grid_onlys[:, level_idx], self.overlaps[:, level_idx],
+                self.presents[:, level_idx])
+
+    # present cells as flat arrays
+    #  returns (inj_site_idxs, cell_keys, grid_onlys, overlaps)
+    def cell_entries(self):
+        (inj_site_idxs, level_idxs, hemi_bits, col_nums, row_nums) = \
+            np.nonzero(self.presents)
+        cell_keys = cic_agg_overlap.pack_cell_keys(
+            level_npa=self.ara_levels[level_idxs],
+            hemi_bit_npa=hemi_bits,
+            col_npa=col_nums,
+            row_npa=row_nums)
+        return (inj_site_idxs, cell_keys, self.grid_onlys[self.presents],
+                self.overlaps[self.presents])
+
+    # tensor of grid factor times coarser, cols and rows block summed factor x
+    #  factor fine cells at a time from col 0, row 0, exact for GRID ONLY and
+    #  OVERLAP as they are pixel counts, coarse cell present if any fine cell
+    #  in its block is
+    def coarsen(self, factor):
+        assert factor >= 1, "coarsen factor must be >= 1"
+        (num_inj_sites, num_levels, num_hemis, num_cols, num_rows) = \
+            self.shape
+        num_coarse_cols = -(-num_cols // factor)
+        num_coarse_rows = -(-num_rows // factor)
+        block_shape = (num_inj_sites, num_levels, num_hemis,
+                       num_coarse_cols, factor, num_coarse_rows, factor)
+
+        def blocks(npa):
+            # pad to whole blocks, padding cells are 0 or not present
+            padded_npa = np.zeros(
+                (num_inj_sites, num_levels, num_hemis,
+                 num_coarse_cols * factor, num_coarse_rows * factor),
+                dtype=npa.dtype)
+            padded_npa[:, :, :, 0:num_cols, 0:num_rows] = npa
+            return padded_npa.reshape(block_shape)
+
+        return GridOverlapTensor(
+            inj_site_lbls=self.inj_site_lbls,
+            inj_site_retros=self.inj_site_retros,
+            ara_levels=self.ara_levels,
+            grid_size=self.grid_size * factor,
+            grid_onlys=blocks(self.grid_onlys).sum(axis=(4, 6)),
+            overlaps=blocks(self.overlaps).sum(axis=(4, 6)),
+            presents=blocks(self.presents).any(axis=(4, 6)))
+
+    # npz format
+    #  { 'inj_site_lbls' : [...], 'inj_site_retros' : [...],
+    #    'ara_levels' : [...], 'grid_size' : n,
+    #    'grid_onlys' : npa, 'overlaps' : npa, 'presents' : npa }
+    def save(self, grid_tensor_path):
+        assert os.path.splitext(grid_tensor_path)[1] == GRID_TENSOR_EXT, \
+            "grid tensor {} must end with {}".format(grid_tensor_path,
+                                                     GRID_TENSOR_EXT)
+        # file object so savez doesn't add its own extension
+        with open(grid_tensor_path, 'wb') as npz_file:
+            np.savez_compressed(npz_file,
+                                inj_site_lbls=np.array(self.inj_site_lbls),
+                                inj_site_retros=self.inj_site_retros,
+                                ara_levels=self.ara_levels,
+                                grid_size=np.array(self.grid_size),
+                                grid_onlys=self.grid_onlys,
+                                overlaps=self.overlaps,
+                                presents=self.presents)
+
+
+def read_grid_tensor(grid_tensor_path):
+    assert os.path.isfile(grid_tensor_path), \
+        "can't find grid tensor {}".format(grid_tensor_path)
+    with open(grid_tensor_path, 'rb') as npz_file:
+        npz = np.load(npz_file)
+        return GridOverlapTensor(
+            inj_site_lbls=npz['inj_site_lbls'].tolist(),
+            inj_site_retros=npz['inj_site_retros'],
+            ara_levels=npz['ara_levels'],
+            grid_size=npz['grid_size'].item(),
+            grid_onlys=npz['grid_onlys'],
+            overlaps=npz['overlaps'],
+            presents=npz['presents'])
+
+
+# sums per row vals into preallocated tensors, one inj site entry per inj site
+#  code and tracer mode, ARA Levels sorted, cols and rows from 0 to max
+#  inj_site_lbls are lbls of inj_site_codes
+def accumulate_grid_tensor(inj_site_lbls, inj_site_codes, retros, ara_levels,
+                           hemi_bits, col_nums, row_nums, grid_onlys,
+                           overlaps, grid_size):
+    (inj_site_keys, inj_site_idxs) = np.unique(
+        np.asarray(inj_site_codes, dtype=np.int64) * 2 + retros,
+        return_inverse=True)
+    (level_npa, level_idxs) = np.unique(ara_levels, return_inverse=True)
+    shape = (len(inj_site_keys), len(level_npa), NUM_HEMIS,
+             np.max(col_nums) + 1 if len(col_nums) > 0 else 0,
+             np.max(row_nums) + 1 if len(row_nums) > 0 else 0)
+    flat_idxs = np.ravel_multi_index(
+        (inj_site_idxs, level_idxs, hemi_bits, col_nums, row_nums), shape)
+    grid_only_npa = np.zeros(shape, dtype=np.int64)
+    np.add.at(grid_only_npa.reshape(-1), flat_idxs, grid_onlys)
+    overlap_npa = np.zeros(shape, dtype=np.int64)
+    np.add.at(overlap_npa.reshape(-1), flat_idxs, overlaps)
+    present_npa = np.zeros(shape, dtype=bool)
+    present_npa.reshape(-1)[flat_idxs] = True
+    return GridOverlapTensor(
+        inj_site_lbls=[inj_site_lbls[key // 2] for key in inj_site_keys],
+        inj_site_retros=inj_site_keys % 2 == 1,
+        ara_levels=level_npa,
+        grid_size=grid_size,
+        grid_onlys=grid_only_npa,
+        overlaps=overlap_npa,
+        presents=present_npa)
+
+
+# ctx mat of present cells of grid_tensor as accumulate_grid_ctx_mat
+def grid_ctx_mat(grid_tensor):
+    (inj_site_idxs, cell_keys, grid_onlys, overlaps) = \
+        grid_tensor.cell_entries()
+    return accumulate_grid_ctx_mat(
+        inj_site_lbls=grid_tensor.inj_site_lbls,
+        inj_site_codes=inj_site_idxs,
+        cell_keys=cell_keys,
+        retros=grid_tensor.inj_site_retros[inj_site_idxs],
+        grid_onlys=grid_onlys,
+        overlaps=overlaps)
+
+
+# sums grid_onlys and overlaps of rows with each (row lbl, col lbl) pair,
+#  antero rows are inj site x grid cell, retro rows grid cell x inj site,
+#  as dct of present cells sorted by row then col
+#  { 'row_lbls' : [...], 'col_lbls' : [...], 'row_idxs' : npa,
+#    'col_idxs' : npa, 'grid_onlys' : npa, 'overlaps' : npa }
+#  row lbls sorted as strings, col lbls grid cells by level, hemi, col, row
+#  i.e. by key, then inj sites, cell labels are only made for cells present
+def accumulate_grid_ctx_mat(inj_site_lbls, inj_site_codes, cell_keys, retros,
+                            grid_onlys, overlaps):
+    (cell_key_npa, cell_codes) = np.unique(cell_keys, return_inverse=True)
+    cell_lbl_npa = np.array(cic_agg_overlap.cell_key_lbls(cell_key_npa),
+                            dtype=object)
+    inj_site_lbl_npa = np.array(inj_site_lbls, dtype=object)
+    anteros = ~retros
+    antero_inj_sites = np.flatnonzero(np.bincount(
+        inj_site_codes[anteros], minlength=len(inj_site_lbl_npa)))
+    antero_cells = np.flatnonzero(np.bincount(
+        cell_codes[anteros], minlength=len(cell_key_npa)))
+    retro_inj_sites = np.flatnonzero(np.bincount(
+        inj_site_codes[retros], minlength=len(inj_site_lbl_npa)))
+    retro_cells = np.flatnonzero(np.bincount(
+        cell_codes[retros], minlength=len(cell_key_npa)))
+
+    # row idx of each antero inj site and retro cell, in sorted row lbls
+    row_lbl_npa = np.concatenate((inj_site_lbl_npa[antero_inj_sites],
+                                  cell_lbl_npa[retro_cells]))
+    row_order = np.argsort(row_lbl_npa, kind='mergesort')
+    row_rank_npa = np.empty(len(row_order), dtype=np.int64)
+    row_rank_npa[row_order] = np.arange(len(row_order))
+    inj_site_row_idxs = np.full(len(inj_site_lbl_npa), -1, dtype=np.int64)
+    inj_site_row_idxs[antero_inj_sites] = \
+        row_rank_npa[0:len(antero_inj_sites)]
+    cell_row_idxs = np.full(len(cell_key_npa), -1, dtype=np.int64)
+    cell_row_idxs[retro_cells] = \
+        row_rank_npa[len(antero_inj_sites):len(row_rank_npa)]
+
+    # col idx of each antero cell, already in key order, then retro inj sites
+    inj_site_col_order = np.argsort(inj_site_lbl_npa[retro_inj_sites],
+                                    kind='mergesort')
+    col_lbl_npa = np.concatenate((
+        cell_lbl_npa[antero_cells],
+        inj_site_lbl_npa[retro_inj_sites[inj_site_col_order]]))
+    cell_col_idxs = np.full(len(cell_key_npa), -1, dtype=np.int64)
+    cell_col_idxs[antero_cells] = np.arange(len(antero_cells))
+    inj_site_col_idxs = np.full(len(inj_site_lbl_npa), -1, dtype=np.int64)
+    inj_site_col_idxs[retro_inj_sites[inj_site_col_order]] = \
+        len(antero_cells) + np.arange(len(retro_inj_sites))
+
+    row_idxs = np.where(retros, cell_row_idxs[cell_codes],
+                        inj_site_row_idxs[inj_site_codes])
+    col_idxs = np.where(retros, inj_site_col_idxs[inj_site_codes],
+                        cell_col_idxs[cell_codes])
+    (mat_idxs, mat_codes) = np.unique(row_idxs * len(col_lbl_npa) + col_idxs,
+                                      return_inverse=True)
+    grid_only_npa = np.zeros(len(mat_idxs), dtype=np.int64)
+    np.add.at(grid_only_npa, mat_codes, grid_onlys)
+    overlap_npa = np.zeros(len(mat_idxs), dtype=np.int64)
+    np.add.at(overlap_npa, mat_codes, overlaps)
+    return {'row_lbls': row_lbl_npa[row_order].tolist(),
+            'col_lbls': col_lbl_npa.tolist(),
+            'row_idxs': mat_idxs // len(col_lbl_npa),
+            'col_idxs': mat_idxs % len(col_lbl_npa),
+            'grid_onlys': grid_only_npa,
+            'overlaps': overlap_npa}
+
+
+# overlap / (grid only + overlap) of present cells of grid_ctx_mat
+def grid_ctx_mat_vals(grid_ctx_mat):
+    total_npa = grid_ctx_mat['grid_onlys'] + grid_ctx_mat['overlaps']
+    assert np.all(total_npa > 0), "GRID ONLY + OVERLAP of cells must be > 0"
+    return grid_ctx_mat['overlaps'].astype(np.float64) / \
+        total_npa.astype(np.float64)
+
+
+# cells not present are blank
+def write_grid_ctx_mat_csv(ctx_mat_path, grid_ctx_mat):
+    col_lbls = grid_ctx_mat['col_lbls']
+    row_starts = np.searchsorted(
+        grid_ctx_mat['row_idxs'],
+        np.arange(len(grid_ctx_mat['row_lbls']) + 1)).tolist()
+    col_idxs = grid_ctx_mat['col_idxs'].tolist()
+    vals = grid_ctx_mat_vals(grid_ctx_mat).tolist()
+    with cic_io.open_file(ctx_mat_path, 'wb') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        # need initial blank for header
+        csvwriter.writerow([''] + col_lbls)
+        for (row_idx, row_lbl) in enumerate(grid_ctx_mat['row_lbls']):
+            cols = [''] * len(col_lbls)
+            for mat_idx in xrange(row_starts[row_idx],
+                                  row_starts[row_idx + 1]):
+                cols[col_idxs[mat_idx]] = vals[mat_idx]
+            csvwriter.writerow([row_lbl] + cols)
+
+
+# writes only present cells, same vals as csv, no blank cells
+def write_sparse_grid_ctx_mat(ctx_mat_path, grid_ctx_mat):
+    cic_ctx_mat.write_sparse_ctx_mat(ctx_mat_path=ctx_mat_path,
+                                     row_lbls=grid_ctx_mat['row_lbls'],
+                                     col_lbls=grid_ctx_mat['col_lbls'],
+                                     row_idxs=grid_ctx_mat['row_idxs'],
+                                     col_idxs=grid_ctx_mat['col_idxs'],
+                                     vals=grid_ctx_mat_vals(grid_ctx_mat))
+
+
+# writes dense memmap ctx mat, cells not present 0, scattered straight into
+#  the memmap so the dense matrix is never in memory
+def write_memmap_grid_ctx_mat(ctx_mat_path, grid_ctx_mat):
+    ctx_mat_memmap = cic_ctx_mat.create_memmap_ctx_mat(
+        ctx_mat_path=ctx_mat_path,
+        row_lbls=grid_ctx_mat['row_lbls'],
+        col_lbls=grid_ctx_mat['col_lbls'])
+    ctx_mat_memmap[grid_ctx_mat['row_idxs'], grid_ctx_mat['col_idxs']] = \
+        grid_ctx_mat_vals(grid_ctx_mat)
+    ctx_mat_memmap.flush()
+
+
+# csv, compressed or not, or sparse ctx mat if path ends with .npz, memmap
+#  ctx mat if .npy
+def write_grid_ctx_mat(ctx_mat_path, grid_ctx_mat):
+    if cic_ctx_mat.is_sparse_ctx_mat(ctx_mat_path):
+        write_sparse_grid_ctx_mat(ctx_mat_path=ctx_mat_path,
+                                  grid_ctx_mat=grid_ctx_mat)
+    elif cic_ctx_mat.is_memmap_ctx_mat(ctx_mat_path):
+        write_memmap_grid_ctx_mat(ctx_mat_path=ctx_mat_path,
+                                  grid_ctx_mat=grid_ctx_mat)
+    else:
+        write_grid_ctx_mat_csv(ctx_mat_path=ctx_mat_path,
+                               grid_ctx_mat=grid_ctx_mat)
@@ -0,0 +1,70 @@
+import os
+import gzip
+import bz2
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# compressed file extensions and stdlib classes that open them, streaming
+#  so memory stays flat whatever the size of the csv
+COMPRESSED_OPEN_DCT = {'.gz': gzip.GzipFile,
+                       '.bz2': bz2.BZ2File}
+try:
+    import lzma
+    COMPRESSED_OPEN_DCT['.xz'] = lzma.LZMAFile
+except ImportError:
+    pass
+BLOCK_SIZE = 1 << 20
+
+
+# compression extension of path, None if not compressed
+def compressed_ext(path):
+    ext = os.path.splitext(path)[1].lower()
+    return ext if ext in COMPRESSED_OPEN_DCT else None
+
+
+def is_compressed(path):
+    return compressed_ext(path) is not None
+
+
+# like os.path.splitext, with any compression extension kept in ext
+#  e.g. 'a/b.csv.gz' -> ('a/b', '.csv.gz')
+def splitext(path):
+    ext = compressed_ext(path)
+    if ext is None:
+        return os.path.splitext(path)
+    (root, csv_ext) = os.path.splitext(path[0:len(path) - len(ext)])
+    return (root, csv_ext + path[len(path) - len(ext):len(path)])
+
+
+# opens path for reading or writing, compressing or decompressing as it
+#  streams if path has compressed extension, mode as for open
+def open_file(path, mode='rb'):
+    ext = compressed_ext(path)
+    if ext is None:
+        return open(path, mode)
+    # compressed files are always binary, 'a' appends a new gzip member
+    mode = mode.replace('b', '') + 'b'
+    assert not (ext == '.bz2' and mode.startswith('a')), \
+        "can't append to {}".format(path)
+    return COMPRESSED_OPEN_DCT[ext](path, mode)
+
+
+# path of uncompressed copy of path, for readers that only take a path,
+#  decompressed in blocks to a temp file removed on exit, path itself if not
+#  compressed
+@contextmanager
+def decompressed_path(path):
+    if not is_compressed(path):
+        yield path
+        return
+    ext = compressed_ext(path)
+    (fd, temp_path) = tempfile.mkstemp(
+        suffix=os.path.splitext(path[0:len(path) - len(ext)])[1])
+    try:
+        with os.fdopen(fd, 'wb') as dst_file:
+            with open_file(path, 'rb') as src_file:
+                shutil.copyfileobj(src_file, dst_file, BLOCK_SIZE)
+        yield temp_path
+    finally:
+        os.remove(temp_path)
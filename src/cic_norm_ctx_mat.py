@@ -0,0 +1,187 @@
+import numpy as np
+
+# anterograde ctx mats are normalized by row, inj site, retrograde by col
+TRACER_MODE_AXIS_DCT = {'anterograde': 1,
+                        'retrograde': 0}
+NORM_STRATEGIES = ['max_total', 'min_max', 'z_score', 'log1p']
+# max_total values clipped to this by default, anterograde only as before
+MAX_TOTAL_CLIP_DCT = {'anterograde': 1.0,
+                      'retrograde': None}
+VAL_BYTES = np.dtype(np.float64).itemsize
+
+
+# tracer mode of ctx mat path, simple method, retrograde if 'ret' in path
+def tracer_mode_of(ctx_mat_path):
+    return 'retrograde' if 'ret' in ctx_mat_path else 'anterograde'
+
+
+# totals of each row (anterograde) or col (retrograde) in one reduction, cols
+#  summed contiguous so each total is pairwise summed as np.sum of the col
+def line_totals(ctx_mat_npa, tracer_mode):
+    if TRACER_MODE_AXIS_DCT[tracer_mode] == 0:
+        return np.ascontiguousarray(ctx_mat_npa.T).sum(axis=1)
+    return ctx_mat_npa.sum(axis=1)
+
+
+# max total line, first of equal totals, and factor each line is multiplied
+#  by to reach max total, 0 for lines totalling 0
+#  returns (max_idx, max_total, fact_npa)
+def max_total_facts(total_npa):
+    max_idx = int(np.argmax(total_npa))
+    max_total = total_npa[max_idx]
+    fact_npa = np.zeros(total_npa.shape, dtype=np.float64)
+    np.divide(float(max_total), total_npa, out=fact_npa,
+              where=total_npa != 0)
+    fact_npa[max_idx] = 1.0
+    return (max_idx, max_total, fact_npa)
+
+
+# (n,) per line npa as rows (ret) or cols (ant) npa to broadcast over ctx mat
+def line_npa(npa, tracer_mode):
+    if TRACER_MODE_AXIS_DCT[tracer_mode] == 1:
+        return npa.reshape(-1, 1)
+    return npa.reshape(1, -1)
+
+
+# index of line idx of ctx mat, row (ant) or col (ret)
+def line_slice(idx, tracer_mode):
+    if TRACER_MODE_AXIS_DCT[tracer_mode] == 1:
+        return (idx, slice(None))
+    return (slice(None), idx)
+
+
+# rows in chunk_mb MB of ctx mat with num_cols cols, at least 1
+def chunk_rows_of(chunk_mb, num_cols):
+    return max(1, int(chunk_mb * (1 << 20)) // max(1, num_cols * VAL_BYTES))
+
+
+# (start, stop) of each chunk of chunk_rows rows, one chunk if None
+def row_chunks(num_rows, chunk_rows=None):
+    if chunk_rows is None:
+        chunk_rows = max(1, num_rows)
+    return [(start, min(start + chunk_rows, num_rows))
+            for start in xrange(0, num_rows, chunk_rows)]
+
+
+# per line stats strategy normalizes with, ctx mat read chunk_rows rows at a
+#  time so it can be a memmap bigger than memory, rows are whole in a chunk so
+#  anterograde stats come from one chunk each, retrograde ones are combined
+#  over chunks
+#  max_total: {'total', 'max_idx', 'max_total', 'fact'}
+#  min_max: {'min', 'range'}
+#  z_score: {'mean', 'std'}
+#  log1p: {}
+def norm_stats(ctx_mat_npa, tracer_mode, strategy, chunk_rows=None):
+    assert strategy in NORM_STRATEGIES, \
+        "invalid strategy {}, expected one of {}".format(strategy,
+                                                         NORM_STRATEGIES)
+    if strategy == 'log1p':
+        return {}
+    axis = TRACER_MODE_AXIS_DCT[tracer_mode]
+    chunks = row_chunks(num_rows=ctx_mat_npa.shape[0], chunk_rows=chunk_rows)
+
+    # per line npa of chunk_fn of each chunk, concatenated if by row,
+    #  combined with combine_fn if by col
+    def reduce_chunks(chunk_fn, combine_fn):
+        line_npas = [chunk_fn(np.asarray(ctx_mat_npa[start:stop],
+                                         dtype=np.float64))
+                     for (start, stop) in chunks]
+        if len(line_npas) == 0:
+            return np.zeros(ctx_mat_npa.shape[1 - axis], dtype=np.float64)
+        if axis == 1:
+            return np.concatenate(line_npas)
+        return reduce(combine_fn, line_npas)
+
+    if strategy == 'max_total':
+        total_npa = reduce_chunks(
+            lambda chunk_npa: line_totals(chunk_npa, tracer_mode), np.add)
+        (max_idx, max_total, fact_npa) = max_total_facts(total_npa)
+        return {'total': total_npa, 'max_idx': max_idx,
+                'max_total': max_total, 'fact': fact_npa}
+    if strategy == 'min_max':
+        min_npa = reduce_chunks(lambda chunk_npa: chunk_npa.min(axis=axis),
+                                np.minimum)
+        max_npa = reduce_chunks(lambda chunk_npa: chunk_npa.max(axis=axis),
+                                np.maximum)
+        return {'min': min_npa, 'range': max_npa - min_npa}
+    # z_score
+    if axis == 1:
+        return {'mean': reduce_chunks(
+                    lambda chunk_npa: chunk_npa.mean(axis=1), None),
+                'std': reduce_chunks(
+                    lambda chunk_npa: chunk_npa.std(axis=1), None)}
+    # cols span chunks, mean first then squared deviations from it
+    num_vals = float(ctx_mat_npa.shape[0])
+    mean_npa = reduce_chunks(
+        lambda chunk_npa: line_totals(chunk_npa, tracer_mode), np.add) / \
+        num_vals
+    sq_dev_npa = reduce_chunks(
+        lambda chunk_npa: line_totals((chunk_npa - mean_npa) ** 2,
+                                      tracer_mode), np.add)
+    return {'mean': mean_npa, 'std': np.sqrt(sq_dev_npa / num_vals)}
+
+
+# normalized rows start to start + len(chunk_npa) of ctx mat, stats of
+#  norm_stats of the whole ctx mat
+#  max_total: each line scaled to total of max total line
+#  min_max: each line to (val - min) / (max - min), 0 if max == min
+#  z_score: each line to (val - mean) / std, 0 if std 0
+#  log1p: log(1 + val) of each val
+#  values clipped to clip if not None, max total line never clipped
+def norm_chunk(chunk_npa, start, stats, tracer_mode, strategy, clip=None):
+    axis = TRACER_MODE_AXIS_DCT[tracer_mode]
+    chunk_npa = np.asarray(chunk_npa, dtype=np.float64)
+    lines = slice(start, start + chunk_npa.shape[0]) if axis == 1 \
+        else slice(None)
+
+    def chunk_line_npa(stat):
+        return line_npa(stats[stat][lines], tracer_mode)
+
+    if strategy == 'max_total':
+        norm_chunk_npa = chunk_npa * chunk_line_npa('fact')
+    elif strategy == 'min_max':
+        min_npa = chunk_line_npa('min')
+        range_npa = chunk_line_npa('range')
+        norm_chunk_npa = np.zeros(chunk_npa.shape, dtype=np.float64)
+        np.divide(chunk_npa - min_npa, range_npa, out=norm_chunk_npa,
+                  where=np.broadcast_to(range_npa != 0, chunk_npa.shape))
+    elif strategy == 'z_score':
+        std_npa = chunk_line_npa('std')
+        norm_chunk_npa = np.zeros(chunk_npa.shape, dtype=np.float64)
+        np.divide(chunk_npa - chunk_line_npa('mean'), std_npa,
+                  out=norm_chunk_npa,
+                  where=np.broadcast_to(std_npa != 0, chunk_npa.shape))
+    else:  # log1p
+        norm_chunk_npa = np.log1p(chunk_npa)
+
+    if clip is not None:
+        np.minimum(norm_chunk_npa, clip, out=norm_chunk_npa)
+        if strategy == 'max_total':
+            # row idx within chunk (ant) or col idx (ret)
+            max_idx = stats['max_idx'] - (start if axis == 1 else 0)
+            if 0 <= max_idx < norm_chunk_npa.shape[1 - axis]:
+                norm_chunk_npa[line_slice(max_idx, tracer_mode)] = \
+                    chunk_npa[line_slice(max_idx, tracer_mode)]
+    return norm_chunk_npa
+
+
+# normalized ctx mat as norm_chunk, ctx_mat_npa read and out written
+#  chunk_rows rows at a time so both can be memmaps bigger than memory, whole
+#  ctx mat at once if chunk_rows None, stats of norm_stats computed if None
+#  returns out, new array if None
+def norm_ctx_mat(ctx_mat_npa, tracer_mode, strategy='max_total', clip=None,
+                 out=None, chunk_rows=None, stats=None):
+    if stats is None:
+        stats = norm_stats(ctx_mat_npa=ctx_mat_npa, tracer_mode=tracer_mode,
+                           strategy=strategy, chunk_rows=chunk_rows)
+    if out is None:
+        out = np.empty(ctx_mat_npa.shape, dtype=np.float64)
+    for (start, stop) in row_chunks(num_rows=ctx_mat_npa.shape[0],
+                                    chunk_rows=chunk_rows):
+        out[start:stop] = norm_chunk(chunk_npa=ctx_mat_npa[start:stop],
+                                     start=start,
+                                     stats=stats,
+                                     tracer_mode=tracer_mode,
+                                     strategy=strategy,
+                                     clip=clip)
+    return out
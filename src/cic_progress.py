@@ -0,0 +1,66 @@
+from __future__ import print_function
+import sys
+import time
+
+# minimum seconds between progress updates
+MIN_INTERVAL = 0.5
+
+
+# reports progress through total items on one terminal line, with rate and
+#  ETA, at most every min_interval seconds, disabled if stream is not a tty
+#  so logs of batch jobs don't fill up with progress lines
+class ProgressReporter(object):
+    def __init__(self, total, unit='rows', min_interval=MIN_INTERVAL,
+                 stream=None, enabled=None):
+        self.stream = sys.stdout if stream is None else stream
+        if enabled is None:
+            enabled = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.enabled = enabled
+        self.total = total
+        self.unit = unit
+        self.min_interval = min_interval
+        self.start_time = time.time()
+        self.next_time = self.start_time + min_interval
+
+    # count is number of items done so far
+    def update(self, count):
+        if not self.enabled:
+            return
+        now = time.time()
+        if now < self.next_time:
+            return
+        self.next_time = now + self.min_interval
+        self.write(count=count, now=now)
+
+    def done(self):
+        if not self.enabled:
+            return
+        self.write(count=self.total, now=time.time())
+        print(file=self.stream)
+
+    def write(self, count, now):
+        elapsed = now - self.start_time
+        rate = count / elapsed if elapsed > 0 else 0.0
+        pct = 100.0 * count / self.total if self.total > 0 else 100.0
+        if count >= self.total:
+            eta_str = "0s"
+        elif rate > 0:
+            eta_str = secs_str((self.total - count) / rate)
+        else:
+            eta_str = "?"
+        # trailing spaces clear end of a previous longer line
+        self.stream.write("\r{0:0.2f}% complete... {1:.0f} {2}/s, "
+                          "ETA {3}    ".format(pct, rate, self.unit, eta_str))
+        self.stream.flush()
+
+
+# e.g. 3725.0 -> '1h02m05s'
+def secs_str(secs):
+    secs = int(round(secs))
+    (mins, secs) = divmod(secs, 60)
+    (hours, mins) = divmod(mins, 60)
+    if hours > 0:
+        return "{}h{:02d}m{:02d}s".format(hours, mins, secs)
+    if mins > 0:
+        return "{}m{:02d}s".format(mins, secs)
+    return "{}s".format(secs)
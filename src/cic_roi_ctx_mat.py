@@ -0,0 +1,281 @@
+from __future__ import print_function
+import os
+import numpy as np
+from array import array
+import cic_agg_overlap
+import cic_progress
+
+
+# tracer mode from name of roi aggregated overlap csv
+def tracer_mode_of(input_agg_overlap_csv):
+    return "retrograde" if 'ret' in input_agg_overlap_csv else "anterograde"
+
+
+# accumulates rows passing row filters of variant args as src, dst label
+#  codes and vals, summed into matrices once all rows are added
+class CtxMatAccumulator(object):
+    # args that decide which rows are added and their labels, -mtv and -raw
+    #  only change what is written
+    @staticmethod
+    def key(variant_args):
+        return tuple([variant_args['hemisphere_of_interest']] +
+                     [None if variant_args[x] is None else
+                      tuple(variant_args[x]) for x in
+                      ['exclude_sections', 'exclusively_include_rois']] +
+                     [variant_args['by_sc_division'],
+                      variant_args['add_level']])
+
+    def __init__(self, variant_args, tracer_mode):
+        self.hemisphere_of_interest = variant_args['hemisphere_of_interest']
+        self.exclude_sections = variant_args['exclude_sections']
+        eir = variant_args['exclusively_include_rois']
+        self.eir_matcher = None if not eir else \
+            cic_agg_overlap.RoiIncludeMatcher(include_rois=eir)
+        self.by_division = variant_args['by_sc_division']
+        self.add_level = variant_args['add_level']
+        self.tracer_mode = tracer_mode
+        # src and dst labels factorized to codes in order first seen
+        #  { lbl : code }
+        self.src_code_dct = {}
+        self.dst_code_dct = {}
+        # per row codes and vals, summed into matrices after all rows
+        self.src_codes = array('l')
+        self.dst_codes = array('l')
+        self.source_onlys = array('l')
+        self.overlaps = array('l')
+        self.mats = None
+
+    def add(self, row, hemi):
+        inj_site = row.injection_site
+        level = row.ara_level
+        roi = row.region
+
+        # only make and add lbl to dct if mtv overlap present and
+        #  hemi of interest or not checking hemi and
+        #  not excluding sections or section not excluded
+        #  not roi exclusive or roi included
+        if ((self.hemisphere_of_interest is None or
+             hemi == self.hemisphere_of_interest) and
+            (not self.exclude_sections or
+             "{}:{}".format(row.case_name, row.slide_number) not in
+             self.exclude_sections) and
+            (self.eir_matcher is None or
+             self.eir_matcher.includes(roi))):
+            # ^^^ check for exact match e.g. VISal_2/3 or == VISal_2/3
+            # or that e.g. MO matches MOp but not MOB ^^^
+            # first make 'roi' cell label
+            if self.by_division:
+                roi_lbl = cic_agg_overlap.sc_division_lbl(roi)
+            else:
+                roi_lbl = "{}".format(roi)
+
+            # if True, append level to roi_lbl
+            if self.add_level:
+                roi_lbl = "{}_{}".format(roi_lbl, level)
+
+            # src labels are matrix rows, dst labels cols
+            #  anterograde { 'Injection Site' : { roi_lbl : ... } }
+            #  retrograde { roi_lbl : { 'Injection Site' : ... } }
+            if self.tracer_mode == 'anterograde':
+                (src_lbl, dst_lbl) = (inj_site, roi_lbl)
+            elif self.tracer_mode == 'retrograde':
+                (src_lbl, dst_lbl) = (roi_lbl, inj_site)
+            else:
+                assert 0, 'Tracer type should either be antro or retrograde'
+
+            self.src_codes.append(self.src_code_dct.setdefault(
+                src_lbl, len(self.src_code_dct)))
+            self.dst_codes.append(self.dst_code_dct.setdefault(
+                dst_lbl, len(self.dst_code_dct)))
+            self.source_onlys.append(row.atlas_only)
+            self.overlaps.append(row.overlap)
+
+    # pickled e.g. back from a Pool worker with matrices summed and per row
+    #  codes and vals dropped
+    def __getstate__(self):
+        self.ctx_mats()
+        state = dict(self.__dict__)
+        for name in ['src_codes', 'dst_codes', 'source_onlys', 'overlaps']:
+            state[name] = array('l')
+        return state
+
+    # returns (present_mat, source_only_mat, overlap_mat) of added rows,
+    #  summed on first call
+    def ctx_mats(self):
+        if self.mats is None:
+            self.mats = accumulate_ctx_mat(
+                src_codes=np.frombuffer(self.src_codes, dtype=np.int_),
+                dst_codes=np.frombuffer(self.dst_codes, dtype=np.int_),
+                source_onlys=np.frombuffer(self.source_onlys, dtype=np.int_),
+                overlaps=np.frombuffer(self.overlaps, dtype=np.int_),
+                num_src=len(self.src_code_dct),
+                num_dst=len(self.dst_code_dct))
+        return self.mats
+
+
+# one pass over roi aggregated overlap csv, adding each row to each of
+#  accumulators, variant_args_lst only for verbose output, progress not shown
+#  if not show_progress e.g. when other inputs are read at the same time
+def accumulate_agg_overlap_csv(input_agg_overlap_csv, tracer_mode,
+                               accumulators, variant_args_lst,
+                               multi_atlas=False, verbose=False,
+                               show_progress=True):
+    if verbose:
+        print("Using tracer mode {}".format(tracer_mode))
+
+    assert os.path.exists(input_agg_overlap_csv), "{} not found".\
+        format(input_agg_overlap_csv)
+
+    (agg_overlap_csv_header, agg_overlap_rows) = \
+        cic_agg_overlap.read_agg_overlap_csv(
+            input_csv_path=input_agg_overlap_csv)
+    assert 'Grid Size' not in agg_overlap_csv_header
+    agg_overlap_records = cic_agg_overlap.agg_overlap_records(
+        header=agg_overlap_csv_header,
+        rows=agg_overlap_rows,
+        col_names=['Atlas Name', 'Atlas Version', 'Overlap Format',
+                   'Slide Number', 'Case Name', 'Injection Site',
+                   'OVERLAP', 'ARA Level', 'REGION', 'ATLAS ONLY'],
+        optional_col_names=['(HEMISPHERE:R:G:B)'])
+
+    if verbose:
+        print("Calculating connectivity matrix from {} agg overlap rows".
+              format(len(agg_overlap_rows)))
+        for variant_args in variant_args_lst:
+            exclude_sections = variant_args['exclude_sections']
+            eir = variant_args['exclusively_include_rois']
+            if exclude_sections is not None:
+                print("Excluding {} sections: {}".format(
+                    len(exclude_sections), exclude_sections))
+            if eir is not None:
+                print("Including only {} sections: {}".format(len(eir), eir))
+
+    progress = cic_progress.ProgressReporter(
+        total=len(agg_overlap_rows), enabled=None if show_progress else False)
+    for row_idx, row in enumerate(agg_overlap_records):
+        # get constant vals, assume
+        # Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap Format
+        #   Tracer are the same for all rows
+        if row_idx == 0:
+            ATLAS_NAME = row.atlas_name
+            ATLAS_VERSION = row.atlas_version
+            OVERLAP_FORMAT = row.overlap_format
+            assert OVERLAP_FORMAT == 'Region'
+
+        # march through rows
+        # for assertion
+        atlas_name = row.atlas_name
+        atlas_version = row.atlas_version
+        overlap_format = row.overlap_format
+
+        # assert these are always the same
+        #   Atlas Name, Atlas Version, Channel Number, Grid Size, Overlap
+        # Format
+        if multi_atlas:
+            if atlas_name != ATLAS_NAME:
+                print("WARNING: Multiple atlases detected: {}, {}".format(
+                    atlas_name, ATLAS_NAME))
+        else:
+            assert atlas_name == ATLAS_NAME
+        assert atlas_version == ATLAS_VERSION, "{} does not equal {}".format(
+            atlas_version, ATLAS_VERSION)
+        assert overlap_format == OVERLAP_FORMAT
+
+        # Need to support overlap data without hemisphere included
+        #  if is included then set hemi normally
+        if '(HEMISPHERE:R:G:B)' in agg_overlap_csv_header:
+            hemi_etc = row.hemisphere_r_g_b
+            hemi = hemi_etc.split(':')[0].replace('(', '')
+        #  else if no hemi included then set hemi to None
+        elif 'REGION RGB' in agg_overlap_csv_header:
+            hemi = None
+        else:
+            assert None, "invalid overlap format"
+
+        for accumulator in accumulators:
+            accumulator.add(row=row, hemi=hemi)
+
+        progress.update(row_idx + 1)
+    progress.done()
+
+
+# src and dst labels of accumulated matrices to write, labels with max
+#  overlap of each ROI > mtv, ant max of mat_olp_calc, ret max of overlap
+#  returns (src_lbls, dst_lbls) sorted
+def mtv_lbls(accumulator, tracer_mode, mtv, verbose=False):
+    src_code_dct = accumulator.src_code_dct
+    dst_code_dct = accumulator.dst_code_dct
+    (present_mat, source_only_mat, overlap_mat) = accumulator.ctx_mats()
+    src_lbl_set = frozenset(src_code_dct.keys())
+    dst_lbl_set = frozenset(dst_code_dct.keys())
+
+    # only get labels with > max intensity, in ant case these are output rois
+    #  by max overlap of each ROI, ant max of mat_olp_calc
+    if tracer_mode == 'anterograde':
+        assert np.all((source_only_mat + overlap_mat > 0)[present_mat]), \
+            "WARNING: cell has no source or overlap"
+        max_roi_olp_npa = max_present(
+            mat_npa=mat_olp_calc_npa(source_only_npa=source_only_mat,
+                                     overlap_npa=overlap_mat),
+            present_mat=present_mat,
+            axis=0)
+        src_lbls = sorted(src_lbl_set)
+        dst_lbls = sorted([lbl for lbl in dst_lbl_set if
+                           max_roi_olp_npa[dst_code_dct[lbl]] > mtv])
+
+        if verbose:
+            print("Filtered\n{} with mtv {}...".format(
+                sorted(dst_lbl_set), mtv))
+            print("result\n{}".format(dst_lbls))
+
+    else:  # retrograde
+        max_roi_olp_npa = max_present(mat_npa=overlap_mat,
+                                      present_mat=present_mat,
+                                      axis=1)
+        src_lbls = sorted([lbl for lbl in src_lbl_set if
+                           max_roi_olp_npa[src_code_dct[lbl]] > mtv])
+        dst_lbls = sorted(dst_lbl_set)
+
+        if verbose:
+            print("Filtered\n{} with mtv {}...".format(
+                sorted(src_lbl_set), mtv))
+            print("result\n{}".format(src_lbls[1:len(src_lbls)]))
+
+    return (src_lbls, dst_lbls)
+
+
+# mat_olp_calc of whole arrays, 0 where source_only + overlap is 0
+def mat_olp_calc_npa(source_only_npa, overlap_npa):
+    total_npa = (source_only_npa + overlap_npa).astype(np.float64)
+    return np.divide(overlap_npa.astype(np.float64), total_npa,
+                     out=np.zeros(total_npa.shape, dtype=np.float64),
+                     where=total_npa > 0)
+
+
+# returns (present_mat, source_only_mat, overlap_mat), num_src x num_dst
+#  sums of source_onlys and overlaps of rows with each src, dst code pair,
+#  present_mat True for pairs with at least one row
+def accumulate_ctx_mat(src_codes, dst_codes, source_onlys, overlaps,
+                       num_src, num_dst):
+    num_cells = num_src * num_dst
+    if num_cells == 0:
+        # no rows kept, bincount minlength must be positive before numpy 1.14
+        return (np.zeros((num_src, num_dst), dtype=bool),
+                np.zeros((num_src, num_dst), dtype=np.int64),
+                np.zeros((num_src, num_dst), dtype=np.int64))
+    cell_idxs = src_codes * num_dst + dst_codes
+    present_mat = np.bincount(cell_idxs, minlength=num_cells) > 0
+    source_only_mat = np.zeros(num_cells, dtype=np.int64)
+    np.add.at(source_only_mat, cell_idxs, source_onlys)
+    overlap_mat = np.zeros(num_cells, dtype=np.int64)
+    np.add.at(overlap_mat, cell_idxs, overlaps)
+    return (present_mat.reshape((num_src, num_dst)),
+            source_only_mat.reshape((num_src, num_dst)),
+            overlap_mat.reshape((num_src, num_dst)))
+
+
+# max along axis of mat_npa over present cells, at least 0
+def max_present(mat_npa, present_mat, axis):
+    if mat_npa.size == 0:
+        return np.zeros(mat_npa.shape[1 - axis], dtype=np.float64)
+    return np.where(present_mat, mat_npa, 0).max(axis=axis)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import csv
+import os
+import cic_ctx_mat
+import cic_io
+import cPickle as pickle
+from cic_dis import cic_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts connectivity matrix between csv, sparse or "
+        "block .npz and memory mapped .npy, e.g. to read .npz or .npy back as "
+        "csv")
+    parser.add_argument('-i', '--input_ctx_mat',
+                        help='Input connectivity matrix csv, sparse or block '
+                        'matrix .npz or memory mapped matrix .npy',
+                        required=True)
+    parser.add_argument('-o', '--output_ctx_mat',
+                        help='Output connectivity matrix csv, or memory '
+                        'mapped matrix if it ends with .npy',
+                        required=True)
+    parser.add_argument('-v', '--verbose',
+                        help='Print extra information about conversion',
+                        action='store_true')
+
+    # READ ARGS
+    args = vars(parser.parse_args())
+
+    input_ctx_mat = args['input_ctx_mat']
+    output_ctx_mat = args['output_ctx_mat']
+    verbose = args['verbose']
+
+    assert os.path.isfile(input_ctx_mat), "{} not found".\
+        format(input_ctx_mat)
+    assert not cic_ctx_mat.is_sparse_ctx_mat(output_ctx_mat), \
+        "can't write sparse ctx mat {}".format(output_ctx_mat)
+
+    # sparse or block ctx mat written with its present cells only, dense with
+    #  all
+    if cic_ctx_mat.is_sparse_ctx_mat(input_ctx_mat) and \
+            not cic_ctx_mat.is_memmap_ctx_mat(output_ctx_mat):
+        (row_roi_name_npa, col_roi_name_npa, sparse_ctx_mat) = \
+            cic_ctx_mat.read_sparse_ctx_mat(input_ctx_mat)
+        write_sparse_ctx_mat_csv(ctx_mat_path=output_ctx_mat,
+                                 row_roi_name_npa=row_roi_name_npa,
+                                 col_roi_name_npa=col_roi_name_npa,
+                                 sparse_ctx_mat=sparse_ctx_mat)
+    else:
+        (row_roi_name_npa, col_roi_name_npa, ctx_mat_npa) = \
+            cic_ctx_mat.read_ctx_mat(input_ctx_mat)
+        if cic_ctx_mat.is_memmap_ctx_mat(output_ctx_mat):
+            cic_ctx_mat.write_memmap_ctx_mat(ctx_mat_path=output_ctx_mat,
+                                             row_lbls=row_roi_name_npa,
+                                             col_lbls=col_roi_name_npa,
+                                             ctx_mat_npa=ctx_mat_npa)
+        else:
+            write_ctx_mat_csv(ctx_mat_path=output_ctx_mat,
+                              row_roi_name_npa=row_roi_name_npa,
+                              col_roi_name_npa=col_roi_name_npa,
+                              ctx_mat_npa=ctx_mat_npa)
+
+    if verbose:
+        print("Converted {} x {} ctx mat {} to {}".format(
+            len(row_roi_name_npa), len(col_roi_name_npa), input_ctx_mat,
+            output_ctx_mat))
+
+    output_pickle_path = cic_utils.pickle_path(output_ctx_mat)
+    pickle_dct = cic_utils.pickle_dct(args)
+    pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
+
+
+# writes every cell, python floats so csv writes them as the converters do
+def write_ctx_mat_csv(ctx_mat_path, row_roi_name_npa, col_roi_name_npa,
+                      ctx_mat_npa):
+    with cic_io.open_file(ctx_mat_path, 'wb') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        # need initial blank for header
+        csvwriter.writerow([''] + col_roi_name_npa.tolist())
+        for (row_idx, row_lbl) in enumerate(row_roi_name_npa.tolist()):
+            csvwriter.writerow([row_lbl] + ctx_mat_npa[row_idx].tolist())
+
+
+# writes present cells only, cells not present blank, cells of blocks
+#  present if block ctx mat
+def write_sparse_ctx_mat_csv(ctx_mat_path, row_roi_name_npa, col_roi_name_npa,
+                             sparse_ctx_mat):
+    row_lbls = row_roi_name_npa.tolist()
+    cols_lst = [[''] * len(col_roi_name_npa) for _ in row_lbls]
+    if isinstance(sparse_ctx_mat, cic_ctx_mat.BlockCtxMat):
+        for (_, row_idxs, col_idxs, vals) in sparse_ctx_mat.blocks:
+            for (row_idx, row_vals) in zip(row_idxs.tolist(), vals.tolist()):
+                for (col_idx, val) in zip(col_idxs.tolist(), row_vals):
+                    cols_lst[row_idx][col_idx] = val
+    else:
+        for (row_idx, col_idx, val) in zip(sparse_ctx_mat.row_idxs.tolist(),
+                                           sparse_ctx_mat.col_idxs.tolist(),
+                                           sparse_ctx_mat.vals.tolist()):
+            cols_lst[row_idx][col_idx] = val
+    with cic_io.open_file(ctx_mat_path, 'wb') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        # need initial blank for header
+        csvwriter.writerow([''] + col_roi_name_npa.tolist())
+        for (row_lbl, cols) in zip(row_lbls, cols_lst):
+            csvwriter.writerow([row_lbl] + cols)
+
+
+if __name__ == '__main__':
+    main()
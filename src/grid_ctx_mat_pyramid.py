@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import cic_grid_tensor
+import cic_io
+import cPickle as pickle
+from cic_dis import cic_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Converts grid tensor of fine grid aggregated overlap to "
+        "connectivity matrices of coarser grids, block summing GRID ONLY and "
+        "OVERLAP of fine cells, no re-export or re-aggregating per Grid Size")
+    parser.add_argument('-i', '--input_grid_tensor',
+                        help='Input grid tensor .npz, from '
+                        'agg_grid_overlap_to_ctx_mat.py -ot',
+                        required=True)
+    parser.add_argument('-o', '--output_ctx_mat_csv',
+                        help='Output path for connectivity matrix csvs, '
+                        'sparse matrices if it ends with .npz, or memory '
+                        'mapped matrices if .npy, _grid-<Grid Size> is added '
+                        'for each factor',
+                        required=True)
+    parser.add_argument('-f', '--factors',
+                        help='Coarsen factors, each fine Grid Size times '
+                        'factor e.g. -f 1 2 4',
+                        type=int,
+                        nargs='+',
+                        required=True)
+    parser.add_argument('-v', '--verbose',
+                        help='Print extra information about conversion',
+                        action='store_true')
+
+    # READ ARGS
+    args = vars(parser.parse_args())
+
+    input_grid_tensor = args['input_grid_tensor']
+    output_ctx_mat_csv = args['output_ctx_mat_csv']
+    factors = args['factors']
+    verbose = args['verbose']
+
+    assert all([factor >= 1 for factor in factors]), \
+        "factors must be >= 1: {}".format(factors)
+
+    grid_tensor = cic_grid_tensor.read_grid_tensor(input_grid_tensor)
+    if verbose:
+        print("Read grid tensor {}, Grid Size {}, inj site x ARA Level x "
+              "hemisphere x col x row {}".format(
+                  input_grid_tensor, grid_tensor.grid_size,
+                  grid_tensor.shape))
+
+    for factor in sorted(set(factors)):
+        coarse_grid_tensor = grid_tensor.coarsen(factor)
+        ctx_mat_path = pyramid_ctx_mat_path(
+            ctx_mat_path=output_ctx_mat_csv,
+            grid_size=coarse_grid_tensor.grid_size)
+        grid_ctx_mat = cic_grid_tensor.grid_ctx_mat(coarse_grid_tensor)
+        cic_grid_tensor.write_grid_ctx_mat(ctx_mat_path=ctx_mat_path,
+                                           grid_ctx_mat=grid_ctx_mat)
+        if verbose:
+            print("Wrote Grid Size {} ctx mat {}, {} x {}".format(
+                coarse_grid_tensor.grid_size, ctx_mat_path,
+                len(grid_ctx_mat['row_lbls']), len(grid_ctx_mat['col_lbls'])))
+
+        output_pickle_path = cic_utils.pickle_path(ctx_mat_path)
+        pickle_dct = cic_utils.pickle_dct(
+            dict(args, factor=factor, grid_size=coarse_grid_tensor.grid_size))
+        pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
+
+
+# e.g. ('out/ctx_mat.csv.gz', 700) -> 'out/ctx_mat_grid-700.csv.gz'
+def pyramid_ctx_mat_path(ctx_mat_path, grid_size):
+    (root, ext) = cic_io.splitext(ctx_mat_path)
+    return "{}_grid-{}{}".format(root, grid_size, ext)
+
+
+if __name__ == '__main__':
+    main()
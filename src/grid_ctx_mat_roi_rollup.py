@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import argparse
+import os
+import cic_grid_rollup
+import cic_grid_tensor
+import cPickle as pickle
+from cic_dis import cic_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rolls grid tensor of grid aggregated overlap up to roi "
+        "or SC division connectivity matrix csv, cells assigned to rois of "
+        "their REGION(S), no separate roi aggregated overlap needed")
+    parser.add_argument('-i', '--input_agg_overlap_csv',
+                        help='Input grid aggregated overlap csv, for '
+                        'REGION(S) of cells',
+                        required=True)
+    parser.add_argument('-it', '--input_grid_tensor',
+                        help='Input grid tensor .npz of the same aggregated '
+                        'overlap, from agg_grid_overlap_to_ctx_mat.py -ot',
+                        required=True)
+    parser.add_argument('-o', '--output_ctx_mat_csv',
+                        help='Output path for connectivity matrix csv, '
+                        'sparse matrix if it ends with .npz, or memory '
+                        'mapped matrix if .npy',
+                        required=True)
+    parser.add_argument('-hemi', '--hemisphere_of_interest',
+                        help='exclusively include listed hemisphere in output')
+    parser.add_argument('-div', '--by_sc_division',
+                        help='Aggregate by division, instead of actual rois',
+                        action='store_true')
+    parser.add_argument('-lvl', '--add_level',
+                        help='Add level information to roi label',
+                        action='store_true')
+    parser.add_argument('-v', '--verbose',
+                        help='Print extra information about conversion',
+                        action='store_true')
+
+    # READ ARGS
+    args = vars(parser.parse_args())
+
+    input_agg_overlap_csv = args['input_agg_overlap_csv']
+    input_grid_tensor = args['input_grid_tensor']
+    output_ctx_mat_csv = args['output_ctx_mat_csv']
+    hemisphere_of_interest = args['hemisphere_of_interest']
+    by_sc_division = args['by_sc_division']
+    add_level = args['add_level']
+    verbose = args['verbose']
+
+    assert os.path.exists(input_agg_overlap_csv), "{} not found".\
+        format(input_agg_overlap_csv)
+
+    grid_tensor = cic_grid_tensor.read_grid_tensor(input_grid_tensor)
+    cell_region_dct = cic_grid_rollup.read_cell_regions(input_agg_overlap_csv)
+    (roi_lbls, assignment) = cic_grid_rollup.roi_assignment(
+        grid_tensor=grid_tensor,
+        cell_region_dct=cell_region_dct,
+        by_sc_division=by_sc_division,
+        add_level=add_level,
+        hemisphere_of_interest=hemisphere_of_interest)
+    if verbose:
+        print("Assigned {} cells of {} to {} {}".format(
+            len(cell_region_dct), input_agg_overlap_csv, len(roi_lbls),
+            'SC divisions' if by_sc_division else 'rois'))
+
+    (grid_only_npa, overlap_npa, present_npa) = \
+        cic_grid_rollup.rollup_grid_tensor(grid_tensor=grid_tensor,
+                                           assignment=assignment)
+    grid_ctx_mat = cic_grid_rollup.roi_ctx_mat(grid_tensor=grid_tensor,
+                                               roi_lbls=roi_lbls,
+                                               grid_only_npa=grid_only_npa,
+                                               overlap_npa=overlap_npa,
+                                               present_npa=present_npa)
+    cic_grid_tensor.write_grid_ctx_mat(ctx_mat_path=output_ctx_mat_csv,
+                                       grid_ctx_mat=grid_ctx_mat)
+    if verbose:
+        print("Wrote ctx mat {}, {} x {}".format(
+            output_ctx_mat_csv, len(grid_ctx_mat['row_lbls']),
+            len(grid_ctx_mat['col_lbls'])))
+
+    output_pickle_path = cic_utils.pickle_path(output_ctx_mat_csv)
+    pickle_dct = cic_utils.pickle_dct(args)
+    pickle.dump(pickle_dct, open(output_pickle_path, "wb"))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,140 +1,234 @@
 #!/usr/bin/env python
 from __future__ import print_function
 import argparse
+import glob
 import os
+import shlex
 import cPickle as pickle
 from cic_dis import cic_utils
+import cic_io
+import cic_ctx_mat
+import cic_norm_ctx_mat
 import csv
+import numpy as np
+from multiprocessing import Pool
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Normalizes connectivity matrix")
     parser.add_argument('-i', '--input_ctx_mat_csv',
-                        help='Input connectivity matrix csv',
-                        required=True)
+                        help='Input connectivity matrix csv, or memory '
+                        'mapped matrix .npy')
     parser.add_argument('-o', '--output_ctx_mat_csv',
-                        help='Output path for normalized ctx mat csv',
-                        required=True)
+                        help='Output path for normalized ctx mat csv, or '
+                        'memory mapped matrix if it ends with .npy')
+    parser.add_argument('-ib', '--input_batch',
+                        help='Batch of input ctx mat csvs normalized in one '
+                        'process, wildcard e.g. "mats/*.csv" or manifest '
+                        '.txt of one input per line, optionally followed by '
+                        'its output path')
+    parser.add_argument('-ot', '--output_template',
+                        help='Output path of each batch input without one in '
+                        'manifest, {dir}, {name} and {ext} of input replaced '
+                        'e.g. "norm/{name}_norm{ext}"')
+    parser.add_argument('-ns', '--num_slots',
+                        help='Number of slots to use for normalizing batch',
+                        type=int, default=1)
+    parser.add_argument('-s', '--strategy',
+                        help='Normalization of each row (anterograde) or col '
+                        '(retrograde), scaled to max total, min-max, z-score, '
+                        'or log1p of each value',
+                        choices=cic_norm_ctx_mat.NORM_STRATEGIES,
+                        default='max_total')
+    parser.add_argument('-clip', '--clip',
+                        help='Clip normalized values to this max, default 1.0 '
+                        'for anterograde max_total, max total row or col '
+                        'never clipped',
+                        type=float)
+    parser.add_argument('-cmb', '--chunk_mb',
+                        help='MB of rows of memory mapped .npy input read '
+                        'and written at a time, output must also be .npy',
+                        type=float, default=64.0)
     parser.add_argument('-v', '--verbose',
                         help='Print extra information about normalization',
                         action='store_true')
 
     args = vars(parser.parse_args())
 
+    input_batch = args['input_batch']
+    num_slots = args['num_slots']
+    verbose = args['verbose']
+
+    if input_batch is None:
+        assert args['input_ctx_mat_csv'] is not None and \
+            args['output_ctx_mat_csv'] is not None, \
+            "-i and -o required without -ib"
+        norm_ctx_mat_csv(args)
+        return
+
+    assert args['input_ctx_mat_csv'] is None and \
+        args['output_ctx_mat_csv'] is None, "-i and -o can't be used with -ib"
+    job_args_lst = [dict(args, input_ctx_mat_csv=input_csv_path,
+                         output_ctx_mat_csv=output_ctx_mat_csv)
+                    for (input_csv_path, output_ctx_mat_csv) in
+                    batch_jobs(input_batch=input_batch,
+                               output_template=args['output_template'])]
+    if verbose:
+        print("normalizing {} ctx mats of {} with {} slots".format(
+            len(job_args_lst), input_batch, num_slots))
+
+    # each ctx mat independent, one job per ctx mat
+    if num_slots > 1:
+        pool = Pool(min(num_slots, len(job_args_lst)))
+        pool.map(norm_ctx_mat_csv, job_args_lst)
+        pool.close()
+        pool.join()
+    else:
+        for job_args in job_args_lst:
+            norm_ctx_mat_csv(job_args)
+
+
+# (input, output) paths of batch, sorted wildcard matches with output of
+#  output_template, or manifest lines, output of output_template if not on
+#  line, blank lines and lines starting with # skipped
+def batch_jobs(input_batch, output_template):
+    if input_batch.endswith('.txt') and os.path.isfile(input_batch):
+        io_path_lsts = []
+        with open(input_batch, 'rb') as manifest_file:
+            for line in manifest_file:
+                if len(line.strip()) > 0 and not line.strip().startswith('#'):
+                    io_path_lsts.append(shlex.split(line))
+    else:
+        # sort glob for consistency of test results
+        io_path_lsts = [[input_csv_path] for input_csv_path in
+                        sorted(glob.glob(input_batch))]
+    assert len(io_path_lsts) > 0, \
+        "no input csv files in {}".format(input_batch)
+
+    io_paths = []
+    for io_path_lst in io_path_lsts:
+        assert len(io_path_lst) in [1, 2], \
+            "expected input and optional output, got {}".format(io_path_lst)
+        input_csv_path = io_path_lst[0]
+        if len(io_path_lst) == 2:
+            output_ctx_mat_csv = io_path_lst[1]
+        else:
+            assert output_template is not None, \
+                "-ot required for {} without output path".format(
+                    input_csv_path)
+            output_ctx_mat_csv = batch_output_path(
+                input_csv_path=input_csv_path,
+                output_template=output_template)
+        assert output_ctx_mat_csv != input_csv_path, \
+            "output would overwrite input {}".format(input_csv_path)
+        io_paths.append((input_csv_path, output_ctx_mat_csv))
+
+    output_paths = [output_path for (_, output_path) in io_paths]
+    assert len(set(output_paths)) == len(output_paths), \
+        "batch outputs not unique: {}".format(output_paths)
+    return io_paths
+
+
+# e.g. ('mats/ret_ctx_mat.csv.gz', 'norm/{name}_norm{ext}') ->
+#  'norm/ret_ctx_mat_norm.csv.gz'
+def batch_output_path(input_csv_path, output_template):
+    (root, ext) = cic_io.splitext(input_csv_path)
+    return output_template.format(dir=os.path.dirname(root),
+                                  name=os.path.basename(root),
+                                  ext=ext)
+
+
+# normalizes input ctx mat csv of args to output ctx mat csv of args, writes
+#  its pickle, top level so Pool can pickle it
+def norm_ctx_mat_csv(args):
     input_csv_path = args['input_ctx_mat_csv']
     output_ctx_mat_csv = args['output_ctx_mat_csv']
-    tracer_mode = 'anterograde'
+    strategy = args['strategy']
     verbose = args['verbose']
 
     # check input path is actually valid
     assert os.path.isfile(input_csv_path),\
         "can't find input csv file {}".format(input_csv_path)
 
-    # OPEN, READ INPUT CSV
+    # OPEN, READ INPUT CSV, memmap ctx mat only read chunk_mb at a time
     if verbose:
         print("reading {}".format(input_csv_path))
-    (row_roi_name_npa, col_roi_name_npa, ctx_mat_npa) = \
-        cic_utils.read_ctx_mat(input_csv_path)
+    if cic_ctx_mat.is_memmap_ctx_mat(input_csv_path):
+        assert cic_ctx_mat.is_memmap_ctx_mat(output_ctx_mat_csv), \
+            "memory mapped input {} needs {} output, got {}".format(
+                input_csv_path, cic_ctx_mat.MEMMAP_CTX_MAT_EXT,
+                output_ctx_mat_csv)
+        (row_roi_name_npa, col_roi_name_npa, ctx_mat_npa) = \
+            cic_ctx_mat.open_memmap_ctx_mat(input_csv_path)
+        chunk_rows = cic_norm_ctx_mat.chunk_rows_of(
+            chunk_mb=args['chunk_mb'], num_cols=len(col_roi_name_npa))
+        if verbose:
+            print("normalizing {} x {} in chunks of {} rows".format(
+                len(row_roi_name_npa), len(col_roi_name_npa), chunk_rows))
+    else:
+        (row_roi_name_npa, col_roi_name_npa, ctx_mat_npa) = \
+            cic_ctx_mat.read_ctx_mat(input_csv_path)
+        chunk_rows = None
 
     # use a simple method to determine if anterograde or retrograde
     #  more importantly, operate on rows or columns accordingly
-    if 'ret' in input_csv_path:
-        tracer_mode = 'retrograde'
-
-    if tracer_mode == 'anterograde':
-        # get max row
-        max_row_idx = -1
-        max_total = -1
-        for idx in xrange(len(row_roi_name_npa)):
-            if(cic_utils.row_total(ctx_mat_npa=ctx_mat_npa, idx=idx) >
-               max_total):
-                max_row_idx = idx
-                max_total = cic_utils.row_total(ctx_mat_npa=ctx_mat_npa,
-                                                idx=idx)
+    tracer_mode = cic_norm_ctx_mat.tracer_mode_of(input_csv_path)
+    clip = args['clip']
+    if clip is None and strategy == 'max_total':
+        clip = cic_norm_ctx_mat.MAX_TOTAL_CLIP_DCT[tracer_mode]
+    stats = cic_norm_ctx_mat.norm_stats(ctx_mat_npa=ctx_mat_npa,
+                                        tracer_mode=tracer_mode,
+                                        strategy=strategy,
+                                        chunk_rows=chunk_rows)
+
+    if strategy == 'max_total':
+        (line, lbl_npa) = ('row', row_roi_name_npa) \
+            if tracer_mode == 'anterograde' else ('col', col_roi_name_npa)
+        (total_npa, max_idx, fact_npa) = \
+            (stats['total'], stats['max_idx'], stats['fact'])
         if verbose:
-            print("Found row {} as max total sum with {}".format(
-                row_roi_name_npa[max_row_idx], max_total))
-
-    if tracer_mode == 'retrograde':
-        # get max col
-        max_col_idx = -1
-        max_total = -1
-        for idx in xrange(len(col_roi_name_npa)):
-            if(cic_utils.col_total(ctx_mat_npa=ctx_mat_npa, idx=idx) >
-               max_total):
-                max_col_idx = idx
-                max_total = cic_utils.col_total(ctx_mat_npa=ctx_mat_npa,
-                                                idx=idx)
+            print("Found {} {} as max total sum with {}".format(
+                line, lbl_npa[max_idx], stats['max_total']))
+        for _ in np.flatnonzero(total_npa == 0):
+            print("WARNING: Nonesense for now, 0 division, {}_total".format(
+                line))
         if verbose:
-            print("Found col {} as max total sum with {}".format(
-                col_roi_name_npa[max_col_idx], max_total))
-
-    with open(output_ctx_mat_csv, 'wb') as csvfile:
-        csvwriter = csv.writer(csvfile)
-
-        if tracer_mode == 'anterograde':
+            for idx in xrange(len(lbl_npa)):
+                if idx != max_idx:
+                    print("Normalizing {} {} total {} with factor {}".format(
+                        lbl_npa[idx], line, total_npa[idx], fact_npa[idx]))
+
+    if cic_ctx_mat.is_memmap_ctx_mat(output_ctx_mat_csv):
+        norm_ctx_mat_memmap = cic_ctx_mat.create_memmap_ctx_mat(
+            ctx_mat_path=output_ctx_mat_csv,
+            row_lbls=row_roi_name_npa,
+            col_lbls=col_roi_name_npa)
+        cic_norm_ctx_mat.norm_ctx_mat(ctx_mat_npa=ctx_mat_npa,
+                                      tracer_mode=tracer_mode,
+                                      strategy=strategy,
+                                      clip=clip,
+                                      out=norm_ctx_mat_memmap,
+                                      chunk_rows=chunk_rows,
+                                      stats=stats)
+        norm_ctx_mat_memmap.flush()
+        del norm_ctx_mat_memmap
+
+    else:
+        norm_ctx_mat_npa = cic_norm_ctx_mat.norm_ctx_mat(
+            ctx_mat_npa=ctx_mat_npa,
+            tracer_mode=tracer_mode,
+            strategy=strategy,
+            clip=clip,
+            stats=stats)
+
+        with cic_io.open_file(output_ctx_mat_csv, 'wb') as csvfile:
+            csvwriter = csv.writer(csvfile)
             header_row = [''] + list(col_roi_name_npa)
             csvwriter.writerow(header_row)
             for idx in xrange(len(row_roi_name_npa)):
-                # now normalize to max and write
-                if idx != max_row_idx:
-                    row_total = cic_utils.row_total(ctx_mat_npa=ctx_mat_npa,
-                                                    idx=idx)
-                    try:
-                        fact = float(max_total)/float(row_total)
-                    except:
-                        print("WARNING: Nonesense for now, 0 division, row_total")
-                        fact = 0
-
-                    if verbose:
-                        print(
-                            "Normalizing {} row total {} with factor {}".
-                            format(row_roi_name_npa[idx], row_total, fact))
-                    norm_row = cic_utils.row_elem_mult(
-                        ctx_mat_npa=ctx_mat_npa,
-                        idx=idx,
-                        fact=fact,
-                        max_prod=1.0)
-
-                    csvwriter.writerow([row_roi_name_npa[idx]] +
-                                       list(norm_row))
-                else:
-                    csvwriter.writerow([row_roi_name_npa[idx]] +
-                                       list(ctx_mat_npa[idx]))
-
-        elif tracer_mode == 'retrograde':
-            header_row = [''] + list(col_roi_name_npa)
-            csvwriter.writerow(header_row)
-            norm_cols = []
-            for idx in xrange(len(col_roi_name_npa)):
-                # now normalize to max and write
-                if idx != max_col_idx:
-                    col_total = cic_utils.col_total(ctx_mat_npa=ctx_mat_npa,
-                                                    idx=idx)
-                    fact = float(max_total)/float(col_total)
-                    if verbose:
-                        print(
-                            "Normalizing {} col total {} with factor {}".
-                            format(col_roi_name_npa[idx], col_total, fact))
-                    norm_col = cic_utils.col_elem_mult(
-                        ctx_mat_npa=ctx_mat_npa,
-                        idx=idx,
-                        fact=fact,
-                        max_prod=None)  # pass None to prevent max clipping
-                else:
-                    norm_col = ctx_mat_npa[:, idx]
-
-                norm_cols.append(norm_col)
-
-            # zip the columns into rows of len(col_roi_name_npa) length
-            norm_rows = zip(*norm_cols)
-
-            for idx, norm_row in enumerate(norm_rows):
-                csvwriter.writerow([row_roi_name_npa[idx]] + list(norm_row))
-
-        else:
-            assert 0, "invalid mode {}".format(tracer_mode)
+                csvwriter.writerow([row_roi_name_npa[idx]] +
+                                   list(norm_ctx_mat_npa[idx]))
 
     if verbose:
         print("wrote to {}".format(output_ctx_mat_csv))
@@ -4,13 +4,21 @@ from __future__ import print_function
 import argparse
 import csv
 import os
+import tempfile
 import cPickle as pickle
 from cic_dis import cic_utils
+import cic_io
+import cic_ctx_mat
 import bct
+import numpy as np
 import time
 import psutil
 from multiprocessing import Pool
 
+# cols of Louvain csv rows, as written by header
+LOUVAIN_CSV_COLS = ['run', 'q', 'num_communities', 'gamma',
+                    'community_structure']
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -39,6 +47,13 @@ def main():
     parser.add_argument('-wh', '--write_header',
                         help='Write header to file before first line(s)',
                         action="store_true")
+    parser.add_argument('-fe', '--flush_every',
+                        help='Flush output csv every this many Louvain runs',
+                        type=int, default=10)
+    parser.add_argument('-res', '--resume',
+                        help='Keep runs of gamma already in output csv, only '
+                        'run the rest, header kept if there is one',
+                        action='store_true')
     parser.add_argument('-und', '--undirected',
                         help='Specify input matrix as undirected',
                         action='store_true')
@@ -63,10 +78,15 @@ def main():
     num_slots = args['num_slots']
     write_header = args['write_header']
     undirected = args['undirected']
+    flush_every = args['flush_every']
+    resume = args['resume']
+
+    assert flush_every >= 1, \
+        "flush_every must be >= 1: {}".format(flush_every)
 
-    # OPEN, READ INPUT CSV
+    # OPEN, READ INPUT CSV, block ctx mat kept in blocks
     (row_roi_name_npa, col_roi_name_npa, ctx_mat_npa) = \
-        cic_utils.read_ctx_mat(input_csv_path)
+        cic_ctx_mat.read_ctx_mat(input_csv_path, densify_blocks=False)
 
     assert len(col_roi_name_npa) == ctx_mat_npa.shape[1], \
         "ERROR length col_roi_name_npa {} != ctx_mat_npa cols {}". \
@@ -78,10 +98,20 @@ def main():
               format(runs, num_slots, gamma, input_csv_path))
         print("{} CPUs available".format(psutil.cpu_count()))
 
+    # blocks straight into square, never densified rectangular first
+    if isinstance(ctx_mat_npa, cic_ctx_mat.BlockCtxMat):
+        if verbose:
+            print("converting {} blocks {} to square...".format(
+                len(ctx_mat_npa.blocks), ctx_mat_npa.block_names))
+        (roi_name_npa, sq_ctx_mat_npa) = cic_ctx_mat.block_ctx_mat_to_sq(
+            row_roi_name_npa=row_roi_name_npa,
+            col_roi_name_npa=col_roi_name_npa,
+            block_ctx_mat=ctx_mat_npa)
+
     # double check formatting, shape of array
-    if cic_utils.is_sq(row_roi_name_npa=row_roi_name_npa,
-                       col_roi_name_npa=col_roi_name_npa,
-                       ctx_mat_npa=ctx_mat_npa):
+    elif cic_utils.is_sq(row_roi_name_npa=row_roi_name_npa,
+                         col_roi_name_npa=col_roi_name_npa,
+                         ctx_mat_npa=ctx_mat_npa):
         roi_name_npa = row_roi_name_npa
         sq_ctx_mat_npa = ctx_mat_npa
 
@@ -112,112 +142,122 @@ def main():
     cic_utils.dup_check_container(dup_check_roi_container=roi_name_npa,
                                   input_csv_path=input_csv_path)
 
+    # runs already in output csv if resuming, only the rest are scheduled
+    resuming = resume and os.path.isfile(output_csv_path)
+    done_runs = set()
+    if resuming:
+        done_runs = completed_louvain_runs(csv_path=output_csv_path,
+                                           gamma=gamma)
+        if verbose:
+            print("Resuming {}, {} of {} runs done".format(
+                output_csv_path, len(done_runs & set(xrange(1, runs + 1))),
+                runs))
+
     if verbose:
         print("Preparing Louvain arguments...")
 
     # call multithreaded louvain
-    # first create argument list
-    map_arg_lst = [(None, None)] * runs
-    for idx in xrange(runs):
-        map_arg_lst[idx] = (connectivity_matrix_npa, gamma, undirected,
-                            verbose, num_slots)
+    # first create argument list, matrix shared with workers once, each run
+    #  only carries its index
+    map_arg_lst = [idx for idx in xrange(runs) if idx + 1 not in done_runs]
 
     if verbose:
         print("done")
 
-    # generate louvain run arr dict, format
-    # [ { 'run' : run_index + 1,
-    #     'num_communities' : len(community_structure_dict.keys(),
-    #     'q' : q,
-    #     'gamma' : gamma   # redundant but that's better than the alternative
-    #     'community_structure' : community_structure_dict}, ... ]
-    louvain_run_arr_dict = []
+    # each louvain run written as it completes, format
+    # { 'run' : run_index + 1,
+    #   'num_communities' : len(community_structure_dict.keys(),
+    #   'q' : q,
+    #   'gamma' : gamma   # redundant but that's better than the alternative
+    #   'community_structure' : community_structure_dict}
 
     if verbose:
         print("Calling Louvain with {} processes...".format(num_slots))
         start = time.time()
 
-    map_results = []
-    # call louvain
-    # only do multi process thing if greater than 1 thread
-    if num_slots > 1:
-        #  first make process pool
-        if verbose:
-            print("Getting process pool...")
-        pool = Pool(num_slots)
-        if verbose:
-            print("done")
-
-        # map results in parallel
-        map_results = pool.imap_unordered(modularity_louvain_dir_wrapper,
-                                          map_arg_lst)
-
-        # wait for work to finish
-        pool.close()
-        pool.join()
-
-    # otherwise, use single process for call
-    else:
-        for map_arg in map_arg_lst:
-            if undirected:
-                map_results.append(bct.modularity_louvain_und(map_arg[0],
-                                                              map_arg[1]))
-            else:
-                map_results.append(bct.modularity_louvain_dir(map_arg[0],
-                                                              map_arg[1]))
+    # header only for new csv, appended rows follow existing ones if resuming
+    write_header = write_header and not resuming
+    open_mode = 'wb' if write_header else 'a'
+
+    (pool, ctx_mat_path, num_written) = (None, None, 0)
+    try:
+        # call louvain
+        # only do multi process thing if greater than 1 thread
+        if num_slots > 1:
+            # matrix saved once for workers to memory map, not pickled per
+            #  run
+            (ctx_mat_fd, ctx_mat_path) = tempfile.mkstemp(suffix='.npy')
+            os.close(ctx_mat_fd)
+            np.save(ctx_mat_path, connectivity_matrix_npa)
+
+            #  first make process pool
+            if verbose:
+                print("Getting process pool...")
+            pool = Pool(num_slots, initializer=init_louvain_worker,
+                        initargs=(ctx_mat_path, gamma, undirected, verbose,
+                                  num_slots))
+            if verbose:
+                print("done")
+
+            # map results in parallel, yielded in run order so rows are
+            #  written by run index, later runs held until earlier ones finish
+            map_results = pool.imap(modularity_louvain_dir_wrapper,
+                                    map_arg_lst)
+
+        # otherwise, use single process for call
+        else:
+            map_results = ((run_idx,) + modularity_louvain(
+                ctx_mat_npa=connectivity_matrix_npa,
+                gamma=gamma,
+                undirected=undirected) for run_idx in map_arg_lst)
+
+        # march through results and write to CSV in run order
+        with cic_io.open_file(output_csv_path, open_mode) as csvfile:
+            csvwriter = csv.writer(csvfile)
+            for (run_idx, ci, q) in map_results:
+                assert len(ci) == roi_name_npa.size,\
+                    "Uh-oh, found commmunities don't make sense"
+
+                community_structure_dict = \
+                    cic_utils.build_community_structure_dict(
+                        ci=ci,
+                        roi_name_npa=roi_name_npa)
+
+                # create wrapper dict for community structure dict
+                louvain_run_dict = cic_utils.build_louvain_run_dict(
+                    run_index=run_idx,
+                    q=q,
+                    community_structure_dict=community_structure_dict,
+                    gamma=gamma)
+
+                # create key index automatically
+                key_index_arr = sorted(louvain_run_dict.keys(), reverse=True)
+                if write_header:
+                    csvwriter.writerow(key_index_arr)
+                    write_header = False
+                # follow keys defined in key_index_arr
+                csvwriter.writerow([louvain_run_dict[key]
+                                    for key in key_index_arr])
+                num_written += 1
+                if num_written % flush_every == 0:
+                    csvfile.flush()
+
+        if pool is not None:
+            # wait for work to finish
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if ctx_mat_path is not None:
+            os.remove(ctx_mat_path)
 
     if verbose:
         print("done in {:0.06}s".format(time.time() - start))
 
-    # march through results and write to CSV
-    for result_idx, map_result in enumerate(map_results):
-        (ci, q) = map_result
-
-        assert len(ci) == roi_name_npa.size,\
-            "Uh-oh, found commmunities don't make sense"
-
-        community_structure_dict = cic_utils.build_community_structure_dict(
-            ci=ci,
-            roi_name_npa=roi_name_npa)
-
-        # create wrapper dict for community structure dict
-        louvain_run_dict = cic_utils.build_louvain_run_dict(
-            run_index=result_idx,
-            q=q,
-            community_structure_dict=community_structure_dict,
-            gamma=gamma)
-
-        louvain_run_arr_dict.append(louvain_run_dict)
-
-    # WRITE LOUVAIN TO OUTPUT CSV
-    key_index_arr = sorted(
-        louvain_run_arr_dict[0].keys(), reverse=True)
-    # write louvain_run_arr_dict to output_csv_path
-    assert len(louvain_run_arr_dict) > 0,\
+    assert len(done_runs) + num_written > 0,\
         "Your louvain run ain't got no results bro"  # reasonable assumption
 
-    if write_header:
-        with open(output_csv_path, 'wb') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            # create key index automatically
-            csvwriter.writerow(key_index_arr)
-            for m in louvain_run_arr_dict:
-                map_val_arr = []
-                # follow keys defined in key_index_arr
-                for key in key_index_arr:
-                    map_val_arr.append(m[key])
-                csvwriter.writerow(map_val_arr)
-
-    else:
-        with open(output_csv_path, 'a') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            for m in louvain_run_arr_dict:
-                map_val_arr = []
-                # follow keys defined in key_index_arr
-                for key in key_index_arr:
-                    map_val_arr.append(m[key])
-                csvwriter.writerow(map_val_arr)
-
     print("Wrote Louvain results to {}".format(output_csv_path))
 
     output_pickle_path = cic_utils.pickle_path(output_csv_path)
@@ -230,11 +270,61 @@ def main():
             time.strftime("%m-%d-%Y %H:%M:%S", time.gmtime())))
 
 
-def modularity_louvain_dir_wrapper(args):
+# run numbers of complete rows of gamma already in Louvain csv, for resume,
+#  rows are one line each so a last line cut short by a crash isn't counted,
+#  and it is cut from uncompressed csvs so appended rows start on a new line,
+#  cols of header if there is one, otherwise LOUVAIN_CSV_COLS
+def completed_louvain_runs(csv_path, gamma):
+    with cic_io.open_file(csv_path, 'rb') as csvfile:
+        lines = csvfile.readlines()
+    if len(lines) > 0 and not lines[-1].endswith('\n'):
+        partial_line = lines.pop()
+        assert cic_io.compressed_ext(csv_path) is None, \
+            "can't resume {}, last row cut short".format(csv_path)
+        with open(csv_path, 'r+b') as csvfile:
+            csvfile.truncate(os.path.getsize(csv_path) - len(partial_line))
+
+    cols = LOUVAIN_CSV_COLS
+    done_runs = set()
+    for row in csv.reader(lines):
+        if len(row) == 0:
+            continue
+        if row[0] == 'run':
+            cols = row
+            continue
+        if float(row[cols.index('gamma')]) == gamma:
+            done_runs.add(int(row[cols.index('run')]))
+    return done_runs
+
+
+# matrix and args of Louvain runs, set once per worker by init_louvain_worker
+LOUVAIN_WORKER_DCT = {}
+
+
+# pool initializer, memory maps matrix copy on write so workers share its
+#  pages and bct can still write to its own copy
+def init_louvain_worker(ctx_mat_path, gamma, undirected, verbose, num_slots):
+    LOUVAIN_WORKER_DCT['ctx_mat_npa'] = np.load(ctx_mat_path, mmap_mode='c')
+    LOUVAIN_WORKER_DCT['gamma'] = gamma
+    LOUVAIN_WORKER_DCT['undirected'] = undirected
+    LOUVAIN_WORKER_DCT['verbose'] = verbose
+    LOUVAIN_WORKER_DCT['num_slots'] = num_slots
+
+
+# returns (ci, q) of one Louvain run
+def modularity_louvain(ctx_mat_npa, gamma, undirected):
+    if undirected:
+        return bct.modularity_louvain_und(ctx_mat_npa, gamma)
+    else:
+        return bct.modularity_louvain_dir(ctx_mat_npa, gamma)
+
+
+# arg is run index, rest from init_louvain_worker
+#  returns (run index, ci, q)
+def modularity_louvain_dir_wrapper(run_idx):
     # if verbose
-    undirected = args[2]
-    verbose = args[3]
-    num_slots = args[4]
+    verbose = LOUVAIN_WORKER_DCT['verbose']
+    num_slots = LOUVAIN_WORKER_DCT['num_slots']
     p = psutil.Process()
     if verbose:
         print("calling modularity louvain dir at {}".format(
@@ -248,11 +338,10 @@ def modularity_louvain_dir_wrapper(args):
     if verbose:
         print("new CPU affinity {}".format(p.cpu_affinity()))
 
-    only_mod_args = args[0:2]
-    if undirected:
-        return bct.modularity_louvain_und(*only_mod_args)
-    else:
-        return bct.modularity_louvain_dir(*only_mod_args)
+    return (run_idx,) + modularity_louvain(
+        ctx_mat_npa=LOUVAIN_WORKER_DCT['ctx_mat_npa'],
+        gamma=LOUVAIN_WORKER_DCT['gamma'],
+        undirected=LOUVAIN_WORKER_DCT['undirected'])
 
 
 if __name__ == "__main__":
@@ -3,7 +3,7 @@ from __future__ import print_function
 import argparse
 from cic_dis import cic_utils
 from cic_dis import cic_plot
-from cic_dis import cic_overlap
+import cic_agg_overlap
 from cic_dis import cic_outspector
 import time
 import plotly.plotly as py
@@ -26,7 +26,8 @@ def main():
                         'structure ',
                         required=True)
     parser.add_argument('-aoc', '--agg_overlap_csv',
-                        help='Input aggregated overlap csv',
+                        help='Input aggregated overlap csv, or partitioned '
+                        'dir of which only levels are read',
                         required=True)
     parser.add_argument('-lvls', '--levels',
                         help='List of levels to visualize',
@@ -141,7 +142,8 @@ def main():
         print("Opening aggregated overlap csv {}...".format(agg_overlap_csv))
         start = time.time()
     (agg_overlap_csv_header, agg_overlap_rows) = \
-        cic_overlap.read_agg_overlap_csv(input_csv_path=agg_overlap_csv)
+        cic_agg_overlap.read_agg_overlap_csv(input_csv_path=agg_overlap_csv,
+                                             levels=levels)
     if verbose:
         print("opened agg overlap csv in {:.04}s".format(time.time() - start))
         print("num rows {}".format(len(agg_overlap_rows)))